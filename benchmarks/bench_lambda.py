@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+
+"""
+Measure cold start and warm invocation latency of the
+query_all_authservers.py lambda_handler, as a local stand-in for
+Lambda billed duration.
+
+Cold starts are measured in fresh Python processes: the time to
+import the module, and the time of the first handler invocation.
+Warm invocations are repeated handler calls in a single process,
+which reuse the module level caches and connection state.
+
+"""
+
+import os
+import sys
+import getopt
+import json
+import time
+import subprocess
+import contextlib
+import io
+
+PROGNAME = os.path.basename(sys.argv[0])
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLD_RUNS = 5
+WARM_CALLS = 20
+
+
+# Options with initialized defaults
+class Opts:
+    cold_runs = COLD_RUNS
+    warm_calls = WARM_CALLS
+    resolver = None
+    port = None
+    use_async = False
+    tcp_only = False
+
+
+COLD_START_SNIPPET = """\
+import sys, time, json, io, contextlib
+t0 = time.perf_counter()
+sys.path.insert(0, {repo!r})
+import query_all_authservers
+t1 = time.perf_counter()
+sys.path.insert(0, {bench!r})
+import bench_lambda
+bench_lambda.set_resolver({resolver!r})
+bench_lambda.set_port({port!r})
+with contextlib.redirect_stdout(io.StringIO()):
+    query_all_authservers.lambda_handler({event!r}, None)
+t2 = time.perf_counter()
+print(json.dumps({{"import_ms": (t1 - t0) * 1000, "first_call_ms": (t2 - t1) * 1000}}))
+"""
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+    print("""\
+Usage: {0} [Options] <zone> <qname> <qtype>
+
+       Options:
+       -h            Print this help string
+       -n N          Number of cold start runs (default {1})
+       -w N          Number of warm invocations (default {2})
+       -r addr[#port] Resolver to use for NS/address lookups
+       -p port       Port of the authoritative servers (default is the
+                     resolver's port if given with -r, else 53)
+       -a            Invoke handler in async mode
+       -t            Invoke handler in TCP only mode
+""".format(PROGNAME, COLD_RUNS, WARM_CALLS))
+    sys.exit(1)
+
+
+def process_args(arguments):
+    """Process command line arguments"""
+
+    try:
+        (options, args) = getopt.getopt(arguments, "hn:w:r:p:at")
+    except getopt.GetoptError as exc_info:
+        usage(exc_info)
+
+    for (opt, optval) in options:
+        if opt == "-h":
+            usage()
+        elif opt == "-n":
+            Opts.cold_runs = int(optval)
+        elif opt == "-w":
+            Opts.warm_calls = int(optval)
+        elif opt == "-r":
+            Opts.resolver = optval
+        elif opt == "-p":
+            Opts.port = int(optval)
+        elif opt == "-a":
+            Opts.use_async = True
+        elif opt == "-t":
+            Opts.tcp_only = True
+
+    if len(args) != 3:
+        usage("Missing positional arguments. 3 required")
+    if Opts.port is None and Opts.resolver and '#' in Opts.resolver:
+        Opts.port = int(Opts.resolver.partition('#')[2])
+    return args
+
+
+def set_resolver(resolver):
+    """Point the default sync and async resolvers at addr[#port]"""
+
+    if resolver is None:
+        return
+    import dns.resolver
+    import dns.asyncresolver
+    address, _, port = resolver.partition('#')
+    for module in (dns.resolver, dns.asyncresolver):
+        res = module.Resolver(configure=False)
+        res.nameservers = [address]
+        if port:
+            res.port = int(port)
+        module.default_resolver = res
+
+
+def set_port(port):
+    """Set the port query_all_authservers sends server queries to"""
+
+    if port is None:
+        return
+    import query_all_authservers
+    query_all_authservers.PORT = port
+
+
+def summarize(values):
+    """Return min/p50/p95/max/mean summary of list of values"""
+
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        "min": round(values[0], 3),
+        "p50": round(values[len(values) // 2], 3),
+        "p95": round(values[min(len(values) - 1,
+                                int(len(values) * 0.95))], 3),
+        "max": round(values[-1], 3),
+        "mean": round(sum(values) / len(values), 3),
+    }
+
+
+def measure_cold(event):
+    """Measure import and first call latency in fresh processes"""
+
+    snippet = COLD_START_SNIPPET.format(
+        repo=REPO_DIR, bench=os.path.dirname(os.path.abspath(__file__)),
+        resolver=Opts.resolver, port=Opts.port, event=event)
+    imports = []
+    first_calls = []
+    for _ in range(Opts.cold_runs):
+        output = subprocess.run([sys.executable, "-c", snippet],
+                                check=True, capture_output=True,
+                                text=True).stdout
+        timing = json.loads(output.splitlines()[-1])
+        imports.append(timing['import_ms'])
+        first_calls.append(timing['first_call_ms'])
+    return {
+        "import_ms": summarize(imports),
+        "first_call_ms": summarize(first_calls),
+    }
+
+
+def measure_warm(event):
+    """Measure repeated handler invocations in this process"""
+
+    sys.path.insert(0, REPO_DIR)
+    import query_all_authservers
+
+    set_resolver(Opts.resolver)
+    set_port(Opts.port)
+    calls = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        query_all_authservers.lambda_handler(event, None)
+        for _ in range(Opts.warm_calls):
+            start = time.perf_counter()
+            query_all_authservers.lambda_handler(event, None)
+            calls.append((time.perf_counter() - start) * 1000)
+    return {
+        "call_ms": summarize(calls),
+        "cache": query_all_authservers.CACHE.stats(),
+    }
+
+
+if __name__ == '__main__':
+
+    ZONE, QNAME, QTYPE = process_args(sys.argv[1:])
+    EVENT = {"zone": ZONE, "qname": QNAME, "qtype": QTYPE,
+             "async": Opts.use_async, "tcp": Opts.tcp_only}
+    RESULT = {
+        "event": EVENT,
+        "cold": measure_cold(EVENT),
+        "warm": measure_warm(EVENT),
+    }
+    print(json.dumps(RESULT, indent=2))
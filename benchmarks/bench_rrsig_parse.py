@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+#
+
+"""
+Compare the RRSIG expiration ingest of plot-rrsig-expirations.py with
+the original line by line loop (split() and strptime() per record),
+on a synthetic zone in dig AXFR output format, and check that both
+produce the same counts of signatures per day left. The parallel
+memory mapped file path (--input) is timed too, for each requested
+number of worker processes.
+
+"""
+
+import os
+import sys
+import getopt
+import math
+import random
+import tempfile
+import time
+import importlib.util
+from datetime import datetime, timedelta
+from collections import defaultdict, OrderedDict
+
+PROGNAME = os.path.basename(sys.argv[0])
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RECORDS = 1000000
+SIG_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+
+# Options with initialized defaults
+class Opts:
+    records = RECORDS
+    zonefile = None
+    workers = [1, os.cpu_count() or 1]
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+    print("""\
+Usage: {0} [Options]
+
+       Options:
+       -h          Print this help string
+       -n N        Number of records in synthetic zone (default {1})
+       -z file     Use this zone file (dig AXFR format) instead
+       -w N,...    Worker counts for the parallel path (default 1,{2})
+""".format(PROGNAME, RECORDS, os.cpu_count() or 1))
+    sys.exit(1)
+
+
+def process_args(arguments):
+    """Process command line arguments"""
+
+    try:
+        (options, args) = getopt.getopt(arguments, "hn:z:w:")
+    except getopt.GetoptError as exc_info:
+        usage(exc_info)
+
+    for (opt, optval) in options:
+        if opt == "-h":
+            usage()
+        elif opt == "-n":
+            Opts.records = int(optval)
+        elif opt == "-z":
+            Opts.zonefile = optval
+        elif opt == "-w":
+            Opts.workers = [int(n) for n in optval.split(',')]
+    if args:
+        usage("Too many arguments")
+
+
+def load_plot_module():
+    """Import plot-rrsig-expirations.py, which is not a valid module name"""
+
+    spec = importlib.util.spec_from_file_location(
+        "plot_rrsig_expirations",
+        os.path.join(REPO_DIR, "plot-rrsig-expirations.py"))
+    module = importlib.util.module_from_spec(spec)
+    # Registered so that worker processes can unpickle its functions
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_zone(outfile, records):
+    """
+    Write synthetic signed zone of about the given number of records,
+    in dig AXFR output format. Signature expirations are a few hours
+    past a whole number of days from now, away from rounding edges.
+    """
+
+    random.seed(1)
+    now = datetime.utcnow()
+    inception = (now - timedelta(days=1)).strftime(SIG_TIMESTAMP_FORMAT)
+    zone = "example.test."
+    written = 0
+    i = 0
+    while written < records:
+        owner = "host{}.{}".format(i, zone)
+        expire = now + timedelta(days=random.randint(1, 30),
+                                 hours=random.randint(1, 10))
+        expire = expire.strftime(SIG_TIMESTAMP_FORMAT)
+        outfile.write(
+            "{0}\t3600\tIN\tA\t192.0.2.{1}\n"
+            "{0}\t3600\tIN\tRRSIG\tA 13 3 3600 {2} {3} 12345 {4} "
+            "dGhpcyBpcyBub3QgYSByZWFsIHNpZ25hdHVyZSBqdXN0IHBhZGRpbmc=\n"
+            "{0}\t3600\tIN\tNSEC\thost{5}.{4} A RRSIG NSEC\n"
+            "{0}\t3600\tIN\tRRSIG\tNSEC 13 3 3600 {2} {3} 12345 {4} "
+            "dGhpcyBpcyBub3QgYSByZWFsIHNpZ25hdHVyZSBqdXN0IHBhZGRpbmc=\n"
+            .format(owner, i % 256, expire, inception, zone, i + 1))
+        written += 4
+        i += 1
+
+
+def legacy_expiration_dict(infile):
+    """The original getExpirationDict() loop, reading from infile"""
+
+    def getDaysLeft(rrsigExpire):
+        e = datetime.strptime(rrsigExpire, SIG_TIMESTAMP_FORMAT)
+        days_left = (e - datetime.utcnow()).total_seconds() / 86400.0
+        return math.floor(days_left + 0.5)
+
+    counts = defaultdict(int)
+    for line in infile:
+        parts = line.split()
+        if parts[3] == 'RRSIG':
+            days_left = getDaysLeft(parts[8])
+            counts[days_left] += 1
+    return OrderedDict(sorted(counts.items()))
+
+
+def timed(function, *args):
+    """Return result and elapsed seconds of function call"""
+
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    process_args(sys.argv[1:])
+    plot = load_plot_module()
+
+    zonefile = Opts.zonefile
+    if zonefile is None:
+        with tempfile.NamedTemporaryFile('w', suffix='.zone',
+                                         delete=False) as f:
+            write_zone(f, Opts.records)
+            zonefile = f.name
+    size = os.path.getsize(zonefile)
+
+    now = time.time()
+    timings = []
+    parallel = []
+    try:
+        with open(zonefile) as f:
+            old, old_secs = timed(legacy_expiration_dict, f)
+        timings.append(("line loop", old_secs))
+        with open(zonefile, 'rb') as f:
+            histogram, new_secs = timed(plot.getExpirationHistogram, f, now)
+        timings.append(("chunked", new_secs))
+        new = plot.getExpirationDict(histogram)
+        for workers in Opts.workers:
+            result, secs = timed(plot.getExpirationHistogramParallel,
+                                 zonefile, workers, now)
+            timings.append(("mmap x{}".format(workers), secs))
+            parallel.append(plot.getExpirationDict(result))
+    finally:
+        if Opts.zonefile is None:
+            os.unlink(zonefile)
+
+    print("Input: {:.1f} MB, {} signatures".format(size / 1e6,
+                                                   sum(new.values())))
+    print("{:<12} {:>10} {:>10} {:>8}".format("Parser", "Seconds", "MB/s",
+                                              "Speedup"))
+    for name, secs in timings:
+        print("{:<12} {:>10.3f} {:>10.1f} {:>7.1f}x".format(
+            name, secs, size / 1e6 / secs, old_secs / secs))
+    if old != new or any(result != new for result in parallel):
+        print("ERROR: results differ")
+        sys.exit(1)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+#
+
+"""
+Benchmark the DNS probing paths of query_all_authservers.py,
+ip2asn.py and check_bindsigningstatus.py against local authoritative
+server stand-ins (see dns_standin.py), without touching the Internet.
+
+The stand-ins are started in a separate process, so their CPU use
+does not distort the measurements. For every scenario the number of
+operations, throughput, p50/p99 latency, and peak Python memory
+allocation (measured with tracemalloc in a separate, shorter pass)
+are reported.
+
+The stand-ins listen on 127.0.1.x addresses, which works out of the
+box on Linux. On other systems the loopback aliases may need to be
+configured first.
+
+"""
+
+import os
+import sys
+import getopt
+import json
+import time
+import random
+import subprocess
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import dns.rdatatype
+
+import query_all_authservers as qa
+import ip2asn
+import check_bindsigningstatus
+import dns_standin
+import bench_lambda
+
+PROGNAME = os.path.basename(sys.argv[0])
+
+OPERATIONS = 200
+MEMORY_OPERATIONS = 20
+
+
+# Options with initialized defaults
+class Opts:
+    servers = dns_standin.SERVERS
+    port = dns_standin.PORT
+    operations = OPERATIONS
+    latency = 0.0
+    loss = 0.0
+    max_udp = None
+    json = False
+    scenarios = None
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+    print("""\
+Usage: {0} [Options] [scenario ...]
+
+       Options:
+       -h          Print this help string
+       -s N        Number of stand-in servers (default {1})
+       -p port     Stand-in port (default {2})
+       -n N        Operations per scenario (default {3})
+       -l secs     Stand-in response latency (default 0)
+       -L prob     Stand-in UDP loss probability (default 0)
+       -m bytes    Stand-in UDP response size limit
+       -j          Output JSON (default is a text table)
+
+Scenarios (default all): {4}
+""".format(PROGNAME, dns_standin.SERVERS, dns_standin.PORT, OPERATIONS,
+           " ".join(SCENARIOS)))
+    sys.exit(1)
+
+
+def process_args(arguments):
+    """Process command line arguments"""
+
+    try:
+        (options, args) = getopt.getopt(arguments, "hs:p:n:l:L:m:j")
+    except getopt.GetoptError as exc_info:
+        usage(exc_info)
+
+    try:
+        for (opt, optval) in options:
+            if opt == "-h":
+                usage()
+            elif opt == "-s":
+                Opts.servers = int(optval)
+            elif opt == "-p":
+                Opts.port = int(optval)
+            elif opt == "-n":
+                Opts.operations = int(optval)
+            elif opt == "-l":
+                Opts.latency = float(optval)
+            elif opt == "-L":
+                Opts.loss = float(optval)
+            elif opt == "-m":
+                Opts.max_udp = int(optval)
+            elif opt == "-j":
+                Opts.json = True
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
+
+    for scenario in args:
+        if scenario not in SCENARIOS:
+            usage("Unknown scenario: {}".format(scenario))
+    Opts.scenarios = args or list(SCENARIOS)
+
+
+def start_standins():
+    """Start stand-in servers in a subprocess, and wait until ready"""
+
+    command = [sys.executable, os.path.join(BENCH_DIR, "dns_standin.py"),
+               "--servers={}".format(Opts.servers),
+               "--port={}".format(Opts.port),
+               "--latency={}".format(Opts.latency),
+               "--loss={}".format(Opts.loss)]
+    if Opts.max_udp is not None:
+        command.append("--max-udp={}".format(Opts.max_udp))
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line.startswith("Serving"):
+        proc.kill()
+        raise RuntimeError("stand-in servers failed to start")
+    return proc
+
+
+def qa_settings(**kwargs):
+    """Return query_all_authservers settings for the stand-ins"""
+
+    return qa.Settings(ip_rrtypes=[dns.rdatatype.A], **kwargs)
+
+
+def check_qa_result(result):
+    """
+    Raise RuntimeError unless every stand-in answered with NOERROR, as
+    query_all_authservers reports failures as TIMEOUT or ERROR rcodes
+    """
+
+    rcodes = [adict['rcode'] for adict in result['answer']]
+    if len(rcodes) != Opts.servers:
+        raise RuntimeError("{} answers from {} servers".format(
+            len(rcodes), Opts.servers))
+    if any(rcode != "NOERROR" for rcode in rcodes):
+        raise RuntimeError("failed queries: {}".format(",".join(rcodes)))
+
+
+def op_qa_sync():
+    """query_all_authservers serial probing of all servers"""
+
+    check_qa_result(qa.main(dns_standin.ZONE, "www." + dns_standin.ZONE, "A",
+                            settings=qa_settings(use_async=False)))
+
+
+def op_qa_async():
+    """query_all_authservers concurrent probing of all servers"""
+
+    check_qa_result(qa.run_persistent(qa.main_async(
+        dns_standin.ZONE, "www." + dns_standin.ZONE, "A",
+        settings=qa_settings(use_async=True))))
+
+
+def op_qa_tcp():
+    """query_all_authservers over pooled, pipelined TCP connections"""
+
+    check_qa_result(qa.run_persistent(qa.main_async(
+        dns_standin.ZONE, "www." + dns_standin.ZONE, "A",
+        settings=qa_settings(tcp_only=True))))
+
+
+def op_qa_truncated():
+    """query_all_authservers with truncated UDP and TCP fallback"""
+
+    check_qa_result(qa.run_persistent(qa.main_async(
+        dns_standin.ZONE, "big." + dns_standin.ZONE, "TXT",
+        settings=qa_settings(use_async=True))))
+
+
+IP2ASN_RESOLVER = None
+
+
+def op_ip2asn():
+    """ip2asn lookup of a random IPv4 address"""
+
+    global IP2ASN_RESOLVER
+    if IP2ASN_RESOLVER is None:
+        IP2ASN_RESOLVER = ip2asn.get_resolver()
+        IP2ASN_RESOLVER.nameservers = [dns_standin.BASE_ADDRESS]
+        IP2ASN_RESOLVER.port = Opts.port
+    address = "{}.{}.{}.{}".format(random.randint(1, 223),
+                                   random.randint(0, 255),
+                                   random.randint(0, 255),
+                                   random.randint(0, 255))
+    if ip2asn.ip2asn(IP2ASN_RESOLVER, address) is None:
+        raise RuntimeError("ip2asn lookup failed")
+
+
+def op_signingstatus():
+    """check_bindsigningstatus TYPE65534 query"""
+
+    resp = check_bindsigningstatus.dnsQuery(
+        dns_standin.BASE_ADDRESS, dns_standin.ZONE,
+        check_bindsigningstatus.SIGNING_STATUS_RECORD, port=Opts.port)
+    if not resp.answer:
+        raise RuntimeError("signing status record not found")
+
+
+SCENARIOS = {
+    "qa_sync": op_qa_sync,
+    "qa_async": op_qa_async,
+    "qa_tcp": op_qa_tcp,
+    "qa_truncated": op_qa_truncated,
+    "ip2asn": op_ip2asn,
+    "signingstatus": op_signingstatus,
+}
+
+
+def percentile(values, pct):
+    """Return nearest-rank percentile of sorted list of values"""
+
+    index = max(0, int(round(pct / 100.0 * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def run_scenario(name):
+    """Run scenario, returning dictionary of measurements"""
+
+    operation = SCENARIOS[name]
+    qa.SERVERS.clear()
+    try:
+        operation()                             # warm up caches
+    except RuntimeError:
+        pass
+
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(Opts.operations):
+        opstart = time.perf_counter()
+        try:
+            operation()
+        except Exception:                       # pylint: disable=broad-except
+            errors += 1
+        latencies.append((time.perf_counter() - opstart) * 1000.0)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for _ in range(min(MEMORY_OPERATIONS, Opts.operations)):
+        try:
+            operation()
+        except Exception:                       # pylint: disable=broad-except
+            pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "operations": Opts.operations,
+        "errors": errors,
+        "ops_per_sec": round(Opts.operations / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "peak_kb": round(peak / 1024.0, 1),
+    }
+
+
+def print_results(results):
+    """Print results table"""
+
+    print("{:<16} {:>6} {:>6} {:>10} {:>10} {:>10} {:>10}".format(
+        "Scenario", "Ops", "Errors", "Ops/s", "p50 ms", "p99 ms",
+        "Peak KB"))
+    for res in results:
+        print("{:<16} {:>6} {:>6} {:>10} {:>10} {:>10} {:>10}".format(
+            res['scenario'], res['operations'], res['errors'],
+            res['ops_per_sec'], res['p50_ms'], res['p99_ms'],
+            res['peak_kb']))
+
+
+if __name__ == '__main__':
+
+    process_args(sys.argv[1:])
+    qa.PORT = Opts.port
+    bench_lambda.set_resolver("{}#{}".format(dns_standin.BASE_ADDRESS,
+                                             Opts.port))
+    STANDINS = start_standins()
+    try:
+        RESULTS = [run_scenario(name) for name in Opts.scenarios]
+    finally:
+        STANDINS.kill()
+    if Opts.json:
+        print(json.dumps({"servers": Opts.servers, "latency": Opts.latency,
+                          "loss": Opts.loss, "results": RESULTS}, indent=2))
+    else:
+        print_results(RESULTS)
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+#
+
+"""
+Local stand-ins for authoritative DNS servers, for benchmarking and
+testing the tools in this repository without touching the Internet.
+
+Starts N dnspython based servers, answering over UDP and TCP, on
+consecutive loopback addresses (127.0.1.1, 127.0.1.2, ...) and a
+common port. All of them serve the same synthetic zone:
+
+  <zone>                 SOA, NS (ns1..nsN.<zone>), TYPE65534
+  ns<i>.<zone>           A (the i-th stand-in address)
+  www.<zone>             A
+  big.<zone>             TXT records totalling about 2KB
+  h<n>.<zone>            A (for n in 0..999)
+
+Names under origin.asn.cymru.com and origin6.asn.cymru.com are
+answered with Cymru style TXT records, synthesized from the queried
+address (a /24 or /48 prefix, with a deterministic origin AS), so
+the stand-ins can also act as the resolver for ip2asn.py.
+
+Per server latency (with jitter), UDP packet loss, a UDP response
+size limit (responses over it are truncated), and NSID are
+configurable. Pointing the resolver of a tool at the first stand-in
+lets it resolve the zone's NS set and addresses locally.
+
+"""
+
+import os
+import sys
+import getopt
+import random
+import asyncio
+import struct
+import ipaddress
+import dns.edns
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+import dns.reversename
+
+PROGNAME = os.path.basename(sys.argv[0])
+
+BASE_ADDRESS = "127.0.1.1"
+PORT = 5353
+ZONE = "example.test."
+SERVERS = 4
+
+CYMRU_V4_SUFFIX = dns.name.from_text("origin.asn.cymru.com.")
+CYMRU_V6_SUFFIX = dns.name.from_text("origin6.asn.cymru.com.")
+
+# TYPE65534 signing status records: alg 13, key tag, remove, complete
+SIGNING_STATUS = [
+    (13, 12345, 0, 1),
+    (13, 54321, 0, 0),
+]
+
+
+# Options with initialized defaults
+class Opts:
+    servers = SERVERS
+    base_address = BASE_ADDRESS
+    port = PORT
+    zone = ZONE
+    latency = 0.0
+    jitter = 0.0
+    loss = 0.0
+    max_udp = None
+    nsid = True
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print("{}\n".format(msg))
+    print("""\
+Usage: {0} [Options]
+
+       Options:
+       --help            Print this help message and exit
+       --servers=N       Number of stand-in servers (default {1})
+       --address=A       First server address (default {2})
+       --port=N          Port to listen on (default {3})
+       --zone=Z          Zone to serve (default {4})
+       --latency=S       Response latency in seconds (default 0)
+       --jitter=S        Additional random latency, up to S seconds
+       --loss=P          UDP packet loss probability, 0..1 (default 0)
+       --max-udp=N       Truncate UDP responses larger than N bytes
+       --no-nsid         Don't return NSID
+""".format(PROGNAME, SERVERS, BASE_ADDRESS, PORT, ZONE))
+    sys.exit(1)
+
+
+def process_args(arguments):
+    """Process command line arguments"""
+
+    longopts = [
+        "help",
+        "servers=",
+        "address=",
+        "port=",
+        "zone=",
+        "latency=",
+        "jitter=",
+        "loss=",
+        "max-udp=",
+        "no-nsid",
+    ]
+    try:
+        (options, args) = getopt.getopt(arguments, "", longopts=longopts)
+    except getopt.GetoptError as exc_info:
+        usage(exc_info)
+
+    try:
+        for (opt, optval) in options:
+            if opt == "--help":
+                usage()
+            elif opt == "--servers":
+                Opts.servers = int(optval)
+            elif opt == "--address":
+                Opts.base_address = optval
+            elif opt == "--port":
+                Opts.port = int(optval)
+            elif opt == "--zone":
+                Opts.zone = optval
+            elif opt == "--latency":
+                Opts.latency = float(optval)
+            elif opt == "--jitter":
+                Opts.jitter = float(optval)
+            elif opt == "--loss":
+                Opts.loss = float(optval)
+            elif opt == "--max-udp":
+                Opts.max_udp = int(optval)
+            elif opt == "--no-nsid":
+                Opts.nsid = False
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
+
+    if args:
+        usage("Error: too many arguments")
+
+
+def server_addresses(count, base_address=BASE_ADDRESS):
+    """Return list of count consecutive addresses from base_address"""
+
+    base = ipaddress.ip_address(base_address)
+    return [str(base + i) for i in range(count)]
+
+
+def signing_status_rdata(alg, keyid, remove, complete):
+    """Return TYPE65534 signing status rdata as used by BIND"""
+
+    return dns.rdata.GenericRdata(dns.rdataclass.IN, 65534,
+                                  struct.pack('!BHBB', alg, keyid,
+                                              remove, complete))
+
+
+class ZoneData:
+    """Synthetic zone contents, as RRsets keyed by (name, rdtype)"""
+
+    def __init__(self, zone=ZONE, addresses=()):
+        self.origin = dns.name.from_text(zone)
+        self.rrsets = {}
+        self.names = set()
+
+        origin = self.origin.to_text()
+        self.add(origin, 'SOA', ["ns1.{0} hostmaster.{0} 2024010101 "
+                                 "3600 900 604800 300".format(origin)])
+        self.add(origin, 'NS', ["ns{}.{}".format(i + 1, origin)
+                                for i in range(len(addresses))])
+        self.add(origin, 65534,
+                 [signing_status_rdata(*status)
+                  for status in SIGNING_STATUS])
+        for i, address in enumerate(addresses):
+            rdtype = 'AAAA' if ':' in address else 'A'
+            self.add("ns{}.{}".format(i + 1, origin), rdtype, [address])
+        self.add("www." + origin, 'A', ["192.0.2.1", "192.0.2.2"])
+        self.add("big." + origin, 'TXT',
+                 ['"{}"'.format(str(i) * 250) for i in range(8)])
+        for i in range(1000):
+            self.add("h{}.{}".format(i, origin), 'A',
+                     ["198.51.{}.{}".format(i // 256, i % 256)])
+
+    def add(self, name, rdtype, rdatas, ttl=300):
+        """Add RRset to zone"""
+
+        name = dns.name.from_text(name)
+        rdtype = dns.rdatatype.RdataType.make(rdtype)
+        rdatas = [rdata if isinstance(rdata, dns.rdata.Rdata) else
+                  dns.rdata.from_text(dns.rdataclass.IN, rdtype, rdata)
+                  for rdata in rdatas]
+        self.rrsets[(name, rdtype)] = dns.rrset.from_rdata_list(name, ttl,
+                                                                rdatas)
+        self.names.add(name)
+
+    def lookup(self, qname, rdtype):
+        """Return (rcode, answer RRset or None)"""
+
+        if qname.is_subdomain(CYMRU_V4_SUFFIX) or \
+           qname.is_subdomain(CYMRU_V6_SUFFIX):
+            return cymru_answer(qname, rdtype)
+        rrset = self.rrsets.get((qname, rdtype))
+        if rrset is not None:
+            return dns.rcode.NOERROR, rrset
+        if qname in self.names:
+            return dns.rcode.NOERROR, None
+        return dns.rcode.NXDOMAIN, None
+
+
+def cymru_answer(qname, rdtype):
+    """
+    Synthesize Cymru style origin TXT answer for reversed address name.
+    IPv4 addresses map to their /24, and IPv6 addresses to their /48,
+    with an origin AS derived from the prefix.
+    """
+
+    if rdtype != dns.rdatatype.TXT:
+        return dns.rcode.NOERROR, None
+    if qname.is_subdomain(CYMRU_V4_SUFFIX):
+        labels = qname.relativize(CYMRU_V4_SUFFIX).labels
+        if len(labels) != 4:
+            return dns.rcode.NXDOMAIN, None
+        octets = [int(label) for label in reversed(labels)]
+        prefix = ipaddress.ip_network("{}.{}.{}.0/24".format(*octets[:3]))
+    else:
+        labels = qname.relativize(CYMRU_V6_SUFFIX).labels
+        if len(labels) != 32:
+            return dns.rcode.NXDOMAIN, None
+        digits = b''.join(reversed(labels)).decode()
+        address = ipaddress.IPv6Address(int(digits, 16))
+        prefix = ipaddress.ip_network("{}/48".format(address), strict=False)
+    asn = 64512 + int(prefix.network_address) % 1000
+    text = '"{} | {} | ZZ | test | 2020-01-01"'.format(asn, prefix)
+    rdata = dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.TXT, text)
+    return dns.rcode.NOERROR, dns.rrset.from_rdata_list(qname, 3600, [rdata])
+
+
+class Standin:
+    """A single stand-in server, answering over UDP and TCP"""
+
+    def __init__(self, data, address, port=PORT, latency=0.0, jitter=0.0,
+                 loss=0.0, max_udp=None, nsid=None):
+        self.data = data
+        self.address = address
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.max_udp = max_udp
+        self.nsid = nsid
+        self.transport = None
+        self.tcp_server = None
+        self.queries = 0
+        self.tcp_connections = 0
+
+    def response(self, wire, udp):
+        """Return response wire data for query wire data, or None"""
+
+        try:
+            query = dns.message.from_wire(wire)
+        except dns.exception.DNSException:
+            return None
+        self.queries += 1
+        res = dns.message.make_response(query)
+        res.flags |= dns.flags.AA
+        if not query.question:
+            res.set_rcode(dns.rcode.FORMERR)
+            return res.to_wire()
+        question = query.question[0]
+        rcode, rrset = self.data.lookup(question.name, question.rdtype)
+        res.set_rcode(rcode)
+        if rrset is not None:
+            res.answer.append(rrset)
+        elif (self.data.origin, dns.rdatatype.SOA) in self.data.rrsets and \
+                question.name.is_subdomain(self.data.origin):
+            res.authority.append(
+                self.data.rrsets[(self.data.origin, dns.rdatatype.SOA)])
+        if query.edns >= 0 and self.nsid:
+            for option in query.options:
+                if option.otype == dns.edns.NSID:
+                    res.use_edns(0, payload=res.payload, options=[
+                        dns.edns.GenericOption(dns.edns.NSID,
+                                               self.nsid.encode())])
+        wire = res.to_wire(max_size=65535)
+        if udp:
+            limit = query.payload if query.edns >= 0 else 512
+            if self.max_udp is not None:
+                limit = min(limit, self.max_udp)
+            if len(wire) > limit:
+                res.answer = []
+                res.authority = []
+                res.flags |= dns.flags.TC
+                wire = res.to_wire(max_size=65535)
+        return wire
+
+    async def delay(self):
+        """Sleep for configured latency"""
+
+        delay = self.latency + random.random() * self.jitter
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def answer_udp(self, wire, peer):
+        """Answer a UDP query"""
+
+        if self.loss and random.random() < self.loss:
+            return
+        await self.delay()
+        response = self.response(wire, udp=True)
+        if response is not None and not self.transport.is_closing():
+            self.transport.sendto(response, peer)
+
+    async def answer_tcp(self, wire, writer):
+        """Answer a (possibly pipelined) TCP query"""
+
+        await self.delay()
+        response = self.response(wire, udp=False)
+        if response is not None and not writer.is_closing():
+            writer.write(struct.pack('!H', len(response)) + response)
+
+    async def handle_tcp(self, reader, writer):
+        """Read queries from a TCP connection"""
+
+        self.tcp_connections += 1
+        tasks = set()
+        try:
+            while True:
+                length, = struct.unpack('!H', await reader.readexactly(2))
+                wire = await reader.readexactly(length)
+                task = asyncio.ensure_future(self.answer_tcp(wire, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        writer.close()
+
+    async def start(self):
+        """Start listening"""
+
+        standin = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            """UDP protocol handler"""
+
+            def datagram_received(self, data, addr):
+                asyncio.ensure_future(standin.answer_udp(data, addr))
+
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            Protocol, local_addr=(self.address, self.port))
+        self.tcp_server = await asyncio.start_server(
+            self.handle_tcp, self.address, self.port)
+
+    def close(self):
+        """Stop listening"""
+
+        if self.transport is not None:
+            self.transport.close()
+        if self.tcp_server is not None:
+            self.tcp_server.close()
+
+
+async def start_standins(count=SERVERS, base_address=BASE_ADDRESS, port=PORT,
+                         zone=ZONE, **kwargs):
+    """
+    Start count stand-in servers on consecutive addresses, serving a
+    common synthetic zone. Keyword arguments are passed to Standin().
+    Returns the list of started Standin objects.
+    """
+
+    addresses = server_addresses(count, base_address)
+    data = ZoneData(zone, addresses)
+    nsid = kwargs.pop('nsid', True)
+    standins = []
+    for i, address in enumerate(addresses):
+        standin = Standin(data, address, port=port,
+                          nsid="ns{}".format(i + 1) if nsid else None,
+                          **kwargs)
+        await standin.start()
+        standins.append(standin)
+    return standins
+
+
+async def serve_forever():
+    """Start stand-ins from command line options and run forever"""
+
+    standins = await start_standins(Opts.servers, Opts.base_address,
+                                    Opts.port, Opts.zone,
+                                    latency=Opts.latency, jitter=Opts.jitter,
+                                    loss=Opts.loss, max_udp=Opts.max_udp,
+                                    nsid=Opts.nsid)
+    print("Serving {} on {} port {}".format(
+        Opts.zone, ", ".join(standin.address for standin in standins),
+        Opts.port), flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+
+    process_args(sys.argv[1:])
+    try:
+        asyncio.run(serve_forever())
+    except KeyboardInterrupt:
+        pass
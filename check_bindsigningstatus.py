@@ -9,48 +9,358 @@ Given a master server IP address and zone name, this program
 queries the private signing status record (RR type code 65534),
 and prints out the status.
 
+With -f, a list of (server, zone) pairs is read from a file instead,
+one "server zone" pair per line, and all of them are queried
+concurrently (with TCP fallback when the UDP response is truncated or
+UDP fails). A Nagios style summary line of the zones whose keys are
+still signing, or whose NSEC3 chains are still being built or removed,
+is printed, or with -j, a JSON report. In watch mode (-w), the zones
+still signing are polled again, with exponential backoff, until they
+have all completed; zones without a status record, or whose server
+could not be queried, are not polled again but reported as failed.
+
 """
 
-import os, sys, struct
-import dns.message, dns.query
-from binascii import hexlify
+import os, sys, struct, getopt, asyncio, json, time
+import dns.message, dns.query, dns.asyncquery, dns.flags, dns.rcode
+import dns.exception
+
+PROGNAME = os.path.basename(sys.argv[0])
 
 SIGNING_STATUS_RECORD = 65534
+CONCURRENCY = 64
+TIMEOUT = 2.0
+RETRIES = 3
+BACKOFF_MIN = 2.0
+BACKOFF_MAX = 60.0
+
+# Nagios plugin exit codes
+OK, WARNING, CRITICAL, UNKNOWN = 0, 1, 2, 3
+
+
+# Options with initialized defaults
+class Opts:
+    infile = None
+    port = 53
+    concurrency = CONCURRENCY
+    timeout = TIMEOUT
+    json = False
+    watch = False
+    max_wait = None
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+    print("""\
+Usage: {0} [Options] <server> <zone>
+       {0} [Options] -f <file|->
+
+       Options:
+       -h          Print this help string
+       -f file     Check all "server zone" pairs listed in file
+       -p port     Server port (default 53)
+       -c N        Maximum concurrent queries (default {1})
+       -t secs     UDP query timeout (default {2})
+       -j          Output JSON report (with -f)
+       -w          Watch: poll until all zones complete signing (with -f)
+       -m secs     Give up watching after this many seconds
+""".format(PROGNAME, CONCURRENCY, TIMEOUT))
+    sys.exit(UNKNOWN)
+
+
+def process_args(arguments):
+    """Process command line arguments"""
+
+    try:
+        (options, args) = getopt.getopt(arguments, "hf:p:c:t:jwm:")
+    except getopt.GetoptError as exc_info:
+        usage(exc_info)
 
+    try:
+        for (opt, optval) in options:
+            if opt == "-h":
+                usage()
+            elif opt == "-f":
+                Opts.infile = optval
+            elif opt == "-p":
+                Opts.port = int(optval)
+            elif opt == "-c":
+                Opts.concurrency = int(optval)
+            elif opt == "-t":
+                Opts.timeout = float(optval)
+            elif opt == "-j":
+                Opts.json = True
+            elif opt == "-w":
+                Opts.watch = True
+            elif opt == "-m":
+                Opts.max_wait = float(optval)
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
 
-def dnsQuery(ip, qname, qtype):
+    if Opts.infile is None:
+        if len(args) != 2 or Opts.json or Opts.watch:
+            usage()
+    elif args:
+        usage("No server or zone arguments allowed with -f")
+    if Opts.concurrency < 1:
+        usage("Concurrency must be at least 1")
+    return args
+
+
+def dnsQuery(ip, qname, qtype, port=53):
     resp = dns.query.udp(dns.message.make_query(qname, qtype),
-                         ip)
+                         ip, port=port)
     return resp
 
 
-def printStatusRdata(rdata):
-    alg = rdata[0]
-    keyid = hexlify(rdata[1:3]).decode()
+def parseStatusRdata(rdata):
+    """
+    Return dictionary of algorithm, key id, removal and completed flags
+    from signing status record rdata.
+    """
     keyid, = struct.unpack('!H', rdata[1:3])
-    removal_flag = rdata[3]
-    completed_flag = rdata[4]
+    return {
+        'alg': rdata[0],
+        'keyid': keyid,
+        'remove': rdata[3],
+        'complete': rdata[4],
+    }
+
+
+def parseChainRdata(rdata):
+    """
+    Return dictionary of NSEC3 hash algorithm, flags, iterations and
+    salt (hex) from NSEC3 chain status record rdata: a zero byte and
+    the NSEC3PARAM rdata. BIND deletes these records once the chain
+    change is done, so a chain is never complete.
+    """
+    alg, flags, iterations, saltlen = struct.unpack('!BBHB', rdata[1:6])
+    return {
+        'hash': alg,
+        'flags': flags,
+        'iterations': iterations,
+        'salt': rdata[6:6+saltlen].hex() or '-',
+        'complete': 0,
+    }
+
+
+def isChainRdata(rdata):
+    """Is signing status record rdata an NSEC3 chain status record?"""
+    return len(rdata) >= 6 and rdata[0] == 0
+
+
+def printStatusRdata(rdata):
+    status = parseStatusRdata(rdata)
     print("alg={} keyid={} remove={} complete={}".format(
-        alg, keyid, removal_flag, completed_flag))
+        status['alg'], status['keyid'], status['remove'],
+        status['complete']))
     return
 
 
+def printChainRdata(rdata):
+    chain = parseChainRdata(rdata)
+    print("nsec3 hash={} flags={} iterations={} salt={} complete=0".format(
+        chain['hash'], chain['flags'], chain['iterations'], chain['salt']))
+    return
+
+
+def readPairs(infile):
+    """Return list of (server, zone) pairs, skipping blanks and comments"""
+    pairs = []
+    for lineno, line in enumerate(infile, 1):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        if len(fields) != 2:
+            print("WARN: line {}: expected server and zone".format(lineno),
+                  file=sys.stderr)
+            continue
+        pairs.append((fields[0], fields[1]))
+    return pairs
+
+
+async def dnsQueryAsync(ip, qname, qtype, sem, port=53, timeout=TIMEOUT,
+                        retries=RETRIES):
+    """
+    Query over UDP, retrying on timeout, and over TCP if the response
+    is truncated or UDP fails.
+    """
+    msg = dns.message.make_query(qname, qtype)
+    resp = None
+    async with sem:
+        for _ in range(retries):
+            try:
+                resp = await dns.asyncquery.udp(msg, ip, port=port,
+                                                timeout=timeout)
+                break
+            except dns.exception.Timeout:
+                continue
+            except OSError:
+                break
+        if resp is None or resp.flags & dns.flags.TC:
+            resp = await dns.asyncquery.tcp(msg, ip, port=port,
+                                            timeout=timeout * retries)
+    return resp
+
+
+async def checkZone(server, zone, sem, port=53, timeout=TIMEOUT):
+    """
+    Return dictionary of signing status of zone on server: its "status"
+    is "complete" if all keys have completed signing, "signing" if any
+    have not or an NSEC3 chain is being changed, "missing" if there is
+    no signing status record, or "error" if the query failed.
+    """
+    result = {'server': server, 'zone': zone, 'keys': [], 'chains': []}
+    try:
+        resp = await dnsQueryAsync(server, zone, SIGNING_STATUS_RECORD, sem,
+                                   port=port, timeout=timeout)
+    except (dns.exception.DNSException, OSError, EOFError) as e:
+        result['status'] = 'error'
+        result['error'] = str(e) or type(e).__name__
+        return result
+    if resp.rcode() != dns.rcode.NOERROR:
+        result['status'] = 'error'
+        result['error'] = dns.rcode.to_text(resp.rcode())
+        return result
+    for rrset in resp.answer:
+        if rrset.rdtype != SIGNING_STATUS_RECORD:
+            continue
+        for rr in rrset:
+            if isChainRdata(rr.data):
+                result['chains'].append(parseChainRdata(rr.data))
+            elif len(rr.data) == 5:
+                result['keys'].append(parseStatusRdata(rr.data))
+    if not result['keys'] and not result['chains']:
+        result['status'] = 'missing'
+    elif not result['chains'] and \
+            all(key['complete'] for key in result['keys']):
+        result['status'] = 'complete'
+    else:
+        result['status'] = 'signing'
+    return result
+
+
+async def checkZones(pairs, port=53, concurrency=CONCURRENCY,
+                     timeout=TIMEOUT):
+    """Return signing status of all (server, zone) pairs, in order"""
+    sem = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*[checkZone(server, zone, sem, port, timeout)
+                                  for server, zone in pairs])
+
+
+def watchZones(pairs, port=53, concurrency=CONCURRENCY, timeout=TIMEOUT,
+               max_wait=None):
+    """
+    Poll (server, zone) pairs until none are still signing, or until
+    max_wait seconds have passed. Only zones still signing are polled
+    again: complete, missing and error results are final. The interval
+    between polls doubles (up to BACKOFF_MAX) while no more zones
+    finish. Returns the latest result for every pair.
+    """
+    results = {}
+    pending = list(pairs)
+    interval = BACKOFF_MIN
+    start = time.monotonic()
+    while True:
+        for result in asyncio.run(checkZones(pending, port, concurrency,
+                                             timeout)):
+            results[(result['server'], result['zone'])] = result
+        done = [pair for pair in pending
+                if results[pair]['status'] != 'signing']
+        pending = [pair for pair in pending
+                   if results[pair]['status'] == 'signing']
+        print("{}: {} of {} zones complete, {} failed".format(
+            time.strftime("%H:%M:%S"),
+            sum(r['status'] == 'complete' for r in results.values()),
+            len(pairs),
+            sum(r['status'] in ('missing', 'error')
+                for r in results.values())), file=sys.stderr)
+        elapsed = time.monotonic() - start
+        if not pending or (max_wait is not None and
+                           elapsed + interval > max_wait):
+            break
+        if done:
+            interval = BACKOFF_MIN
+        time.sleep(interval)
+        interval = min(interval * 2, BACKOFF_MAX)
+    return [results[pair] for pair in pairs]
+
+
+def summarize(results):
+    """Return Nagios exit code and summary line for zone results"""
+    counts = {status: [r for r in results if r['status'] == status]
+              for status in ('complete', 'signing', 'missing', 'error')}
+    failed = counts['missing'] + counts['error']
+    signing = counts['signing']
+    details = []
+    for r in signing:
+        keyids = [str(key['keyid']) for key in r['keys']
+                  if not key['complete']]
+        detail = "{}@{}".format(r['zone'], r['server'])
+        if keyids:
+            detail += " signing keyid {}".format(",".join(keyids))
+        if r['chains']:
+            detail += " changing {} NSEC3 chain(s)".format(len(r['chains']))
+        details.append(detail)
+    for r in failed:
+        details.append("{}@{} {}".format(r['zone'], r['server'],
+                                         r.get('error', 'no status record')))
+    if failed:
+        code, label = CRITICAL, "CRITICAL"
+    elif signing:
+        code, label = WARNING, "WARNING"
+    else:
+        code, label = OK, "OK"
+    line = "{}: {} zones complete, {} signing, {} failed".format(
+        label, len(counts['complete']), len(signing), len(failed))
+    if details:
+        line += ": " + "; ".join(details)
+    return code, line
+
+
 if __name__ == '__main__':
 
-    master_ip, zone = sys.argv[1:]
-    resp = dnsQuery(master_ip, zone, SIGNING_STATUS_RECORD)
+    args = process_args(sys.argv[1:])
+
+    if Opts.infile is not None:
+        infile = sys.stdin if Opts.infile == "-" else open(Opts.infile)
+        pairs = readPairs(infile)
+        if Opts.watch:
+            results = watchZones(pairs, Opts.port, Opts.concurrency,
+                                 Opts.timeout, Opts.max_wait)
+        else:
+            results = asyncio.run(checkZones(pairs, Opts.port,
+                                             Opts.concurrency, Opts.timeout))
+        code, line = summarize(results)
+        if Opts.json:
+            print(json.dumps({"summary": line, "exit_code": code,
+                              "zones": results}, indent=2))
+        else:
+            print(line)
+        sys.exit(code)
+
+    master_ip, zone = args
+    resp = dnsQuery(master_ip, zone, SIGNING_STATUS_RECORD, port=Opts.port)
     if (resp.rcode() != 0) or (len(resp.answer) == 0):
         print("ERROR: record {} not found.".format(SIGNING_STATUS_RECORD))
         sys.exit(3)
 
     completed = False
     seenRecord = False
+    chainChange = False
 
     for rrset in resp.answer:
         if rrset.rdtype != 65534:
             continue
         seenRecord = True
         for rr in rrset:
+            if isChainRdata(rr.data):
+                printChainRdata(rr.data)
+                chainChange = True
+                continue
             printStatusRdata(rr.data)
             completed_flag = rr.data[-1]
             if completed_flag == 1:
@@ -61,7 +371,7 @@ if __name__ == '__main__':
     if not seenRecord:
         print("ERROR: Could not find signing status record.")
         sys.exit(2)
-    if completed:
+    if completed and not chainChange:
         print("OK: Signing completed")
         sys.exit(0)
     else:
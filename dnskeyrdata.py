@@ -4,6 +4,9 @@
 """
 Decode DNSKEY RDATA provided in text form as the command line argument.
 
+The decoding functions are also used by verify_zone_signatures.py,
+which indexes a zone's keys by key tag with index_keys().
+
 """
 
 import sys
@@ -11,15 +14,59 @@ import dns.rdata
 import dns.rdataclass
 import dns.rdatatype
 import dns.dnssec
+import dns.dnssecalgs
+
+
+def decode_dnskey(text):
+    """Return DNSKEY rdata object from its text form"""
+
+    return dns.rdata.from_text(dns.rdataclass.IN,
+                               dns.rdatatype.DNSKEY,
+                               text)
+
+
+def public_key(r):
+    """
+    Return public key object (with a verify(signature, data) method)
+    for DNSKEY rdata, or None if its algorithm isn't supported or the
+    key is malformed.
+    """
+
+    try:
+        public_cls = dns.dnssecalgs.get_algorithm_cls_from_dnskey(r).public_cls
+        return public_cls.from_dnskey(r)
+    except (dns.dnssec.UnsupportedAlgorithm, ValueError):
+        return None
+
+
+def index_keys(dnskeys):
+    """
+    Return dictionary of (key tag, algorithm) to list of public key
+    objects, for DNSKEY rdatas. Key tags can collide, so there may be
+    more than one key per entry. Unusable keys are left out.
+    """
+
+    index = {}
+    for r in dnskeys:
+        public = public_key(r)
+        if public is not None:
+            index.setdefault((dns.dnssec.key_id(r), r.algorithm),
+                             []).append(public)
+    return index
+
+
+def print_dnskey(r):
+    """Print DNSKEY rdata and its decoded fields"""
+
+    print(r)
+    print('')
+    print("keytag:", dns.dnssec.key_id(r))
+    print("flags:", r.flags)
+    print("protocol:", r.protocol)
+    print("algorithm:", r.algorithm)
+    print("keylength:", len(r.key)*8)
+
 
+if __name__ == '__main__':
 
-r = dns.rdata.from_text(dns.rdataclass.IN,
-                        dns.rdatatype.DNSKEY,
-                        sys.argv[1])
-print(r)
-print('')
-print("keytag:", dns.dnssec.key_id(r))
-print("flags:", r.flags)
-print("protocol:", r.protocol)
-print("algorithm:", r.algorithm)
-print("keylength:", len(r.key)*8)
+    print_dnskey(decode_dnskey(sys.argv[1]))
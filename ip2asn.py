@@ -13,12 +13,45 @@ covering network prefix, responsible RIR, and date?
 Uses the specialized DNS zone service operated by CYMRU to obtain
 this information from internet routing looking glasses.
 
+In bulk mode (-f), addresses are read one per line from a file (or
+stdin), and looked up concurrently with asynchronous queries, up to
+a bounded number in flight. Results are written in input order, as
+TSV or JSON lines, each tagged with the input address.
+
+Bulk mode caches each answer under the covering prefix it reports,
+and answers any later address inside a cached prefix locally, with a
+longest prefix match. Note that this can hide a more specific prefix
+announced from within a cached one, until the cached entry expires.
+
+Alternatively, answers can come from an offline prefix index (-i),
+built (-b) from a prefix to origin AS dump, such as a CAIDA pfx2as
+file, a "prefix ASN" RIB text export, or saved Cymru answers in the
+"ASN | prefix | CC | RIR | date" format. The index is memory mapped,
+so it opens instantly and its pages are shared between processes.
+
+A persistent sqlite cache file (-P) keeps answers, keyed by prefix,
+across runs and between concurrent processes. Expired entries are
+removed from it with -x.
+
 """
 
 import os.path
 import sys
+import getopt
+import json
+import time
+import mmap
+import array
+import bisect
+import struct
 import socket
+import sqlite3
+import ipaddress
+import asyncio
+from collections import deque, OrderedDict
+import dns.exception
 import dns.resolver
+import dns.asyncresolver
 import dns.reversename
 
 PROGNAME = os.path.basename(sys.argv[0])
@@ -27,16 +60,123 @@ VERSION = "0.1"
 IP2ASN_V4_SUFFIX = ".origin.asn.cymru.com."
 IP2ASN_V6_SUFFIX = ".origin6.asn.cymru.com."
 
+TIMEOUT = 5
+CONCURRENCY = 256
+CACHE_SIZE = 100000
+# Concurrent lookups of uncached addresses within the same /24 (IPv4)
+# or /48 (IPv6), the longest prefixes generally routed, wait for the
+# first one's answer, which most likely covers them all.
+COALESCE_LENGTH = {4: 24, 6: 48}
+FIELDS = ["asn", "prefix", "country", "rir", "date"]
+
 
-def usage():
+# Options with initialized defaults
+class Opts:
+    infile = None
+    json = False
+    server = None
+    verbose = False
+    index = None
+    build = None
+    persistent = None
+    prune = False
+
+
+def usage(msg=None):
     """Print usage string"""
-    print("Usage: {} <address>".format(PROGNAME))
+    if msg:
+        print(msg)
+    print("""\
+Usage: {0} [Options] <address>
+       {0} [Options] -f <file|->
+       {0} -b <indexfile> <dumpfile|->
+       {0} -P <cachefile> -x
+
+       Options:
+       -h          Print this help string
+       -f file     Bulk mode: read addresses from file ("-" for stdin)
+       -c N        Maximum concurrent lookups in bulk mode (default {1})
+       -j          Output JSON lines in bulk mode (default is TSV)
+       -s addr     Resolver to use, as addr[#port] (default system)
+       -t secs     Query timeout (default {2})
+       -C N        Prefix cache size in bulk mode, 0 disables (default {3})
+       -v          Print prefix cache statistics to stderr in bulk mode
+       -i file     Answer from offline prefix index file, not the DNS
+       -b file     Build offline prefix index file from prefix dump
+       -P file     Use persistent prefix cache file
+       -x          Prune expired entries from persistent cache and exit
+""".format(PROGNAME, CONCURRENCY, TIMEOUT, CACHE_SIZE))
     sys.exit(1)
 
 
-def get_resolver(timeout=5, edns=False):
+def process_args(arguments):
+    """Process command line arguments"""
+
+    global CONCURRENCY, TIMEOUT, CACHE_SIZE
+
+    try:
+        (options, args) = getopt.getopt(arguments, "hf:c:js:t:C:vi:b:P:x")
+    except getopt.GetoptError as exc_info:
+        usage(exc_info)
+
+    try:
+        for (opt, optval) in options:
+            if opt == "-h":
+                usage()
+            elif opt == "-f":
+                Opts.infile = optval
+            elif opt == "-c":
+                CONCURRENCY = int(optval)
+            elif opt == "-j":
+                Opts.json = True
+            elif opt == "-s":
+                Opts.server = optval
+            elif opt == "-t":
+                TIMEOUT = float(optval)
+            elif opt == "-C":
+                CACHE_SIZE = int(optval)
+            elif opt == "-v":
+                Opts.verbose = True
+            elif opt == "-i":
+                Opts.index = optval
+            elif opt == "-b":
+                Opts.build = optval
+            elif opt == "-P":
+                Opts.persistent = optval
+            elif opt == "-x":
+                Opts.prune = True
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
+
+    if Opts.build is not None:
+        if Opts.infile is not None or Opts.index is not None or \
+           len(args) != 1:
+            usage("Index build takes only a prefix dump file argument")
+        return args
+    if Opts.prune:
+        if Opts.persistent is None or args:
+            usage("Pruning needs only a persistent cache file (-P)")
+        return args
+    if Opts.infile is None and len(args) != 1:
+        usage()
+    if Opts.infile is not None and args:
+        usage("No address arguments allowed in bulk mode")
+    if CONCURRENCY < 1:
+        usage("Concurrency must be at least 1")
+    return args
+
+
+def set_server(r, server):
+    """Point resolver at given addr[#port] server"""
+    address, _, port = server.partition('#')
+    r.nameservers = [address]
+    if port:
+        r.port = int(port)
+
+
+def get_resolver(timeout=5, edns=False, module=dns.resolver):
     """return initialized resolver object"""
-    r = dns.resolver.Resolver()
+    r = module.Resolver()
     r.lifetime = timeout
     if edns:
         r.use_edns(edns=0, ednsflags=0, payload=4096)
@@ -70,13 +210,8 @@ def reverse_hexdigits(packedstring):
     return ''.join(["%02x" % x for x in packedstring])
 
 
-def ip2asn(res, address):
-    """
-    TXT records queried return single strings of the form:
-    ASN | IPprefix | CountryCode | RIR | date, e.g.
-    '55 | 128.91.0.0/16 | US | arin | '
-    '55 | 2607:f470::/32 | US | arin | 2008-05-01'
-    """
+def address2qname(address):
+    """Return CYMRU origin query name for address"""
     qname = None
     try:
         if address.find('.') != -1:
@@ -91,20 +226,663 @@ def ip2asn(res, address):
         pass
     if not qname:
         raise ValueError("%s isn't an IP address" % address)
+    return qname
+
+
+def address2int(address):
+    """Return (family, integer value) tuple for address"""
+    if address.find(':') != -1:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, address),
+                                 'big')
+    return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+
+
+def parse_prefix(result):
+    """
+    Return (family, prefix length, integer network value) for the
+    prefix in a TXT answer string, or None if it has no valid prefix.
+    """
+    try:
+        network, length = result.split('|')[1].strip().split('/')
+        family, value = address2int(network)
+        length = int(length)
+    except (IndexError, ValueError, OSError):
+        return None
+    if not 0 <= length <= PrefixCache.BITS[family]:
+        return None
+    return family, length, value
+
+
+class PrefixCache:
+    """
+    Longest prefix match cache of origin TXT answers, keyed by the
+    covering prefix reported in each answer. Each address family has
+    a hash table of prefixes for every prefix length seen, probed from
+    the most specific length down. Entries expire with the TTL of the
+    answer, and the least recently used are evicted beyond maxsize.
+    Lookups count as hits when answered from the cache; callers count
+    misses with count_miss() when they go on to send a query.
+
+    An optional backing store (PersistentCache) is consulted on misses,
+    and written through on every put.
+    """
+
+    BITS = {4: 32, 6: 128}
+
+    def __init__(self, maxsize=CACHE_SIZE, backing=None):
+        self.maxsize = maxsize
+        self.backing = backing
+        self.entries = OrderedDict()
+        self.lengths = {4: {}, 6: {}}
+        self.order = {4: (), 6: ()}
+        self.hits = 0
+        self.misses = 0
+
+    def _add_length(self, family, length, count):
+        counts = self.lengths[family]
+        counts[length] = counts.get(length, 0) + count
+        if counts[length] == 0:
+            del counts[length]
+            self.order[family] = tuple(sorted(counts, reverse=True))
+        elif counts[length] == count:
+            self.order[family] = tuple(sorted(counts, reverse=True))
+
+    def _remove(self, key):
+        del self.entries[key]
+        self._add_length(key[0], key[1], -1)
+
+    def get(self, address):
+        """Return cached TXT string for address, or None"""
+        family, value = address2int(address)
+        bits = self.BITS[family]
+        now = time.time()
+        for length in self.order[family]:
+            key = (family, length, value >> (bits - length))
+            entry = self.entries.get(key)
+            if entry is None:
+                continue
+            if entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._remove(key)
+        if self.backing is not None:
+            entry = self.backing.get_entry(family, value)
+            if entry is not None:
+                length, expiration, result = entry
+                self._insert((family, length, value >> (bits - length)),
+                             expiration, result)
+                self.hits += 1
+                return result
+        return None
+
+    def count_miss(self):
+        """Count a lookup that missed, and is sent as a query"""
+        self.misses += 1
+        if self.backing is not None:
+            self.backing.count_miss()
+
+    def _insert(self, key, expiration, result):
+        if self.maxsize <= 0:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (expiration, result)
+        self._add_length(key[0], key[1], 1)
+        while len(self.entries) > self.maxsize:
+            self._remove(next(iter(self.entries)))
+
+    def put(self, result, ttl):
+        """Cache TXT string result under its prefix, for ttl seconds"""
+        prefix = parse_prefix(result)
+        if prefix is None or ttl <= 0:
+            return
+        family, length, value = prefix
+        self._insert((family, length, value >> (self.BITS[family] - length)),
+                     time.time() + ttl, result)
+        if self.backing is not None:
+            self.backing.put(result, ttl)
+
+    def close(self):
+        """Close backing store, if any"""
+        if self.backing is not None:
+            self.backing.close()
+
+    def stats(self):
+        """Return dictionary of cache statistics"""
+        lookups = self.hits + self.misses
+        stats = {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+        if self.backing is not None:
+            stats["persistent"] = self.backing.stats()
+        return stats
+
+
+class PersistentCache:
+    """
+    Persistent prefix cache in an sqlite file, keyed by address family,
+    prefix length and network address (as a blob), with the TXT answer
+    and its expiration time. The database uses WAL mode, so concurrent
+    processes can read while one writes. Writes are buffered, and
+    written in short transactions of COMMIT_INTERVAL entries (and on
+    close()), so no write lock is held while waiting for queries.
+
+    Lookups probe the prefix lengths known to this process, so new
+    lengths added by other processes are seen after reopening. As with
+    PrefixCache, callers count misses with count_miss().
+    """
+
+    COMMIT_INTERVAL = 1000
+    BYTES = {4: 4, 6: 16}
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS prefixes (
+            family INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            network BLOB NOT NULL,
+            expiration REAL NOT NULL,
+            result TEXT NOT NULL,
+            PRIMARY KEY (family, length, network)) WITHOUT ROWID""")
+        self.db.execute("""CREATE INDEX IF NOT EXISTS prefixes_expiration
+            ON prefixes (expiration)""")
+        self.lengths = {4: set(), 6: set()}
+        for family, length in self.db.execute(
+                "SELECT DISTINCT family, length FROM prefixes"):
+            self.lengths[family].add(length)
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, family, length, value):
+        bits = PrefixCache.BITS[family]
+        network = value >> (bits - length) << (bits - length)
+        return network.to_bytes(self.BYTES[family], 'big')
+
+    def get_entry(self, family, value):
+        """
+        Return (prefix length, expiration, TXT string) of the longest
+        unexpired cached prefix covering integer address value, or None.
+        """
+        lengths = sorted(self.lengths[family], reverse=True)
+        if not lengths:
+            return None
+        # Entries not yet written are looked up in the buffer too
+        now = time.time()
+        best = None
+        for length in lengths:
+            entry = self.pending.get(
+                (family, length, self._key(family, length, value)))
+            if entry is not None and entry[0] > now:
+                best = (length,) + entry
+                break
+        params = [family]
+        for length in lengths:
+            params += [length, self._key(family, length, value)]
+        params.append(now)
+        row = self.db.execute(
+            "SELECT length, expiration, result FROM prefixes "
+            "WHERE family = ? AND (length, network) IN (VALUES {}) "
+            "AND expiration > ? ORDER BY length DESC LIMIT 1".format(
+                ", ".join(["(?, ?)"] * len(lengths))), params).fetchone()
+        if best is not None and (row is None or best[0] >= row[0]):
+            row = best
+        if row is not None:
+            self.hits += 1
+        return row
+
+    def get(self, address):
+        """Return cached TXT string for address, or None"""
+        entry = self.get_entry(*address2int(address))
+        return entry[2] if entry else None
+
+    def count_miss(self):
+        """Count a lookup that missed, and is sent as a query"""
+        self.misses += 1
+
+    def put(self, result, ttl):
+        """Cache TXT string result under its prefix, for ttl seconds"""
+        prefix = parse_prefix(result)
+        if prefix is None or ttl <= 0:
+            return
+        family, length, value = prefix
+        self.pending[(family, length, self._key(family, length, value))] = \
+            (time.time() + ttl, result)
+        self.lengths[family].add(length)
+        if len(self.pending) >= self.COMMIT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write buffered entries to the database"""
+        if not self.pending:
+            return
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.executemany(
+                "INSERT OR REPLACE INTO prefixes VALUES (?, ?, ?, ?, ?)",
+                [key + entry for key, entry in self.pending.items()])
+            self.db.execute("COMMIT")
+        except sqlite3.OperationalError as e:
+            if self.db.in_transaction:
+                self.db.execute("ROLLBACK")
+            print("WARN: persistent cache write failed: {}".format(e),
+                  file=sys.stderr)
+        self.pending = {}
+
+    def prune(self):
+        """Delete expired entries, returning the number deleted"""
+        return self.db.execute("DELETE FROM prefixes WHERE expiration <= ?",
+                               (time.time(),)).rowcount
+
+    def close(self):
+        """Write buffered entries and close the database"""
+        self.flush()
+        self.db.close()
+
+    def stats(self):
+        """Return dictionary of cache statistics"""
+        lookups = self.hits + self.misses
+        self.flush()
+        return {
+            "size": self.db.execute(
+                "SELECT COUNT(*) FROM prefixes").fetchone()[0],
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def parse_dump_line(line):
+    """
+    Parse line of a prefix dump, returning (network, record string)
+    or None. Accepts CAIDA pfx2as "network length ASN", "prefix ASN",
+    and "ASN | prefix | CC | RIR | date" lines.
+    """
+    if line.find('|') != -1:
+        fields = [field.strip() for field in line.split('|')]
+        prefix, asn, extra = fields[1], fields[0], fields[2:5]
+    else:
+        fields = line.split()
+        if len(fields) == 3 and fields[0].find('/') == -1:
+            prefix = "{}/{}".format(fields[0], fields[1])
+            asn = fields[2]
+        elif len(fields) == 2 and fields[0].find('/') != -1:
+            prefix, asn = fields
+        else:
+            return None
+        asn = asn.replace('_', ' ').replace(',', ' ')
+        extra = []
+    try:
+        network = ipaddress.ip_network(prefix, strict=False)
+    except ValueError:
+        return None
+    extra = (extra + [""] * 3)[:3]
+    return network, " | ".join([asn, str(network)] + extra)
+
+
+def flatten_prefixes(prefixes):
+    """
+    Flatten list of nested (start, end, record number) prefix ranges
+    into disjoint ranges, each mapped to the record of its most
+    specific covering prefix. Returns arrays of range start values
+    and record numbers (PrefixIndex.NONE where nothing covers).
+    """
+    starts, values = [], []
+
+    def emit(start, value):
+        if starts and starts[-1] == start:
+            values[-1] = value
+            if len(values) > 1 and values[-2] == value:
+                starts.pop()
+                values.pop()
+        elif not values or values[-1] != value:
+            starts.append(start)
+            values.append(value)
+
+    stack = []
+    for start, end, recno in sorted(prefixes,
+                                    key=lambda p: (p[0], -p[1])):
+        while stack and stack[-1][0] <= start:
+            emit(stack.pop()[0], stack[-1][1] if stack else PrefixIndex.NONE)
+        emit(start, recno)
+        stack.append((end, recno))
+    while stack:
+        emit(stack.pop()[0], stack[-1][1] if stack else PrefixIndex.NONE)
+    return starts, values
+
+
+def build_index(infile, outfile):
+    """
+    Build offline prefix index file from prefix dump lines in infile.
+    IPv6 ranges are keyed on the top 64 address bits, so prefixes
+    longer than /64 (absent from the global routing table) are skipped.
+    Returns a tuple of the number of prefixes indexed and skipped.
+    """
+    records = []
+    prefixes = {4: [], 6: []}
+    skipped = 0
+    for line in infile:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parsed = parse_dump_line(line)
+        if parsed is None or (parsed[0].version == 6 and
+                              parsed[0].prefixlen > 64):
+            skipped += 1
+            continue
+        network, record = parsed
+        shift = 0 if network.version == 4 else 64
+        start = int(network.network_address) >> shift
+        end = (int(network.broadcast_address) >> shift) + 1
+        prefixes[network.version].append((start, end, len(records)))
+        records.append(record.encode('utf-8'))
+
+    sections = []
+    for version, typecode in ((4, 'I'), (6, 'Q')):
+        starts, values = flatten_prefixes(prefixes[version])
+        if starts and starts[-1] == PrefixIndex.LIMIT[version]:
+            starts.pop()
+            values.pop()
+        sections.append(array.array(typecode, starts))
+        sections.append(array.array('I', values))
+    offsets = array.array('I', [0])
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    sections.append(offsets)
+    sections.append(b"".join(records))
+
+    header = struct.pack(PrefixIndex.HEADER, PrefixIndex.MAGIC,
+                         sys.byteorder == 'little', len(sections[0]),
+                         len(sections[2]), len(records), len(sections[5]))
+    outfile.write(header)
+    for section in sections:
+        data = section.tobytes() if isinstance(section, array.array) \
+            else section
+        outfile.write(data + b"\0" * (-len(data) % 8))
+    return len(records), skipped
+
+
+class PrefixIndex:
+    """
+    Offline, memory mapped prefix index. Nested prefixes are flattened
+    at build time into sorted, disjoint address ranges, each mapped to
+    the answer string of its most specific covering prefix, so lookup
+    is a binary search over the mapped range start array.
+    """
+
+    MAGIC = b"IP2ASNX1"
+    HEADER = "=8s?7x4Q"
+    NONE = 0xffffffff
+    LIMIT = {4: 2**32, 6: 2**64}
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+        size = struct.calcsize(self.HEADER)
+        magic, little, n4, n6, nrec, blobsize = struct.unpack(
+            self.HEADER, view[:size])
+        if magic != self.MAGIC:
+            raise ValueError("{} is not a prefix index file".format(path))
+        if little != (sys.byteorder == 'little'):
+            raise ValueError("{} has foreign byte order".format(path))
+        offset = size
+
+        def section(count, itemsize, typecode):
+            nonlocal offset
+            data = view[offset:offset + count * itemsize].cast(typecode)
+            offset += count * itemsize + (-(count * itemsize) % 8)
+            return data
+
+        self.starts = {4: section(n4, 4, 'I')}
+        self.values = {4: section(n4, 4, 'I')}
+        self.starts[6] = section(n6, 8, 'Q')
+        self.values[6] = section(n6, 4, 'I')
+        self.offsets = section(nrec + 1, 4, 'I')
+        self.blob = view[offset:offset + blobsize]
+
+    def lookup(self, address):
+        """Return answer string for address, or None if not covered"""
+        family, value = address2int(address)
+        if family == 6:
+            value >>= 64
+        starts = self.starts[family]
+        i = bisect.bisect_right(starts, value) - 1
+        if i < 0:
+            return None
+        recno = self.values[family][i]
+        if recno == self.NONE:
+            return None
+        return bytes(self.blob[self.offsets[recno]:
+                               self.offsets[recno + 1]]).decode('utf-8')
+
+
+def ip2asn(res, address, cache=None):
+    """
+    TXT records queried return single strings of the form:
+    ASN | IPprefix | CountryCode | RIR | date, e.g.
+    '55 | 128.91.0.0/16 | US | arin | '
+    '55 | 2607:f470::/32 | US | arin | 2008-05-01'
+
+    res is a resolver object, or an offline backend with a lookup()
+    method (PrefixIndex) that returns answers in the same format.
+    """
+    qname = address2qname(address)
+    if hasattr(res, 'lookup'):
+        return res.lookup(address)
+    if cache is not None:
+        result = cache.get(address)
+        if result is not None:
+            return result
+        cache.count_miss()
 
     txt_rrset = do_query(res, qname, 'TXT')
     if txt_rrset:
-        return txt_rrset[0].strings[0].decode('utf-8')
+        result = txt_rrset[0].strings[0].decode('utf-8')
+        if cache is not None:
+            cache.put(result, txt_rrset.ttl)
+        return result
 
     return None
 
 
+def coalesce_key(address):
+    """Return key of the block of address that lookups coalesce on"""
+    family, value = address2int(address)
+    return family, value >> (PrefixCache.BITS[family] -
+                             COALESCE_LENGTH[family])
+
+
+async def ip2asn_async(res, address, sem, cache=None, inflight=None):
+    """
+    Async version of ip2asn(), using an async resolver object. Returns
+    a tuple of the TXT string (or None) and an error string (or None).
+
+    With a cache and an inflight dictionary (shared by all lookups),
+    a lookup first waits for any query in flight for an address in the
+    same COALESCE_LENGTH block, and only sends its own query if that
+    answer didn't cover its address.
+    """
+    try:
+        qname = address2qname(address)
+    except ValueError as e:
+        return None, str(e)
+    done = None
+    if cache is not None and inflight is not None:
+        key = coalesce_key(address)
+        while key in inflight:
+            await inflight[key].wait()
+            result = cache.get(address)
+            if result is not None:
+                return result, None
+        done = inflight[key] = asyncio.Event()
+    try:
+        async with sem:
+            # Checked after acquiring the semaphore, since an answer
+            # covering this address may have arrived while waiting.
+            if cache is not None:
+                result = cache.get(address)
+                if result is not None:
+                    return result, None
+                cache.count_miss()
+            answers = await res.resolve(qname, 'TXT')
+        result = answers.rrset[0].strings[0].decode('utf-8')
+        if cache is not None:
+            cache.put(result, answers.rrset.ttl)
+        return result, None
+    except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN):
+        return None, "No records found"
+    except dns.exception.Timeout:
+        return None, "Query timed out"
+    except dns.exception.DNSException as e:
+        return None, "error: {}".format(type(e).__name__)
+    finally:
+        if done is not None:
+            del inflight[key]
+            done.set()
+
+
+def format_result(address, result, error):
+    """Return output line for address lookup result"""
+    values = [field.strip() for field in result.split('|')] if result else []
+    values = (values + [""] * len(FIELDS))[:len(FIELDS)]
+    if Opts.json:
+        record = {"address": address}
+        record.update(zip(FIELDS, values))
+        record["error"] = error
+        return json.dumps(record)
+    return "\t".join([address] + values + [error or ""])
+
+
+def bulk_lookup_offline(index, infile, outfile):
+    """Look up all addresses in infile in offline index, in order"""
+    if not Opts.json:
+        outfile.write("\t".join(["address"] + FIELDS + ["error"]) + "\n")
+    for address in read_addresses(infile):
+        try:
+            result = ip2asn(index, address)
+            error = None if result else "No records found"
+        except (ValueError, OSError):
+            result, error = None, "%s isn't an IP address" % address
+        outfile.write(format_result(address, result, error) + "\n")
+
+
+def read_addresses(infile):
+    """Yield addresses from input file, skipping blanks and comments"""
+    for line in infile:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def make_cache():
+    """Return prefix cache for lookups, as set by options, or None"""
+    backing = PersistentCache(Opts.persistent) if Opts.persistent else None
+    if CACHE_SIZE > 0:
+        return PrefixCache(CACHE_SIZE, backing)
+    return backing
+
+
+def print_cache_stats(cache):
+    """Print prefix cache statistics to stderr"""
+    print("Prefix cache: {}".format(json.dumps(cache.stats())),
+          file=sys.stderr)
+
+
+async def bulk_lookup(infile, outfile):
+    """
+    Look up all addresses in infile concurrently, writing results to
+    outfile in input order. At most CONCURRENCY queries are in flight,
+    and only a bounded window of pending results is held in memory.
+    Addresses covered by a cached prefix are answered without a task,
+    and lookups within the same block share one query in flight.
+    """
+    res = get_resolver(timeout=TIMEOUT, module=dns.asyncresolver)
+    if Opts.server:
+        set_server(res, Opts.server)
+    cache = make_cache()
+    sem = asyncio.Semaphore(CONCURRENCY)
+    window = CONCURRENCY * 4
+    pending = deque()
+    inflight = {}
+
+    async def flush(count):
+        while len(pending) > count:
+            address, outcome = pending.popleft()
+            if asyncio.isfuture(outcome):
+                outcome = await outcome
+            outfile.write(format_result(address, *outcome) + "\n")
+
+    if not Opts.json:
+        outfile.write("\t".join(["address"] + FIELDS + ["error"]) + "\n")
+    for address in read_addresses(infile):
+        result = None
+        if cache is not None:
+            try:
+                result = cache.get(address)
+            except (ValueError, OSError):
+                pass
+        if result is not None:
+            pending.append((address, (result, None)))
+        else:
+            pending.append((address, asyncio.ensure_future(
+                ip2asn_async(res, address, sem, cache, inflight))))
+        await flush(window)
+    await flush(0)
+    if cache is not None:
+        if Opts.verbose:
+            print_cache_stats(cache)
+        cache.close()
+
+
 if __name__ == '__main__':
 
-    if len(sys.argv) != 2:
-        usage()
+    args = process_args(sys.argv[1:])
+
+    if Opts.build is not None:
+        with open(Opts.build, 'wb') as out:
+            if args[0] == "-":
+                counts = build_index(sys.stdin, out)
+            else:
+                with open(args[0]) as f:
+                    counts = build_index(f, out)
+        print("Indexed {} prefixes, skipped {} lines".format(*counts))
+        sys.exit(0)
 
-    address = sys.argv[1]
-    res = get_resolver()
+    if Opts.prune:
+        cache = PersistentCache(Opts.persistent)
+        print("Pruned {} expired entries".format(cache.prune()))
+        cache.close()
+        sys.exit(0)
+
+    index = PrefixIndex(Opts.index) if Opts.index else None
+
+    if Opts.infile is not None:
+        f = sys.stdin if Opts.infile == "-" else open(Opts.infile)
+        if index:
+            bulk_lookup_offline(index, f, sys.stdout)
+        else:
+            asyncio.run(bulk_lookup(f, sys.stdout))
+        sys.exit(0)
+
+    address = args[0]
+    cache = None
+    if index:
+        res = index
+    else:
+        res = get_resolver(timeout=TIMEOUT)
+        if Opts.server:
+            set_server(res, Opts.server)
+        cache = make_cache()
 
-    print(ip2asn(res, address))
+    print(ip2asn(res, address, cache))
+    if cache is not None:
+        if Opts.verbose:
+            print_cache_stats(cache)
+        cache.close()
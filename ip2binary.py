@@ -11,9 +11,96 @@ $ ip2binary.py 128.91.2.13
 $ ip2binary.py 2001:4860:4860::8844
 00100000000000010100100001100000010010000110000000000000000000000000000000000000000000000000000000000000000000001000100001000100
 
+In bulk mode (-f), addresses are read one per line, and converted in
+batches with NumPy: IPv4 addresses as uint32 arrays, and IPv6 as pairs
+of uint64. Output is bit strings in input order (default), or raw
+packed network order binary (-p), optionally sorted and deduplicated
+(-u, which outputs IPv4 before IPv6). With -a the addresses are
+instead aggregated into the minimal set of covering CIDR prefixes.
+
+$ printf '10.0.0.0\\n10.0.0.1\\n10.0.0.2\\n' | ip2binary.py -a -f -
+10.0.0.0/31
+10.0.0.2/32
+
 """
 
-import sys, socket
+import os
+import sys
+import getopt
+import socket
+import itertools
+
+import numpy as np
+
+
+PROGNAME = os.path.basename(sys.argv[0])
+
+BATCH_SIZE = 1000000
+
+
+# Options with initialized defaults
+class Opts:
+    infile = None
+    packed = False
+    unique = False
+    aggregate = False
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+    print("""\
+Usage: {0} <address>
+       {0} [Options] -f <file|->
+
+       Options:
+       -h          Print this help string
+       -f file     Bulk mode: read addresses from file ("-" for stdin)
+       -p          Output packed binary, in network byte order
+       -u          Sort and deduplicate output (IPv4 before IPv6)
+       -a          Aggregate addresses into minimal set of CIDR prefixes
+       -b N        Addresses per batch (default {1})
+""".format(PROGNAME, BATCH_SIZE))
+    sys.exit(1)
+
+
+def process_args(arguments):
+    """Process command line arguments"""
+
+    global BATCH_SIZE
+
+    try:
+        (options, args) = getopt.getopt(arguments, "hf:puab:")
+    except getopt.GetoptError as exc_info:
+        usage(exc_info)
+
+    try:
+        for (opt, optval) in options:
+            if opt == "-h":
+                usage()
+            elif opt == "-f":
+                Opts.infile = optval
+            elif opt == "-p":
+                Opts.packed = True
+            elif opt == "-u":
+                Opts.unique = True
+            elif opt == "-a":
+                Opts.aggregate = True
+            elif opt == "-b":
+                BATCH_SIZE = int(optval)
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
+
+    if Opts.infile is None:
+        if len(args) != 1 or Opts.packed or Opts.unique or Opts.aggregate:
+            usage()
+    elif args:
+        usage("No address arguments allowed in bulk mode")
+    if BATCH_SIZE < 1:
+        usage("Batch size must be at least 1")
+    return args
 
 
 def ip2binary(address):
@@ -24,13 +111,240 @@ def ip2binary(address):
     else:
         raise ValueError("{} isn't an IP address".format(address))
 
-    binary_string = ''
-    for i in packed:
-        binary_string += "{:08b}".format(i)
-    return binary_string
+    return "{:0{}b}".format(int.from_bytes(packed, 'big'), len(packed) * 8)
+
+
+def parse_batch(lines):
+    """
+    Parse batch of address lines. Returns uint32 array of IPv4
+    addresses, (N, 2) uint64 array of IPv6 addresses (high and low
+    halves), the address family of each parsed line in input order,
+    and the number of lines that could not be parsed.
+    """
+
+    pton = socket.inet_pton
+    v4, v6 = [], []
+    families = bytearray()
+    errors = 0
+    for line in lines:
+        address = line.strip()
+        if not address:
+            continue
+        try:
+            if address.find(':') != -1:
+                v6.append(pton(socket.AF_INET6, address))
+                families.append(6)
+            else:
+                v4.append(pton(socket.AF_INET, address))
+                families.append(4)
+        except OSError:
+            errors += 1
+    return (np.frombuffer(b"".join(v4), dtype='>u4').astype(np.uint32),
+            np.frombuffer(b"".join(v6), dtype='>u8').astype(
+                np.uint64).reshape(-1, 2),
+            np.frombuffer(bytes(families), dtype=np.uint8), errors)
+
+
+def to_packed(addresses):
+    """Return network order bytes of uint32 or (N, 2) uint64 array"""
+
+    return addresses.astype(addresses.dtype.newbyteorder('>')).tobytes()
+
+
+def to_bits(addresses):
+    """
+    Return (N, width + 1) uint8 array of ASCII bit strings, each
+    terminated by a newline, for uint32 or (N, 2) uint64 array.
+    """
+
+    width = addresses.dtype.itemsize * 8 * (
+        addresses.shape[1] if addresses.ndim == 2 else 1)
+    octets = np.frombuffer(to_packed(addresses), dtype=np.uint8)
+    bits = np.unpackbits(octets).reshape(len(addresses), width)
+    lines = np.empty((bits.shape[0], bits.shape[1] + 1), dtype=np.uint8)
+    lines[:, :-1] = bits + ord('0')
+    lines[:, -1] = ord('\n')
+    return lines
+
+
+def sort_unique(addresses):
+    """Return sorted unique rows of uint32 or (N, 2) uint64 array"""
+
+    if addresses.ndim == 1:
+        addresses = np.sort(addresses)
+        keep = addresses[1:] != addresses[:-1]
+    else:
+        addresses = addresses[np.lexsort((addresses[:, 1],
+                                          addresses[:, 0]))]
+        keep = np.any(addresses[1:] != addresses[:-1], axis=1)
+    return addresses[np.concatenate(([True], keep))] if len(addresses) \
+        else addresses
+
+
+def write_batch(out, v4, v6, families=None):
+    """
+    Write batch of addresses in input order, given by families, or
+    if that is None, all IPv4 addresses before IPv6 addresses.
+    """
+
+    convert = to_packed if Opts.packed else to_bits
+    if families is None or not len(v6) or not len(v4):
+        out.write(convert(v4))
+        out.write(convert(v6))
+    else:
+        width = {4: 4, 6: 16} if Opts.packed else {4: 33, 6: 129}
+        data = {4: memoryview(convert(v4)).cast('B'),
+                6: memoryview(convert(v6)).cast('B')}
+        offset = {4: 0, 6: 0}
+        for family in families.tolist():
+            start = offset[family]
+            offset[family] = start + width[family]
+            out.write(data[family][start:offset[family]])
+
+
+def range_to_cidrs(start, end, bits):
+    """
+    Decompose inclusive integer address ranges (uint64 arrays) into
+    CIDR prefixes, working on all ranges at once. Returns arrays of
+    prefix start values and prefix lengths, sorted by start.
+    """
+
+    starts, lengths = [], []
+    start = start.astype(np.uint64)
+    remaining = end.astype(np.uint64) - start + np.uint64(1)
+    while len(start):
+        # Largest aligned block at start that fits in the range
+        align = start & (~start + np.uint64(1))
+        align[start == 0] = np.uint64(1) << np.uint64(bits)
+        _, exponent = np.frexp(remaining.astype(np.float64))
+        fit = np.uint64(1) << (exponent - 1).astype(np.uint64)
+        size = np.minimum(align, fit)
+        _, exponent = np.frexp(size.astype(np.float64))
+        starts.append(start)
+        lengths.append(bits - (exponent - 1))
+        start = start + size
+        remaining = remaining - size
+        active = remaining > 0
+        start, remaining = start[active], remaining[active]
+    if not starts:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    starts = np.concatenate(starts)
+    order = np.argsort(starts, kind='stable')
+    return starts[order], np.concatenate(lengths)[order]
+
+
+def format_v4_prefixes(starts, lengths):
+    """
+    Return text lines for IPv4 prefixes, built with table lookups:
+    each octet and length is rendered into a NUL padded cell, and
+    the NUL bytes are then dropped.
+    """
+
+    cells = np.zeros((256, 4), dtype=np.uint8)
+    for value in range(256):
+        text = str(value).encode()
+        cells[value, :len(text)] = np.frombuffer(text, dtype=np.uint8)
+    octet_cells = cells.copy()
+    octet_cells[np.arange(256), [len(str(v)) for v in range(256)]] = ord('.')
+    last_cells = octet_cells.copy()
+    last_cells[last_cells == ord('.')] = ord('/')
+    length_cells = cells[:33].copy()
+    length_cells[np.arange(33), [len(str(v)) for v in range(33)]] = \
+        ord('\n')
+
+    octets = np.frombuffer(to_packed(starts.astype(np.uint32)),
+                           dtype=np.uint8).reshape(-1, 4)
+    text = np.concatenate((octet_cells[octets[:, :3]].reshape(-1, 12),
+                           last_cells[octets[:, 3]],
+                           length_cells[lengths]), axis=1).ravel()
+    return text[text != 0].tobytes()
+
+
+def aggregate_v4(addresses):
+    """Return minimal CIDR prefix lines covering sorted unique IPv4 array"""
+
+    if not len(addresses):
+        return b""
+    values = addresses.astype(np.uint64)
+    breaks = np.flatnonzero(np.diff(values) != 1) + 1
+    run_starts = values[np.concatenate(([0], breaks))]
+    run_ends = values[np.concatenate((breaks - 1, [len(values) - 1]))]
+    return format_v4_prefixes(*range_to_cidrs(run_starts, run_ends, 32))
+
+
+def aggregate_v6(addresses):
+    """
+    Return minimal CIDR prefix lines covering sorted unique (N, 2) IPv6
+    array. Runs of consecutive addresses are found with NumPy; since
+    they are rare in IPv6 data, runs are split into prefixes with
+    Python integers rather than 128-bit vector arithmetic.
+    """
+
+    if not len(addresses):
+        return b""
+    high, low = addresses[:, 0], addresses[:, 1]
+    consecutive = ((high[1:] == high[:-1]) & (low[1:] == low[:-1] + 1)) | \
+        ((high[1:] == high[:-1] + 1) & (low[1:] == 0) &
+         (low[:-1] == np.uint64(2**64 - 1)))
+    breaks = np.flatnonzero(~consecutive) + 1
+    firsts = np.concatenate(([0], breaks)).tolist()
+    lasts = np.concatenate((breaks - 1, [len(addresses) - 1])).tolist()
+    high, low = high.tolist(), low.tolist()
+    prefixes = []
+    for first, last in zip(firsts, lasts):
+        start = (high[first] << 64) | low[first]
+        end = (high[last] << 64) | low[last]
+        while start <= end:
+            size = min(start & -start or 2**128,
+                       1 << ((end - start + 1).bit_length() - 1))
+            prefixes.append("{}/{}\n".format(
+                socket.inet_ntop(socket.AF_INET6, start.to_bytes(16, 'big')),
+                129 - size.bit_length()))
+            start += size
+    return "".join(prefixes).encode()
+
+
+def bulk_convert(infile, out):
+    """Convert all addresses in infile, returning count of bad lines"""
+
+    errors = 0
+    v4_batches, v6_batches = [], []
+    while True:
+        lines = list(itertools.islice(infile, BATCH_SIZE))
+        if not lines:
+            break
+        v4, v6, families, batch_errors = parse_batch(lines)
+        errors += batch_errors
+        if Opts.unique or Opts.aggregate:
+            v4_batches.append(sort_unique(v4))
+            v6_batches.append(sort_unique(v6))
+        else:
+            write_batch(out, v4, v6, families)
+
+    if not (Opts.unique or Opts.aggregate):
+        return errors
+    v4 = sort_unique(np.concatenate(v4_batches or
+                                    [np.empty(0, dtype=np.uint32)]))
+    v6 = sort_unique(np.concatenate(v6_batches or
+                                    [np.empty((0, 2), dtype=np.uint64)]))
+    if Opts.aggregate:
+        out.write(aggregate_v4(v4))
+        out.write(aggregate_v6(v6))
+    else:
+        write_batch(out, v4, v6)
+    return errors
 
 
 if __name__ == '__main__':
 
-    address = sys.argv[1]
-    print(ip2binary(address))
+    args = process_args(sys.argv[1:])
+
+    if Opts.infile is None:
+        print(ip2binary(args[0]))
+        sys.exit(0)
+
+    infile = sys.stdin if Opts.infile == "-" else open(Opts.infile)
+    count = bulk_convert(infile, sys.stdout.buffer)
+    if count:
+        print("WARN: {} lines were not IP addresses".format(count),
+              file=sys.stderr)
@@ -4,75 +4,474 @@
 """
 Print statistics from a BIND 9.x format zone journal file.
 
-This program processes the output of "named-journalprint -x" on
-a BIND journal file, and prints out statistics for number of
-serial update transactions and record count and sizes per
-transaction.
+This program reads a BIND journal (.jnl) file directly, and prints
+out statistics for number of serial update transactions and record
+count and sizes per transaction. The journal is memory mapped, and
+only the journal and transaction headers are parsed; the records
+themselves are skipped over without being decoded. Both the original
+("BIND LOG V9") and the current ("BIND LOG V9.2") journal formats are
+supported.
 
-Lines processed are like:
-Transaction: version 2 offset 168601825 size 3914 rrcount 26 start 2013178356 end 2013178357
+    journalinfo.py zonefile.jnl
 
-One way to run this program is the following (bash shell syntax):
+It also still accepts the output of "named-journalprint -x" on a
+journal file, on standard input or as a file, with lines like:
+Transaction: version 2 offset 168601825 size 3914 rrcount 26 start 2013178356 end 2013178357
 
     journalinfo.py <(named-journalprint -x zonefile.jnl)
 
+Statistics are computed in a single pass in constant memory: mean
+and standard deviation with Welford's method, and the quantiles from
+a mergeable logarithmic bucket sketch (as DDSketch), accurate to 1%.
+
+With -w, the transaction, record and byte rates per window of that
+many seconds are printed too. The journal has no timestamps, so the
+end serial of each transaction is taken as its time, which is right
+for zones using unixtime serials (serial-update-method unixtime).
+
+In follow mode (-f), the journal is watched for new transactions,
+and their rates per window (default 60 seconds) of wall clock time
+are printed as they arrive, until interrupted.
+
 """
 
 
+import os
 import sys
 import re
+import math
+import time
+import mmap
+import struct
+import getopt
+import itertools
 import numpy as np
 
 
-REGEXP = r'^Transaction: version (?P<version>\d+) ' \
-    r'offset (?P<offset>\d+) size (?P<size>\d+) ' \
-    r'rrcount (?P<rrcount>\d+) start (?P<start>\d+) end (?P<end>\d+)$'
+PROGNAME = os.path.basename(sys.argv[0])
+
+REGEXP = re.compile(
+    r'^Transaction: version (?P<version>\d+) '
+    r'offset (?P<offset>\d+) size (?P<size>\d+) '
+    r'rrcount (?P<rrcount>\d+) start (?P<start>\d+) end (?P<end>\d+)$')
+
+# Journal file format identifiers (NUL padded to 16 bytes), and the
+# transaction header version each implies
+JOURNAL_FORMATS = {
+    b'BIND LOG V9\n': 1,
+    b'BIND LOG V9.2\n': 2,
+}
+
+# Journal header, padded to 64 bytes: format, first transaction (serial,
+# offset), end of last transaction (serial, offset), index size, source
+# serial, flags. Index entries of (serial, offset) follow.
+JOURNAL_HEADER = struct.Struct('!16sIIIIIIB')
+JOURNAL_HEADER_SIZE = 64
+
+# Transaction header: size (excluding header), record count (version 2
+# only), serial before and after the update. Each record that follows
+# is prefixed by its size.
+TRANSACTION_HEADERS = {
+    1: struct.Struct('!III'),
+    2: struct.Struct('!IIII'),
+}
+RR_HEADER = struct.Struct('!I')
+
+BATCH_SIZE = 65536
+SKETCH_ACCURACY = 0.01
+FOLLOW_WINDOW = 60
+POLL_INTERVAL = 1.0
+
+
+# Options with initialized defaults
+class Opts:
+    window = None
+    follow = False
+    interval = POLL_INTERVAL
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+    print("""\
+Usage: {0} [Options] [journalfile]
+
+       Options:
+       -h          Print this help string
+       -w secs     Print update rates per window of secs seconds
+                   (serials are taken as times, unless following)
+       -f          Follow journal file, printing rates of new updates
+                   (window default {1} seconds) until interrupted
+       -i secs     Poll interval in follow mode (default {2})
+""".format(PROGNAME, FOLLOW_WINDOW, POLL_INTERVAL))
+    sys.exit(1)
+
+
+def process_args(arguments):
+    """Process command line arguments"""
+
+    try:
+        (options, args) = getopt.getopt(arguments, "hw:fi:")
+    except getopt.GetoptError as exc_info:
+        usage(exc_info)
+
+    try:
+        for (opt, optval) in options:
+            if opt == "-h":
+                usage()
+            elif opt == "-w":
+                Opts.window = int(optval)
+            elif opt == "-f":
+                Opts.follow = True
+            elif opt == "-i":
+                Opts.interval = float(optval)
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
+
+    if len(args) > 1:
+        usage()
+    if Opts.window is not None and Opts.window < 1:
+        usage("Window must be at least 1 second")
+    if Opts.follow:
+        if not args:
+            usage("Follow mode needs a journal file")
+        if Opts.window is None:
+            Opts.window = FOLLOW_WINDOW
+    return args
+
+
+def journal_version(data):
+    """Return journal format version of file data, or None if not a journal"""
+
+    return JOURNAL_FORMATS.get(bytes(data[:16]).rstrip(b'\0'))
+
+
+def read_header(data):
+    """Return dictionary of journal header fields"""
+
+    (_, begin_serial, begin_offset, end_serial, end_offset, index_size,
+     source_serial, _) = JOURNAL_HEADER.unpack_from(data)
+    return {
+        'version': journal_version(data),
+        'begin_serial': begin_serial,
+        'begin_offset': begin_offset,
+        'end_serial': end_serial,
+        'end_offset': end_offset,
+        'index_size': index_size,
+        'source_serial': source_serial,
+    }
+
+
+def count_records(data, offset, end):
+    """Count records between offset and end by their size prefixes"""
+
+    count = 0
+    while offset < end:
+        offset += RR_HEADER.size + RR_HEADER.unpack_from(data, offset)[0]
+        count += 1
+    return count
+
+
+def journal_transactions(data, header, offset=None):
+    """
+    Generate (version, offset, size, rrcount, start, end) of every
+    transaction in the journal data (from offset, if given), reading
+    only transaction headers. Version 1 headers have no record count,
+    so those transactions' records are counted by their size prefixes.
+    """
 
+    version = header['version']
+    xhdr = TRANSACTION_HEADERS[version]
+    if offset is None:
+        offset = header['begin_offset']
+    end = header['end_offset']
+    if end > len(data):
+        raise ValueError("journal is truncated")
+    while offset < end:
+        if version == 2:
+            size, rrcount, start, stop = xhdr.unpack_from(data, offset)
+        else:
+            size, start, stop = xhdr.unpack_from(data, offset)
+        next_offset = offset + xhdr.size + size
+        if next_offset > end:
+            raise ValueError("transaction at offset {} overruns "
+                             "journal".format(offset))
+        if version == 1:
+            rrcount = count_records(data, offset + xhdr.size, next_offset)
+        yield version, offset, size, rrcount, start, stop
+        offset = next_offset
 
-def named_subgroup(matchobject, name):
-    """Return value from regex named subgroup"""
 
-    return matchobject.groupdict()[name]
+def text_transactions(infile):
+    """Generate transactions from "named-journalprint -x" output lines"""
 
+    match = REGEXP.match
+    for line in infile:
+        m = match(line.rstrip('\n'))
+        if m is not None:
+            yield tuple(map(int, m.groups()))
 
-def print_stats(name, array):
+
+def serial_gt(serial1, serial2):
+    """Return whether serial1 is after serial2, in serial arithmetic"""
+
+    return 0 < (serial1 - serial2) % 2**32 < 2**31
+
+
+class StreamingStats:
+    """
+    Count, min, max, mean and standard deviation of a stream of values,
+    and their quantiles to within the given relative accuracy, in
+    constant memory. Values are counted in logarithmic buckets of ratio
+    gamma, and a quantile is estimated as the middle of its bucket.
+    Statistics of separate streams can be merged. Values must be 0 or
+    at least 1, as sizes and counts are, so that bucket keys are never
+    negative.
+    """
+
+    def __init__(self, accuracy=SKETCH_ACCURACY):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = self.max = None
+        self.zeros = 0
+        self.buckets = np.zeros(0, dtype=np.int64)
+
+    def _combine(self, count, mean, m2, low, high, zeros, buckets):
+        """Merge in moments and buckets of another set of values"""
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self.zeros += zeros
+        if len(buckets) > len(self.buckets):
+            self.buckets = np.pad(self.buckets,
+                                  (0, len(buckets) - len(self.buckets)))
+        self.buckets[:len(buckets)] += buckets
+
+    def update(self, values):
+        """Add sequence of values"""
+
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        if values.min() < 0 or np.any((values > 0) & (values < 1)):
+            raise ValueError("values must be 0 or at least 1")
+        mean = values.mean()
+        positive = values[values > 0]
+        keys = np.ceil(np.log(positive) / self.log_gamma).astype(np.int64)
+        self._combine(len(values), mean, ((values - mean) ** 2).sum(),
+                      values.min(), values.max(),
+                      len(values) - len(positive), np.bincount(keys))
+
+    def merge(self, other):
+        """Add statistics of other, which must have the same accuracy"""
+
+        if other.gamma != self.gamma:
+            raise ValueError("can't merge sketches of different accuracy")
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min,
+                          other.max, other.zeros, other.buckets)
+
+    def std(self):
+        return math.sqrt(self.m2 / self.count)
+
+    def quantile(self, q):
+        """Return estimate of q quantile (0 <= q <= 1)"""
+
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        key = int(np.searchsorted(np.cumsum(self.buckets),
+                                  rank - self.zeros, side='right'))
+        estimate = 2 * self.gamma ** key / (self.gamma + 1)
+        return min(max(estimate, self.min), self.max)
+
+
+class RateWindows:
+    """
+    Print transaction, record and byte rates per fixed length window
+    of time, in seconds: either wall clock time, or for zones using
+    unixtime serials, the end serial of each transaction.
+    """
+
+    def __init__(self, length, out=sys.stdout):
+        self.length = length
+        self.out = out
+        self.start = None
+        self.transactions = self.rrs = self.bytes = 0
+        self.serial = None
+        self.header = False
+
+    def advance(self, when):
+        """Move to window containing time when, printing finished ones"""
+
+        window = int(when) - int(when) % self.length
+        if self.start is not None and window > self.start:
+            self.flush()
+        if self.start is None or window > self.start:
+            self.start = window
+
+    def add(self, when, rrcount, size, serial):
+        self.advance(when)
+        self.transactions += 1
+        self.rrs += rrcount
+        self.bytes += size
+        self.serial = serial
+
+    def flush(self):
+        """Print rates of current window"""
+
+        if self.start is None:
+            return
+        if not self.header:
+            print("{:<20} {:>10} {:>10} {:>12}  {}".format(
+                "Window (UTC)", "Txns/s", "RRs/s", "Bytes/s", "Last serial"),
+                file=self.out)
+            self.header = True
+        print("{:<20} {:>10.2f} {:>10.2f} {:>12.1f}  {}".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(self.start)),
+            self.transactions / self.length, self.rrs / self.length,
+            self.bytes / self.length,
+            "-" if self.serial is None else self.serial), file=self.out)
+        self.out.flush()
+        self.transactions = self.rrs = self.bytes = 0
+
+
+def process_transactions(transactions, rrcounts, sizes, windows=None,
+                         clock=None):
+    """
+    Add record counts and sizes of transactions to the statistics, in
+    batches, and to the rate windows if given, timed by clock() or else
+    by end serial. Returns the last transaction, or None.
+    """
+
+    last = None
+    while True:
+        batch = list(itertools.islice(transactions, BATCH_SIZE))
+        if not batch:
+            return last
+        _, _, size, rrcount, _, end = zip(*batch)
+        rrcounts.update(rrcount)
+        sizes.update(size)
+        if windows is not None:
+            for i, serial in enumerate(end):
+                windows.add(clock() if clock else serial, rrcount[i],
+                            size[i], serial)
+        last = batch[-1]
+
+
+def follow_journal(path, rrcounts, sizes, windows, interval):
+    """
+    Follow journal, adding transactions appended to it to statistics
+    and wall clock rate windows, until interrupted. When the journal
+    is replaced (as BIND does when compacting it), reading resumes at
+    the first transaction after the last serial seen.
+    """
+
+    inode = offset = serial = None
+    while True:
+        try:
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != inode:
+                    inode, offset = st.st_ino, None
+                if st.st_size >= JOURNAL_HEADER_SIZE:
+                    with mmap.mmap(f.fileno(), 0,
+                                   access=mmap.ACCESS_READ) as data:
+                        header = read_header(data)
+                        if header['version'] is None:
+                            raise ValueError("not a journal file")
+                        if offset is not None and \
+                           not header['begin_offset'] <= offset <= \
+                           header['end_offset']:
+                            offset = None
+                        transactions = journal_transactions(data, header,
+                                                            offset)
+                        if offset is None and serial is not None:
+                            transactions = (t for t in transactions
+                                            if serial_gt(t[5], serial))
+                        last = process_transactions(
+                            transactions, rrcounts, sizes,
+                            windows if inode is not None and
+                            serial is not None else None, time.time)
+                        if last is not None:
+                            version, offset, size = last[:3]
+                            offset += TRANSACTION_HEADERS[version].size + size
+                            serial = last[5]
+                        elif offset is None:
+                            offset = header['end_offset']
+                            serial = header['end_serial']
+        except (OSError, ValueError, struct.error) as e:
+            print("WARN: {}: {}".format(path, e), file=sys.stderr)
+            inode = offset = None
+        windows.advance(time.time())
+        time.sleep(interval)
+
+
+def print_stats(name, stats):
     """Print statistics"""
 
     print(f"Stat name: {name}:")
-    print("\tmin = {}".format(np.min(array)))
-    print("\tmax = {}".format(np.max(array)))
-    print("\tmean = {:.1f}".format(np.mean(array)))
-    print("\tmedian = {:.1f}".format(np.median(array)))
-    print("\tstd = {:.1f}".format(np.std(array)))
+    print("\tmin = {}".format(int(stats.min)))
+    print("\tmax = {}".format(int(stats.max)))
+    print("\tmean = {:.1f}".format(stats.mean))
+    print("\tmedian = {:.1f}".format(stats.quantile(0.5)))
+    print("\tstd = {:.1f}".format(stats.std()))
+    print("\tp95 = {:.1f}".format(stats.quantile(0.95)))
+    print("\tp99 = {:.1f}".format(stats.quantile(0.99)))
 
 
 if __name__ == '__main__':
 
-    ARGLEN = len(sys.argv)
-    if ARGLEN > 2:
-        print("Usage: journalinfo [journalfile]")
-        sys.exit(1)
-    elif ARGLEN == 2:
-        INFILE = open(sys.argv[1], 'r')
+    args = process_args(sys.argv[1:])
+    if args:
+        INFILE = open(args[0], 'rb')
+        if journal_version(INFILE.read(16)) is None:
+            INFILE.close()
+            if Opts.follow:
+                usage("Follow mode needs a journal file")
+            INFILE = open(args[0], 'r')
     else:
         INFILE = sys.stdin
 
-    values_rrcount = []
-    values_size = []
-
-    for line in INFILE:
-        line = line.rstrip('\n')
-        m = re.search(REGEXP, line)
-        if m is None:
-            continue
-        rrcount = int(named_subgroup(m, 'rrcount'))
-        size = int(named_subgroup(m, 'size'))
-        values_rrcount.append(rrcount)
-        values_size.append(size)
+    rrcounts, sizes = StreamingStats(), StreamingStats()
+    windows = RateWindows(Opts.window) if Opts.window else None
+    if Opts.follow:
+        INFILE.close()
+        try:
+            follow_journal(args[0], rrcounts, sizes, windows, Opts.interval)
+        except KeyboardInterrupt:
+            windows.flush()
+    elif INFILE.mode == 'rb':
+        with mmap.mmap(INFILE.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header = read_header(data)
+            print("Journal: format version {}, serials {} to {}, "
+                  "{} index entries".format(
+                      header['version'], header['begin_serial'],
+                      header['end_serial'], header['index_size']))
+            try:
+                process_transactions(journal_transactions(data, header),
+                                     rrcounts, sizes, windows)
+            except (ValueError, struct.error) as e:
+                print("ERROR: {}: {}".format(args[0], e))
+                sys.exit(2)
+    else:
+        process_transactions(text_transactions(INFILE), rrcounts, sizes,
+                             windows)
+    if windows is not None and not Opts.follow:
+        windows.flush()
 
     print('\nStats:')
-    values_rrcount = np.array(values_rrcount)
-    values_size = np.array(values_size)
-    print("#Serial Updates: {}".format(values_rrcount.size))
-    print_stats("rrcount", values_rrcount)
-    print_stats("size", values_size)
+    print("#Serial Updates: {}".format(rrcounts.count))
+    if rrcounts.count:
+        print_stats("rrcount", rrcounts)
+        print_stats("size", sizes)
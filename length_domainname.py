@@ -1,13 +1,301 @@
 #!/usr/bin/python3
 #
 
+"""
+Print the uncompressed wire length of a domain name and its labels.
+
+With -f, a zone in presentation format (one RR per line, as output by
+dig AXFR or named-compilezone) is read instead, and the wire size of
+the response to a query for every (owner, type) pair in it is
+predicted, by rendering the response with DNS name compression. The
+responses are modelled as minimal ones (answer RRset only), with an
+EDNS OPT record, and unless -D is given, the DO bit set and the
+covering RRSIGs in the answer. With -x, NODATA responses for every
+owner name are estimated too: the apex SOA and the NSEC (or matching
+NSEC3) record in the authority section, with their RRSIGs.
+
+The distribution of response sizes is printed, with counts of the
+responses exceeding each threshold (-t, default 512, 1232 and 1420
+bytes), and the largest responses.
+
+"""
+
+import os
 import sys
+import getopt
+import heapq
+from collections import Counter
 import dns.name
+import dns.flags
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.renderer
+import dns.rrset
+import dns.dnssec
+import dns.exception
+
+from zonelines import split_record, owner_groups
+
+
+PROGNAME = os.path.basename(sys.argv[0])
+
+THRESHOLDS = [512, 1232, 1420]
+LARGEST = 20
+BUCKET_SIZE = 128
+EDNS_PAYLOAD = 1232
+
+
+# Options with initialized defaults
+class Opts:
+    infile = None
+    dnssec = True
+    denial = False
+    thresholds = THRESHOLDS
+    largest = LARGEST
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+    print("""\
+Usage: {0} <domainname>
+       {0} [Options] -f <zonefile|->
+
+       Options:
+       -h          Print this help string
+       -f file     Estimate response sizes for zone file ("-" for stdin)
+       -D          Leave out DNSSEC: no DO bit, no RRSIGs
+       -x          Also estimate NODATA responses with denial records
+       -t N,...    Size thresholds to report (default {1})
+       -l N        Number of largest responses to list (default {2})
+""".format(PROGNAME, ",".join(str(t) for t in THRESHOLDS), LARGEST))
+    sys.exit(1)
+
+
+def process_args(arguments):
+    """Process command line arguments"""
+
+    try:
+        (options, args) = getopt.getopt(arguments, "hf:Dxt:l:")
+    except getopt.GetoptError as exc_info:
+        usage(exc_info)
+
+    try:
+        for (opt, optval) in options:
+            if opt == "-h":
+                usage()
+            elif opt == "-f":
+                Opts.infile = optval
+            elif opt == "-D":
+                Opts.dnssec = False
+            elif opt == "-x":
+                Opts.denial = True
+            elif opt == "-t":
+                Opts.thresholds = sorted(int(t) for t in optval.split(','))
+            elif opt == "-l":
+                Opts.largest = int(optval)
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
+
+    if Opts.infile is None:
+        if len(args) != 1:
+            usage()
+    elif args:
+        usage("No domain name argument allowed with -f")
+    return args
+
+
+def print_name_length(name):
+    """Print uncompressed wire length of name, and of its labels"""
+
+    n = dns.name.from_text(name)
+    labels = n.labels
+    wire = n.to_digestable()
+    print(len(wire))
+    print(wire)
+    for label in labels:
+        print(label, len(label)+1)
+
+
+def response_size(qname, rdtype, answer=(), authority=(), dnssec=True):
+    """
+    Return wire size of a response to a query for qname and rdtype,
+    with the given answer and authority section RRsets, rendered with
+    name compression.
+    """
+
+    r = dns.renderer.Renderer(0, dns.flags.QR | dns.flags.AA)
+    r.add_question(qname, rdtype)
+    for rrset in answer:
+        r.add_rrset(dns.renderer.ANSWER, rrset)
+    for rrset in authority:
+        r.add_rrset(dns.renderer.AUTHORITY, rrset)
+    r.add_edns(0, dns.flags.DO if dnssec else 0, EDNS_PAYLOAD)
+    r.write_header()
+    return len(r.get_wire())
+
+
+def parse_group(lines, origin):
+    """
+    Return owner name, and dictionaries of RRsets and of RRSIG RRsets
+    by (covered) type, of a group of RR lines with the same owner.
+    """
+
+    rrsets, rrsigs = {}, {}
+    name = None
+    for line in lines:
+        record = split_record(line)
+        if record is None:
+            continue
+        owner, rdtype, text = record
+        name = dns.name.from_text(owner, origin)
+        rdtype = dns.rdatatype.from_text(rdtype)
+        rdata = dns.rdata.from_text(dns.rdataclass.IN, rdtype, text,
+                                    origin=origin, relativize=False)
+        if rdtype == dns.rdatatype.RRSIG:
+            table, key = rrsigs, rdata.type_covered
+        else:
+            table, key = rrsets, rdtype
+        if key not in table:
+            table[key] = dns.rrset.RRset(name, dns.rdataclass.IN, rdtype)
+        table[key].add(rdata)
+    return name, rrsets, rrsigs
+
+
+class SizeReport:
+    """Response size distribution, threshold counts and largest sizes"""
+
+    def __init__(self, thresholds=THRESHOLDS, largest=LARGEST):
+        self.thresholds = thresholds
+        self.over = Counter()
+        self.buckets = Counter()
+        self.largest = []
+        self.nlargest = largest
+        self.count = 0
+        self.total = 0
+
+    def add(self, size, owner, rdtype):
+        self.count += 1
+        self.total += size
+        self.buckets[size // BUCKET_SIZE] += 1
+        for threshold in self.thresholds:
+            if size > threshold:
+                self.over[threshold] += 1
+        entry = (size, owner.to_text(), rdtype)
+        if len(self.largest) < self.nlargest:
+            heapq.heappush(self.largest, entry)
+        elif entry > self.largest[0]:
+            heapq.heapreplace(self.largest, entry)
+
+    def print(self):
+        print("Responses: {}, mean size {:.1f} bytes".format(
+            self.count, self.total / self.count if self.count else 0))
+        print("\nSize distribution:")
+        for bucket in sorted(self.buckets):
+            print("  {:5d}-{:<5d} {:12d} {:6.2f}%".format(
+                bucket * BUCKET_SIZE, (bucket + 1) * BUCKET_SIZE - 1,
+                self.buckets[bucket],
+                100.0 * self.buckets[bucket] / self.count))
+        print("\nOver threshold:")
+        for threshold in self.thresholds:
+            print("  > {:<5d} {:12d} {:6.2f}%".format(
+                threshold, self.over[threshold],
+                100.0 * self.over[threshold] / self.count
+                if self.count else 0))
+        if self.largest:
+            print("\nLargest responses:")
+            for size, owner, rdtype in sorted(self.largest, reverse=True):
+                exceeded = [t for t in self.thresholds if size > t]
+                print("  {:6d} {} {}{}".format(
+                    size, owner, rdtype,
+                    "  (> {})".format(max(exceeded)) if exceeded else ""))
+
+
+def estimate_zone(lines, report, dnssec=True, denial=False):
+    """
+    Add the predicted response sizes for all (owner, type) pairs of a
+    zone, streamed as RR lines with the apex first, to report. With
+    denial, NODATA responses for every owner are added too. Returns
+    the number of unparsable owner groups.
+    """
+
+    groups = owner_groups(lines)
+    origin = dns.name.root
+    soa = nsec3param = None
+    nsec3s = {}
+    pending = []
+    bad = 0
+    first = True
+    for group in groups:
+        try:
+            name, rrsets, rrsigs = parse_group(group, origin)
+        except (dns.exception.DNSException, ValueError):
+            bad += 1
+            continue
+        if first:
+            origin = name
+            if dns.rdatatype.SOA in rrsets:
+                soa = [rrsets[dns.rdatatype.SOA]]
+                if dnssec and dns.rdatatype.SOA in rrsigs:
+                    soa.append(rrsigs[dns.rdatatype.SOA])
+            nsec3param = rrsets.get(dns.rdatatype.NSEC3PARAM)
+            first = False
+        elif name == origin:
+            continue                    # closing SOA of a transfer
+        if dns.rdatatype.NSEC3 in rrsets:
+            if denial:
+                nsec3s[name.labels[0].lower()] = \
+                    _with_rrsig(rrsets, rrsigs, dns.rdatatype.NSEC3, dnssec)
+            continue
+        for rdtype, rrset in rrsets.items():
+            report.add(response_size(
+                name, rdtype, _with_rrsig(rrsets, rrsigs, rdtype, dnssec),
+                dnssec=dnssec), name, dns.rdatatype.to_text(rdtype))
+        if not denial or soa is None:
+            continue
+        if dns.rdatatype.NSEC in rrsets:
+            report.add(response_size(
+                name, dns.rdatatype.NULL, authority=soa + _with_rrsig(
+                    rrsets, rrsigs, dns.rdatatype.NSEC, dnssec),
+                dnssec=dnssec), name, "NODATA")
+        elif nsec3param is not None:
+            param = nsec3param[0]
+            pending.append((name, dns.dnssec.nsec3_hash(
+                name, param.salt, param.iterations,
+                param.algorithm).lower().encode()))
+
+    # NSEC3 records are only all known at the end of the zone
+    for name, hashed in pending:
+        nsec3 = nsec3s.get(hashed)
+        if nsec3 is not None:
+            report.add(response_size(name, dns.rdatatype.NULL,
+                                     authority=soa + nsec3, dnssec=dnssec),
+                       name, "NODATA")
+    return bad
+
+
+def _with_rrsig(rrsets, rrsigs, rdtype, dnssec):
+    """Return list of RRset of rdtype, followed by its RRSIGs if any"""
+
+    if dnssec and rdtype in rrsigs:
+        return [rrsets[rdtype], rrsigs[rdtype]]
+    return [rrsets[rdtype]]
+
+
+if __name__ == '__main__':
+
+    args = process_args(sys.argv[1:])
+    if Opts.infile is None:
+        print_name_length(args[0])
+        sys.exit(0)
 
-n = dns.name.from_text(sys.argv[1])
-labels = n.labels
-wire = n.to_digestable()
-print(len(wire))
-print(wire)
-for label in labels:
-    print(label, len(label)+1)
+    infile = sys.stdin if Opts.infile == "-" else open(Opts.infile)
+    report = SizeReport(Opts.thresholds, Opts.largest)
+    bad = estimate_zone(infile, report, Opts.dnssec, Opts.denial)
+    report.print()
+    if bad:
+        print("WARN: {} owner names could not be parsed".format(bad),
+              file=sys.stderr)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+#
+
+"""
+Continuously monitor all nameserver addresses for a set of zones,
+qnames, and qtypes, and export Prometheus style metrics.
+
+Targets are read from a file in the same JSON lines format as the
+batch mode of query_all_authservers.py. Every target is re-probed
+once per interval, and the targets are spread evenly over the
+interval rather than being probed all at once. NS and address
+caches, per-server RTT estimators, and (with -t) persistent TCP
+connections are kept across rounds.
+
+Metrics are served in the Prometheus text exposition format at
+http://<address>:<port>/metrics
+
+"""
+
+import os
+import sys
+import getopt
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import dns.exception
+import dns.rdatatype
+
+import query_all_authservers as qa
+
+
+PROGNAME = os.path.basename(sys.argv[0])
+VERSION = "0.0.1"
+
+INTERVAL = 60
+LISTEN_ADDRESS = "127.0.0.1"
+LISTEN_PORT = 9153
+VERBOSE = False
+
+RTT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+
+    print("""\
+{0} version {1}
+Usage: {0} [Options] <targetfile>
+
+       Options:
+       -h          Print this help string
+       -4          Use IPv4 transport only
+       -6          Use IPv6 transport only
+       -e          Disable EDNS (and NSID)
+       -t          Use TCP only, over persistent connections
+       -c N        Maximum in-flight queries (default {2})
+       -i N        Probe interval in seconds (default {3})
+       -l addr     Metrics listen address (default {4})
+       -p port     Metrics listen port (default {5})
+       -v          Print each probe result as a JSON line
+
+<targetfile> contains JSON lines of zone, qname, and qtype, e.g.
+  {{"zone": "example.com", "qname": "www.example.com", "qtype": "A"}}
+""".format(PROGNAME, VERSION, qa.CONCURRENCY, INTERVAL,
+           LISTEN_ADDRESS, LISTEN_PORT))
+    sys.exit(4)
+
+
+def process_args(arg_vector):
+    """Process command line options and arguments"""
+
+    global INTERVAL, LISTEN_ADDRESS, LISTEN_PORT, VERBOSE
+
+    try:
+        (options, args) = getopt.getopt(arg_vector, 'h46etc:i:l:p:v')
+    except getopt.GetoptError as exc_info:
+        usage("{}".format(exc_info))
+
+    try:
+        for (opt, optval) in options:
+            if opt == "-h":
+                usage()
+            elif opt == "-4":
+                qa.IP_RRTYPES = [dns.rdatatype.A]
+            elif opt == "-6":
+                qa.IP_RRTYPES = [dns.rdatatype.AAAA]
+            elif opt == "-e":
+                qa.EDNS = False
+            elif opt == "-t":
+                qa.TCP_ONLY = True
+            elif opt == "-c":
+                qa.CONCURRENCY = int(optval)
+            elif opt == "-i":
+                INTERVAL = float(optval)
+            elif opt == "-l":
+                LISTEN_ADDRESS = optval
+            elif opt == "-p":
+                LISTEN_PORT = int(optval)
+            elif opt == "-v":
+                VERBOSE = True
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
+
+    if len(args) != 1:
+        usage("Missing target file argument")
+    if INTERVAL <= 0 or qa.CONCURRENCY < 1:
+        usage("Interval and concurrency must be positive")
+
+    return args[0]
+
+
+def format_labels(labels):
+    """Return Prometheus label set string for tuple of (name, value)"""
+
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in labels) + "}"
+
+
+class Metrics:
+    """
+    Thread safe store of counters, gauges and histograms, keyed by
+    metric name and label set, rendered in Prometheus text format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.types = {}
+        self.values = {}
+
+    def declare(self, name, mtype, helptext):
+        """Declare metric type and help string"""
+
+        self.types[name] = mtype
+        self.help[name] = helptext
+        self.values[name] = {}
+
+    def inc(self, name, labels=(), value=1):
+        """Increment counter"""
+
+        with self.lock:
+            series = self.values[name]
+            series[labels] = series.get(labels, 0) + value
+
+    def set(self, name, labels=(), value=0):
+        """Set gauge value"""
+
+        with self.lock:
+            self.values[name][labels] = value
+
+    def observe(self, name, labels=(), value=0.0):
+        """Add observation to histogram"""
+
+        with self.lock:
+            series = self.values[name]
+            hist = series.get(labels)
+            if hist is None:
+                hist = series[labels] = [[0] * len(RTT_BUCKETS), 0, 0.0]
+            for i, bound in enumerate(RTT_BUCKETS):
+                if value <= bound:
+                    hist[0][i] += 1
+            hist[1] += 1
+            hist[2] += value
+
+    def render(self):
+        """Return metrics in Prometheus text exposition format"""
+
+        lines = []
+        with self.lock:
+            for name, series in self.values.items():
+                lines.append("# HELP {} {}".format(name, self.help[name]))
+                lines.append("# TYPE {} {}".format(name, self.types[name]))
+                for labels, value in sorted(series.items()):
+                    if self.types[name] != "histogram":
+                        lines.append("{}{} {}".format(
+                            name, format_labels(labels), value))
+                        continue
+                    buckets, count, total = value
+                    for bound, bcount in zip(RTT_BUCKETS, buckets):
+                        lines.append("{}_bucket{} {}".format(
+                            name, format_labels(labels + (("le", bound),)),
+                            bcount))
+                    lines.append("{}_bucket{} {}".format(
+                        name, format_labels(labels + (("le", "+Inf"),)),
+                        count))
+                    lines.append("{}_sum{} {}".format(
+                        name, format_labels(labels), round(total, 6)))
+                    lines.append("{}_count{} {}".format(
+                        name, format_labels(labels), count))
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+METRICS.declare("dns_probe_rtt_seconds", "histogram",
+                "Query round trip time per server address")
+METRICS.declare("dns_probe_timeouts_total", "counter",
+                "Queries that got no response per server address")
+METRICS.declare("dns_probe_rcode_total", "counter",
+                "Responses per server address and rcode")
+METRICS.declare("dns_probe_answer_sets", "gauge",
+                "Distinct answer sets seen across servers for a target")
+METRICS.declare("dns_probe_consistent", "gauge",
+                "1 if all responding servers gave the same answer")
+METRICS.declare("dns_probe_errors_total", "counter",
+                "Probe rounds that failed (e.g. NS resolution errors)")
+METRICS.declare("dns_probe_rounds_total", "counter",
+                "Probe rounds completed per target")
+METRICS.declare("dns_probe_cache_hit_ratio", "gauge",
+                "Hit ratio of the NS and address cache")
+
+
+def update_metrics(result):
+    """Update metrics from a query_all_authservers result dictionary"""
+
+    query = result['query']
+    target = (("zone", query['zone']), ("qname", query['qname']),
+              ("qtype", query['qtype']))
+    if 'error' in result:
+        METRICS.inc("dns_probe_errors_total", target)
+        return
+
+    answer_sets = set()
+    for adict in result['answer']:
+        server = (("server", adict['name']), ("ip", adict['ip']))
+        METRICS.inc("dns_probe_rcode_total",
+                    server + (("rcode", adict['rcode']),))
+        if adict['rcode'] == "TIMEOUT":
+            METRICS.inc("dns_probe_timeouts_total", server)
+        if adict['rtt_ms'] is not None:
+            METRICS.observe("dns_probe_rtt_seconds", server,
+                            adict['rtt_ms'] / 1000.0)
+        if adict['rcode'] not in ("TIMEOUT", "ERROR", "SKIPPED"):
+            answer_sets.add((adict['rcode'], adict['answers']))
+
+    METRICS.set("dns_probe_answer_sets", target, len(answer_sets))
+    METRICS.set("dns_probe_consistent", target,
+                1 if len(answer_sets) <= 1 else 0)
+    METRICS.inc("dns_probe_rounds_total", target)
+    METRICS.set("dns_probe_cache_hit_ratio", (),
+                round(qa.CACHE.hit_rate(), 4))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """HTTP request handler serving the metrics page"""
+
+    def do_GET(self):
+        """Serve GET /metrics"""
+
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Don't log every scrape"""
+
+        return
+
+
+def start_metrics_server(address, port):
+    """Start metrics HTTP server in a background thread"""
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+async def probe_target(zone, qname, qtype, offset, sem):
+    """
+    Probe target once per INTERVAL, starting offset seconds from now.
+    If a round overruns the interval, the missed slots are skipped so
+    the target stays on its schedule.
+    """
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + offset
+    while True:
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+        try:
+            result = await qa.main_async(zone, qname, qtype, sem=sem)
+        except (dns.exception.DNSException, OSError) as exc_info:
+            result = qa.make_error_result(zone, qname, qtype, exc_info)
+        update_metrics(result)
+        if VERBOSE:
+            print(json.dumps(result), flush=True)
+        deadline += INTERVAL
+        now = loop.time()
+        if deadline < now:
+            deadline += INTERVAL * ((now - deadline) // INTERVAL + 1)
+
+
+async def monitor(targets):
+    """
+    Run probes for all targets forever, with start times staggered
+    evenly across the interval.
+    """
+
+    sem = asyncio.Semaphore(qa.CONCURRENCY)
+    spacing = INTERVAL / len(targets)
+    await asyncio.gather(*[probe_target(zone, qname, qtype, i * spacing, sem)
+                           for i, (zone, qname, qtype) in enumerate(targets)])
+
+
+if __name__ == '__main__':
+
+    TARGETFILE = process_args(sys.argv[1:])
+    with open(TARGETFILE, 'r') as INFILE:
+        TARGETS = list(qa.read_batch(INFILE))
+    if not TARGETS:
+        usage("No targets found in {}".format(TARGETFILE))
+
+    start_metrics_server(LISTEN_ADDRESS, LISTEN_PORT)
+    print("Monitoring {} targets every {}s, metrics at "
+          "http://{}:{}/metrics".format(len(TARGETS), INTERVAL,
+                                        LISTEN_ADDRESS, LISTEN_PORT),
+          file=sys.stderr)
+    try:
+        qa.run_async(monitor(TARGETS))
+    except KeyboardInterrupt:
+        pass
@@ -6,14 +6,39 @@ Given a list of DNS RR types, print the wire representation of
 the NSEC bitmaps field and associated breakdown by window number
 and windowed bitmap.
 
+With --zone, a whole signed zone in presentation format (one RR per
+line, as output by dig AXFR or named-compilezone) is read instead,
+and the type bitmaps of all its NSEC and NSEC3 records are analysed:
+counts of records each RR type is present in, window usage, and the
+distribution of bitmap wire sizes, along with the mean NSEC/NSEC3
+rdata size. The zone is read in large chunks, and each distinct type
+list is decoded only once; identical bitmaps are interned, so the
+records of even very large zones share a few hundred decoded objects.
+
 """
 
+import re
+import sys
 import argparse
 from io import BytesIO
 from binascii import hexlify
+from collections import Counter
+import dns.exception
 import dns.rdatatype
 from dns.rdtypes.ANY.NSEC import Bitmap
 
+from zonelines import read_chunks
+
+
+# Owner, optional TTL and class, then for NSEC: next name and type
+# list, or for NSEC3: hash algorithm, flags, iterations, salt, next
+# hashed owner and type list. Being anchored at the owner name, RRSIGs
+# covering NSEC and NSEC3 records don't match.
+DENIAL_RECORD = re.compile(
+    rb'^[^ \t\n;]+[ \t]+(?:\d+[ \t]+)?(?:IN[ \t]+)?'
+    rb'(?:NSEC|NSEC3[ \t]+\d+[ \t]+\d+[ \t]+\d+[ \t]+([^ \t\n]+))'
+    rb'[ \t]+([^ \t\n]+)[ \t]*([^\n;]*)', re.M)
+
 
 def _to_wire(record):
     buf = BytesIO()
@@ -29,19 +54,147 @@ def _make_rdtype(arg):
     return value
 
 
+class InternedBitmap:
+    """Decoded type bitmap, shared by all records with the same bitmap"""
+
+    __slots__ = ('bitmap', 'rdtypes', 'windows', 'wire_length')
+
+    def __init__(self, bitmap, rdtypes):
+        self.bitmap = bitmap
+        self.rdtypes = rdtypes
+        self.windows = tuple(window for window, _ in bitmap.windows)
+        self.wire_length = len(_to_wire(bitmap))
+
+
+class BitmapTable:
+    """
+    Intern table of type bitmaps, keyed by wire format, with a cache
+    from type list text to interned bitmap, so that each distinct type
+    list is only decoded once.
+    """
+
+    def __init__(self):
+        self.bitmaps = {}
+        self.texts = {}
+
+    def lookup(self, text):
+        """Return interned bitmap for type list text (bytes)"""
+        interned = self.texts.get(text)
+        if interned is None:
+            rdtypes = sorted(set(dns.rdatatype.from_text(name)
+                                 for name in text.decode().split()))
+            bitmap = Bitmap.from_rdtypes(rdtypes)
+            interned = self.bitmaps.setdefault(
+                _to_wire(bitmap), InternedBitmap(bitmap, tuple(rdtypes)))
+            self.texts[text] = interned
+        return interned
+
+
+def scan_zone(infile):
+    """
+    Count NSEC and NSEC3 records in a binary zone stream by type list
+    text. Returns a Counter keyed by (is_nsec3, type list text), and a
+    dictionary of total rdata bytes outside the bitmaps by is_nsec3.
+    """
+    counts = Counter()
+    fixed = {False: 0, True: 0}
+    for data in read_chunks(infile):
+        for salt, next_name, types in DENIAL_RECORD.findall(data):
+            if salt:
+                # Hash algorithm, flags, iterations, salt length and
+                # salt, hash length and base32hex next hashed owner
+                fixed[True] += 6 + (0 if salt == b'-' else len(salt) // 2) \
+                    + len(next_name) * 5 // 8
+                counts[(True, types.strip())] += 1
+            else:
+                # Next owner name, taken as absolute
+                fixed[False] += len(next_name) + 1
+                counts[(False, types.strip())] += 1
+    return counts, fixed
+
+
+def zone_report(counts, fixed, table):
+    """Print type bitmap statistics of scanned zone"""
+    records = {False: 0, True: 0}
+    bitmap_bytes = {False: 0, True: 0}
+    type_counts = Counter()
+    window_counts = Counter()
+    sizes = Counter()
+    errors = 0
+    for (is_nsec3, text), count in counts.items():
+        try:
+            interned = table.lookup(text)
+        except dns.exception.DNSException:
+            print("WARN: {} records with bad type list: {}".format(
+                count, text.decode(errors='replace')), file=sys.stderr)
+            errors += count
+            continue
+        records[is_nsec3] += count
+        bitmap_bytes[is_nsec3] += interned.wire_length * count
+        sizes[interned.wire_length] += count
+        for rdtype in interned.rdtypes:
+            type_counts[rdtype] += count
+        for window in interned.windows:
+            window_counts[window] += count
+
+    total = records[False] + records[True]
+    print("Records: {} (NSEC {}, NSEC3 {}), {} distinct type lists, "
+          "{} distinct bitmaps".format(total, records[False], records[True],
+                                       len(table.texts), len(table.bitmaps)))
+    if errors:
+        print("Records with bad type lists: {}".format(errors))
+    if not total:
+        return
+    for is_nsec3, name in ((False, "NSEC"), (True, "NSEC3")):
+        if records[is_nsec3]:
+            print("Mean {} rdata size: {:.1f} bytes (bitmap {:.1f})".format(
+                name, (fixed[is_nsec3] + bitmap_bytes[is_nsec3]) /
+                records[is_nsec3], bitmap_bytes[is_nsec3] / records[is_nsec3]))
+
+    print("\nBitmap wire size distribution:")
+    for size in sorted(sizes):
+        print("  {:5d} bytes {:12d} {:6.2f}%".format(
+            size, sizes[size], 100.0 * sizes[size] / total))
+
+    print("\nWindow usage:")
+    for window in sorted(window_counts):
+        print("  {:03d} {:12d} {:6.2f}%".format(
+            window, window_counts[window],
+            100.0 * window_counts[window] / total))
+
+    print("\nType presence:")
+    for rdtype, count in type_counts.most_common():
+        print("  {:<12} {:12d} {:6.2f}%".format(
+            dns.rdatatype.to_text(rdtype), count, 100.0 * count / total))
+
+
 __description__ = """\
 Given a list of DNS RR types, print the wire representation of
 the NSEC bitmaps field and associated breakdown by window number
-and windowed bitmap.
+and windowed bitmap. With --zone, analyse the type bitmaps of all
+NSEC and NSEC3 records in a signed zone instead.
 """
 
 parser = argparse.ArgumentParser(
     description=__description__)
 parser.add_argument('rrtype',
                     type=_make_rdtype,
-                    nargs='+')
+                    nargs='*')
+parser.add_argument('-z', '--zone',
+                    metavar='FILE',
+                    help='zone file to analyse, one RR per line '
+                    '("-" for standard input)')
 args = parser.parse_args()
 
+if args.zone:
+    if args.rrtype:
+        parser.error("no RR types allowed with --zone")
+    infile = sys.stdin.buffer if args.zone == '-' else open(args.zone, 'rb')
+    zone_report(*scan_zone(infile), BitmapTable())
+    sys.exit(0)
+if not args.rrtype:
+    parser.error("RR types or --zone required")
+
 bitmaps = Bitmap.from_rdtypes(args.rrtype)
 bitmaps_wire = _to_wire(bitmaps)
 print("Bitmaps length:", len(bitmaps_wire))
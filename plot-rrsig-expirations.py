@@ -15,20 +15,79 @@ And you can pipe that input to the program directly:
 
   dig @<ip> +nocmd +nostats +onesoa <zone> AXFR | plot-rrsig-expirations.py
 
+Standard input is read in large binary chunks. Only the RRSIG
+expiration fields are extracted (with a regular expression), their
+timestamps are converted in vectorised batches, relative to a single
+reference time, and counted straight into a histogram of days left.
+
+A zone file can instead be given with --input. It is memory mapped
+and split into line aligned chunks, whose partial histograms are
+computed by a pool of worker processes (--workers) and then merged.
+
+In forecast mode (--forecast), the signatures are instead projected
+forward under BIND's sig-validity-interval semantics: a signature is
+regenerated when it comes within the refresh interval of expiring,
+and its replacement is valid for the full validity interval, so it
+is regenerated again every (validity - refresh). The number of
+signatures regenerated per hour over the forecast horizon is printed
+as a table, broken down by covered type and key tag, with hours above
+the --max-rate signing rate flagged, and plotted.
+
+With --server and --zone, the zone is fetched directly by zone
+transfer instead, and its RRSIG records are processed as the transfer
+messages arrive, without building the zone in memory. With --state,
+the expiration time of every signature, keyed by owner, covered type
+and key tag, is saved in a compact state file along with the zone's
+SOA serial. Later runs ask for an IXFR from that serial and apply the
+differences to the state, falling back to a full AXFR when the server
+can't provide them. Given only --state, the saved state is analysed
+without contacting any server.
+
 """
 
-import os, sys, getopt, math
-from datetime import datetime, timedelta
-from collections import defaultdict, OrderedDict
+import os, sys, getopt, re, time, mmap, math, gzip, json, itertools
+from multiprocessing import Pool
+from collections import OrderedDict
 import numpy as np
+import dns.query
+import dns.rdatatype
+import dns.exception
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
+from zonelines import read_chunks
+
 PROGNAME = os.path.basename(sys.argv[0])
-SIG_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
 DEFAULT_OUTFILE = "out.png"
 DEFAULT_TITLE = "RRSIG Expiration Times Distribution"
+FORECAST_TITLE = "RRSIG Re-signing Forecast"
+CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_VALIDITY = 30.0                    # days, as BIND's default
+DEFAULT_HORIZON = 28.0                     # days
+MAX_PLOT_TYPES = 8
+XFR_TIMEOUT = 30                           # seconds per transfer message
+STATE_VERSION = 1
+
+# Type RRSIG, type covered, algorithm, labels, original TTL, and the
+# expiration timestamp (YYYYMMDDHHmmSS). Starting the pattern with the
+# literal type lets the regex engine skip quickly between matches.
+# Type names in NSEC bitmaps don't match, as no digits follow them.
+RRSIG_EXPIRATION = re.compile(
+    rb'RRSIG[ \t]+[^ \t\n]+[ \t]+\d+[ \t]+\d+[ \t]+\d+[ \t]+'
+    rb'(\d{14})[ \t]')
+
+# Type covered, expiration and key tag, for the forecast
+RRSIG_FIELDS = re.compile(
+    rb'RRSIG[ \t]+([^ \t\n]+)[ \t]+\d+[ \t]+\d+[ \t]+\d+[ \t]+'
+    rb'(\d{14})[ \t]+\d{14}[ \t]+(\d+)[ \t]')
+
+# Digit place values of year, month, day, hour, minute, second
+TIMESTAMP_WEIGHTS = np.zeros((14, 6), dtype=np.int64)
+for column, (start, width) in enumerate([(0, 4), (4, 2), (6, 2),
+                                         (8, 2), (10, 2), (12, 2)]):
+    for i in range(width):
+        TIMESTAMP_WEIGHTS[start + i, column] = 10 ** (width - 1 - i)
 
 
 # Options with initialized defaults
@@ -37,6 +96,17 @@ class Opts:
     verbose = False
     outfile = DEFAULT_OUTFILE
     title = DEFAULT_TITLE
+    infile = None
+    workers = os.cpu_count() or 1
+    forecast = False
+    validity = DEFAULT_VALIDITY
+    refresh = None                         # default validity / 4
+    horizon = DEFAULT_HORIZON
+    max_rate = None
+    server = None
+    port = 53
+    zone = None
+    state = None
 
 
 def usage(msg=None):
@@ -51,14 +121,30 @@ Usage: {0} [Options] [<outfile>]
        --histo          Create a histogram plot
        --out=<file>     Output file (default is {1})
        --title=<title>  Use specified title above the graph
-
-Reads a presentation format DNS zonefile from standard input, one RR per
-line, and then produces a plot of signature expiration times (in days),
-writing the output to a file.
+       --input=<file>   Read zone from file, in parallel chunks
+       --workers=<N>    Worker processes for --input (default {2})
+       --forecast       Forecast hourly re-signing load instead
+       --validity=<d>   Signature validity interval in days (default {3})
+       --refresh=<d>    Re-sign when within this many days of expiry
+                        (default 1/4 of the validity interval)
+       --horizon=<d>    Forecast horizon in days (default {4})
+       --max-rate=<N>   Flag hours re-signing more than N signatures
+       --server=<addr>  Transfer zone from server (addr[#port]) instead
+       --zone=<zone>    Zone to transfer from --server
+       --state=<file>   Keep signature expiration state in file, and
+                        update it by IXFR from --server on later runs
+
+Reads a presentation format DNS zonefile from standard input (or the
+--input file), one RR per line, and then produces a plot of signature
+expiration times (in days), writing the output to a file.
 
 Input suitable for this program can be generated with dig, e.g.
 dig @<ip> +nocmd +nostats +onesoa <zone> AXFR | {0}
-""".format(PROGNAME, DEFAULT_OUTFILE))
+
+or the zone can be transferred directly, e.g.
+{0} --server=<ip> --zone=<zone> --state=<zone>.state
+""".format(PROGNAME, DEFAULT_OUTFILE, Opts.workers, DEFAULT_VALIDITY,
+           DEFAULT_HORIZON))
     sys.exit(1)
 
 
@@ -72,6 +158,16 @@ def process_args(arguments):
         "histo",
         "out=",
         "title=",
+        "input=",
+        "workers=",
+        "forecast",
+        "validity=",
+        "refresh=",
+        "horizon=",
+        "max-rate=",
+        "server=",
+        "zone=",
+        "state=",
     ]
     try:
         (options, args) = getopt.getopt(arguments, "", longopts=longopts)
@@ -89,6 +185,42 @@ def process_args(arguments):
             Opts.outfile = optval
         elif opt == "--title":
             Opts.title = optval
+        elif opt == "--input":
+            Opts.infile = optval
+        elif opt == "--workers":
+            try:
+                Opts.workers = int(optval)
+            except ValueError:
+                usage("Error: invalid number of workers")
+            if Opts.workers < 1:
+                usage("Error: invalid number of workers")
+        elif opt == "--forecast":
+            Opts.forecast = True
+        elif opt in ("--validity", "--refresh", "--horizon", "--max-rate"):
+            try:
+                value = float(optval)
+            except ValueError:
+                usage("Error: invalid value for {}".format(opt))
+            setattr(Opts, opt[2:].replace('-', '_'), value)
+        elif opt == "--server":
+            Opts.server, _, port = optval.partition('#')
+            try:
+                Opts.port = int(port) if port else Opts.port
+            except ValueError:
+                usage("Error: invalid server port")
+        elif opt == "--zone":
+            Opts.zone = optval if optval.endswith('.') else optval + '.'
+        elif opt == "--state":
+            Opts.state = optval
+
+    if (Opts.server is None) != (Opts.zone is None):
+        usage("Error: --server and --zone must be given together")
+    if Opts.infile and (Opts.server or Opts.state):
+        usage("Error: --input can't be combined with --server or --state")
+    if Opts.refresh is None:
+        Opts.refresh = Opts.validity / 4
+    if not 0 <= Opts.refresh < Opts.validity or Opts.horizon <= 0:
+        usage("Error: refresh must be less than validity, horizon positive")
 
     if args:
         usage("Error: too many arguments")
@@ -96,31 +228,418 @@ def process_args(arguments):
         return
 
 
-def getDaysLeft(rrsigExpire):
-    e = datetime.strptime(rrsigExpire, SIG_TIMESTAMP_FORMAT)
-    days_left = (e - datetime.now()).total_seconds() / 86400.0
-    return math.floor(days_left + 0.5)
-
-
-def getExpirationDict():
-    counts = defaultdict(int)
-    for line in sys.stdin:
-        parts = line.split()
-        if parts[3] == 'RRSIG':
-            days_left = getDaysLeft(parts[8])
-            counts[days_left] += 1
-    orderedCounts = OrderedDict(sorted(counts.items()))
-    return orderedCounts
-
-
-def getExpirationCounts():
-    expirations = []
-    for line in sys.stdin:
-        parts = line.split()
-        if parts[3] == 'RRSIG':
-            days_left = getDaysLeft(parts[8])
-            expirations.append(days_left)
-    return expirations
+def timestampsToEpoch(timestamps):
+    """
+    Convert bytes of concatenated 14 digit YYYYMMDDHHmmSS timestamps
+    to an array of seconds since the epoch (days_from_civil algorithm).
+    """
+    digits = np.frombuffer(timestamps, dtype=np.uint8).reshape(-1, 14)
+    fields = (digits.astype(np.int64) - ord('0')) @ TIMESTAMP_WEIGHTS
+    year, month, day, hour, minute, second = fields.T
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    days = era * 146097 + doe - 719468
+    return days * 86400 + hour * 3600 + minute * 60 + second
+
+
+def readExpirations(infile, chunk_size=CHUNK_SIZE):
+    """
+    Generate arrays of RRSIG expiration times (seconds since the epoch)
+    from a binary input stream, one array per chunk of input lines.
+    """
+    for data in read_chunks(infile, chunk_size):
+        yield timestampsToEpoch(b"".join(RRSIG_EXPIRATION.findall(data)))
+
+
+def daysHistogram(expirations, now):
+    """
+    Return (first_day, counts) histogram of expiration times in days
+    left (rounded to the nearest day) from the reference time now,
+    where counts[i] is the number of signatures with first_day + i
+    days left.
+    """
+    if not len(expirations):
+        return 0, np.zeros(0, dtype=np.int64)
+    days = np.floor((expirations - now) / 86400.0 + 0.5).astype(np.int64)
+    low = int(days.min())
+    return low, np.bincount(days - low)
+
+
+def addHistograms(histogram1, histogram2):
+    """Return sum of two (first_day, counts) histograms"""
+    (first1, counts1), (first2, counts2) = histogram1, histogram2
+    if not len(counts1):
+        return histogram2
+    if not len(counts2):
+        return histogram1
+    first = min(first1, first2)
+    size = max(first1 + len(counts1), first2 + len(counts2)) - first
+    counts = np.zeros(size, dtype=np.int64)
+    counts[first1 - first:first1 - first + len(counts1)] += counts1
+    counts[first2 - first:first2 - first + len(counts2)] += counts2
+    return first, counts
+
+
+def getExpirationHistogram(infile, now=None):
+    """
+    Return (first_day, counts) histogram of RRSIG expiration times in
+    days left, read serially from a binary input stream.
+    """
+    if now is None:
+        now = time.time()
+    histogram = (0, np.zeros(0, dtype=np.int64))
+    for expirations in readExpirations(infile):
+        histogram = addHistograms(histogram, daysHistogram(expirations, now))
+    return histogram
+
+
+def lineBoundaries(data, start, end, count):
+    """
+    Return offsets splitting data[start:end] into about count pieces,
+    each ending just after a newline (or at end).
+    """
+    offsets = [start]
+    for i in range(1, count):
+        offset = data.find(b"\n", start + (end - start) * i // count,
+                           end) + 1
+        if offset > offsets[-1]:
+            offsets.append(offset)
+    if offsets[-1] != end:
+        offsets.append(end)
+    return offsets
+
+
+def rangeHistogram(task):
+    """
+    Return histogram of RRSIG expiration times in a line aligned byte
+    range of a file, parsing the mapped file in CHUNK_SIZE pieces.
+    Runs in worker processes.
+    """
+    path, start, end, now = task
+    histogram = (0, np.zeros(0, dtype=np.int64))
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offsets = lineBoundaries(data, start, end,
+                                     max(1, (end - start) // CHUNK_SIZE))
+            for low, high in zip(offsets, offsets[1:]):
+                timestamps = b"".join(RRSIG_EXPIRATION.findall(data, low,
+                                                               high))
+                histogram = addHistograms(histogram, daysHistogram(
+                    timestampsToEpoch(timestamps), now))
+    return histogram
+
+
+def getExpirationHistogramParallel(path, workers, now=None):
+    """
+    Return (first_day, counts) histogram of RRSIG expiration times in
+    days left, for a zone file. The file is memory mapped and split
+    into line aligned chunks, several per worker for load balancing,
+    whose partial histograms are computed by a process pool and merged.
+    """
+    if now is None:
+        now = time.time()
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0, np.zeros(0, dtype=np.int64)
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            count = max(1, min(workers * 4, size // CHUNK_SIZE))
+            offsets = lineBoundaries(data, 0, size, count)
+    tasks = [(path, low, high, now) for low, high in zip(offsets, offsets[1:])]
+    histogram = (0, np.zeros(0, dtype=np.int64))
+    if workers == 1 or len(tasks) == 1:
+        partials = map(rangeHistogram, tasks)
+        for partial in partials:
+            histogram = addHistograms(histogram, partial)
+        return histogram
+    with Pool(min(workers, len(tasks))) as pool:
+        for partial in pool.imap_unordered(rangeHistogram, tasks):
+            histogram = addHistograms(histogram, partial)
+    return histogram
+
+
+def getExpirationDict(histogram):
+    first, counts = histogram
+    days = np.flatnonzero(counts)
+    return OrderedDict(zip((days + first).tolist(), counts[days].tolist()))
+
+
+class ExpiryState:
+    """
+    RRSIG expiration times of a zone, keyed by (owner, covered type,
+    key tag), and the SOA serial of the zone version they describe.
+    Saved as gzipped JSON, with the signatures grouped by owner name.
+    """
+
+    def __init__(self, zone, serial=None):
+        self.zone = zone
+        self.serial = serial
+        self.signatures = {}
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt') as f:
+            data = json.load(f)
+        if data.get("version") != STATE_VERSION:
+            raise ValueError("{}: unknown state file version".format(path))
+        state = cls(data["zone"], data["serial"])
+        state.signatures = {(owner, covered, keytag): expiration
+                            for owner, sigs in data["signatures"].items()
+                            for covered, keytag, expiration in sigs}
+        return state
+
+    def save(self, path):
+        """Write state to path, atomically replacing any previous state"""
+        owners = {}
+        for (owner, covered, keytag), expiration in self.signatures.items():
+            owners.setdefault(owner, []).append([covered, keytag, expiration])
+        data = {"version": STATE_VERSION, "zone": self.zone,
+                "serial": self.serial, "signatures": owners}
+        tmpfile = "{}.tmp{}".format(path, os.getpid())
+        with gzip.open(tmpfile, 'wt') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmpfile, path)
+
+    def expirations(self):
+        return np.fromiter(self.signatures.values(), dtype=np.int64,
+                           count=len(self.signatures))
+
+    def signatureFields(self):
+        """Generate (keys, expirations) batch, as readSignatureFields()"""
+        keys = [(covered, keytag) for _, covered, keytag in self.signatures]
+        yield keys, self.expirations()
+
+
+def transferRecords(server, zone, rdtype, serial=0, port=53):
+    """
+    Generate (name, rdtype, rdata) of each record of a zone transfer,
+    in the order received, as the response messages arrive.
+    """
+    for message in dns.query.xfr(server, zone, rdtype=rdtype, serial=serial,
+                                 port=port, timeout=XFR_TIMEOUT,
+                                 relativize=False):
+        for rrset in message.answer:
+            for rdata in rrset:
+                yield rrset.name, rrset.rdtype, rdata
+
+
+def signatureKey(name, rdata):
+    return (name.to_text(), dns.rdatatype.to_text(rdata.type_covered),
+            rdata.key_tag)
+
+
+def applyTransfer(state, records):
+    """
+    Update state from zone transfer records. An incremental response
+    is a series of differences, each a sequence of deleted records
+    introduced by the old SOA, and one of added records introduced by
+    the new SOA. Any other response carries the whole zone, and
+    replaces the state. Returns transfer kind ("IXFR", "AXFR" or
+    "current"), and the number of signatures added and deleted.
+    """
+    records = iter(records)
+    first = next(records, None)
+    if first is None or first[1] != dns.rdatatype.SOA:
+        raise dns.exception.FormError("transfer doesn't start with SOA")
+    serial = first[2].serial
+    second = next(records, None)
+    added = deleted = 0
+    if second is None:
+        kind = "current"
+    elif (second[1] == dns.rdatatype.SOA and state.serial is not None and
+          second[2].serial == state.serial != serial):
+        kind = "IXFR"
+        deleting = True
+        for name, rdtype, rdata in records:
+            if rdtype == dns.rdatatype.SOA:
+                deleting = not deleting
+            elif rdtype != dns.rdatatype.RRSIG:
+                continue
+            elif deleting:
+                if state.signatures.pop(signatureKey(name, rdata), None) \
+                   is not None:
+                    deleted += 1
+            else:
+                state.signatures[signatureKey(name, rdata)] = rdata.expiration
+                added += 1
+    else:
+        kind = "AXFR"
+        signatures = {}
+        for name, rdtype, rdata in itertools.chain([second], records):
+            if rdtype == dns.rdatatype.RRSIG:
+                signatures[signatureKey(name, rdata)] = rdata.expiration
+        deleted, added = len(state.signatures), len(signatures)
+        state.signatures = signatures
+    state.serial = serial
+    return kind, added, deleted
+
+
+def getExpiryState(server, zone, path=None, port=53):
+    """
+    Return ExpiryState of zone, loaded from the state file at path (if
+    given and it exists), and brought up to date from server (if not
+    None): by IXFR from the saved serial, or by AXFR when there is no
+    saved state or the IXFR fails. The updated state is saved to path.
+    """
+    if path and os.path.exists(path):
+        state = ExpiryState.load(path)
+        if server is None:
+            return state
+        if state.zone != zone:
+            print("WARN: {} has state of zone {}, starting over".format(
+                path, state.zone), file=sys.stderr)
+            state = ExpiryState(zone)
+    elif server is None:
+        raise ValueError("No state file {}".format(path))
+    else:
+        state = ExpiryState(zone)
+
+    old_serial = state.serial
+    result = None
+    if old_serial is not None:
+        try:
+            result = applyTransfer(state, transferRecords(
+                server, zone, dns.rdatatype.IXFR, old_serial, port))
+        except (dns.exception.DNSException, OSError, EOFError) as e:
+            print("WARN: IXFR of {} failed: {}; trying AXFR ..".format(
+                zone, e), file=sys.stderr)
+    if result is None:
+        result = applyTransfer(state, transferRecords(
+            server, zone, dns.rdatatype.AXFR, port=port))
+    kind, added, deleted = result
+    if kind == "current":
+        print("{} is current at serial {}: {} signatures".format(
+            zone, state.serial, len(state.signatures)))
+    else:
+        print("{} of {} serial {} -> {}: {} signatures added, {} deleted,"
+              " {} total".format(kind, zone, old_serial, state.serial, added,
+                                 deleted, len(state.signatures)))
+    if path:
+        state.save(path)
+    return state
+
+
+def readSignatureFields(infile):
+    """
+    Generate (keys, expirations) batches from a binary input stream,
+    one per chunk of input lines, where keys is a list of (covered
+    type, key tag) tuples, and expirations the matching array of RRSIG
+    expiration times.
+    """
+    for data in read_chunks(infile):
+        fields = RRSIG_FIELDS.findall(data)
+        if fields:
+            covered, expirations, keytags = zip(*fields)
+            yield (list(zip(covered, keytags)),
+                   timestampsToEpoch(b"".join(expirations)))
+
+
+def forecastResigning(batches, validity, refresh, horizon, now=None):
+    """
+    Project RRSIG regeneration times over the horizon (all intervals in
+    seconds), from (keys, expirations) batches of signatures, as made
+    by readSignatureFields(). Returns a list of "type/keytag" category
+    labels, and an array where counts[c, h] is the number of signatures
+    of category c regenerated in hour h from now.
+    """
+    if now is None:
+        now = time.time()
+    now, refresh = int(now), int(refresh)
+    hours = int(math.ceil(horizon / 3600.0))
+    period = int(validity) - refresh
+    categories = {}
+    counts = np.zeros((0, hours), dtype=np.int64)
+    for keys, expirations in batches:
+        ids = np.fromiter((categories.setdefault(key, len(categories))
+                           for key in keys),
+                          dtype=np.int64, count=len(keys))
+        # Seconds from now until each signature is first regenerated;
+        # those already inside the refresh interval are due now.
+        first = expirations - refresh - now
+        first = np.maximum(first, 0)
+        due = first < hours * 3600
+        first, ids = first[due], ids[due]
+        repeats = (hours * 3600 - 1 - first) // period + 1
+        starts = np.cumsum(repeats) - repeats
+        steps = np.arange(repeats.sum()) - np.repeat(starts, repeats)
+        events = np.repeat(first, repeats) + steps * period
+        bins = np.repeat(ids, repeats) * hours + events // 3600
+        chunk_counts = np.bincount(bins, minlength=len(categories) * hours)
+        if len(counts) < len(categories):
+            counts = np.vstack((counts, np.zeros(
+                (len(categories) - len(counts), hours), dtype=np.int64)))
+        counts += chunk_counts.reshape(len(categories), hours)
+    labels = ["/".join(field.decode() if isinstance(field, bytes)
+                       else str(field) for field in key)
+              for key in categories]
+    return labels, counts
+
+
+def printForecast(labels, counts, now, max_rate=None):
+    """Print hourly re-signing forecast table and summary"""
+    totals = counts.sum(axis=0)
+    print("Re-signing forecast from {} UTC: validity {:g}d, refresh {:g}d,"
+          " horizon {:g}d".format(
+              time.strftime("%Y-%m-%d %H:%M", time.gmtime(now)),
+              Opts.validity, Opts.refresh, Opts.horizon))
+    print("{:<17} {:>10}  {}".format("Hour (UTC)", "Signatures",
+                                     "By covered type/key tag"))
+    for hour in np.flatnonzero(totals).tolist():
+        column = counts[:, hour]
+        order = np.argsort(-column, kind='stable')
+        breakdown = ", ".join("{}={}".format(labels[c], column[c])
+                              for c in order.tolist() if column[c])
+        flag = "*" if max_rate is not None and totals[hour] > max_rate \
+            else " "
+        print("{:<17} {:>9}{}  {}".format(
+            time.strftime("%Y-%m-%d %H:%M",
+                          time.gmtime(now + hour * 3600)),
+            totals[hour], flag, breakdown))
+    print("\nTotals by covered type/key tag:")
+    category_totals = counts.sum(axis=1)
+    for c in np.argsort(-category_totals, kind='stable').tolist():
+        print("  {:<24} {:>10}".format(labels[c], category_totals[c]))
+    if len(totals) and totals.max():
+        peak = int(totals.argmax())
+        print("Peak: {} signatures at {} UTC".format(
+            totals[peak], time.strftime("%Y-%m-%d %H:%M",
+                                        time.gmtime(now + peak * 3600))))
+    if max_rate is not None:
+        print("Hours over {:g} signatures: {}".format(
+            max_rate, int((totals > max_rate).sum())))
+
+
+def plotForecast(labels, counts, outfile, max_rate=None):
+    """Plot hourly re-signing forecast, stacked by covered type"""
+    if not counts.sum():
+        raise ValueError("No input data to process")
+    types = OrderedDict()
+    for label, row in zip(labels, counts):
+        covered = label.split('/')[0]
+        types[covered] = types.get(covered, 0) + row
+    names = sorted(types, key=lambda name: -types[name].sum())
+    if len(names) > MAX_PLOT_TYPES:
+        other = sum(types[name] for name in names[MAX_PLOT_TYPES - 1:])
+        names = names[:MAX_PLOT_TYPES - 1]
+        series = [types[name] for name in names] + [other]
+        names.append("other")
+    else:
+        series = [types[name] for name in names]
+    days = np.arange(counts.shape[1]) / 24.0
+    plt.figure(figsize=(12, 5))
+    plt.stackplot(days, series, labels=names, step='post')
+    if max_rate is not None:
+        plt.axhline(max_rate, color='red', linestyle='--',
+                    label='max rate ({:g}/h)'.format(max_rate))
+    plt.title(Opts.title if Opts.title != DEFAULT_TITLE else FORECAST_TITLE)
+    plt.xlabel('Days from now')
+    plt.ylabel('Signatures regenerated per hour')
+    plt.legend(loc='upper right', fontsize='small')
+    plt.savefig(outfile, dpi=150)
+    print("Plot output saved in {}".format(outfile))
 
 
 def plotLine(data, outfile):
@@ -141,13 +660,16 @@ def plotLine(data, outfile):
     print("Plot output saved in {}".format(outfile))
 
 
-def plotHistogram(data, outfile):
-    if not data:
+def plotHistogram(histogram, outfile):
+    first, counts = histogram
+    if not counts.sum():
         raise ValueError("No input data to process")
     MINVAL = 0
-    MAXVAL = max(expirations) + 1
+    MAXVAL = first + len(counts)
     BINSIZE = 1
-    plt.hist(data, bins=np.arange(MINVAL, MAXVAL+BINSIZE, BINSIZE))
+    days = np.arange(first, MAXVAL)
+    plt.hist(days, bins=np.arange(MINVAL, MAXVAL+BINSIZE, BINSIZE),
+             weights=counts)
     plt.title(Opts.title)
     plt.xlabel('RRSIG Expiration Times (days)')
     plt.ylabel('RRSIG Counts')
@@ -160,9 +682,38 @@ if __name__ == '__main__':
 
     process_args(sys.argv[1:])
 
+    state = None
+    if Opts.server or Opts.state:
+        try:
+            state = getExpiryState(Opts.server, Opts.zone, Opts.state,
+                                   Opts.port)
+        except (dns.exception.DNSException, OSError, EOFError,
+                ValueError) as e:
+            print("ERROR: {}".format(e), file=sys.stderr)
+            sys.exit(2)
+
+    if Opts.forecast:
+        now = time.time()
+        if state is not None:
+            batches = state.signatureFields()
+        else:
+            infile = open(Opts.infile, 'rb') if Opts.infile \
+                else sys.stdin.buffer
+            batches = readSignatureFields(infile)
+        labels, counts = forecastResigning(
+            batches, Opts.validity * 86400, Opts.refresh * 86400,
+            Opts.horizon * 86400, now)
+        printForecast(labels, counts, now, Opts.max_rate)
+        plotForecast(labels, counts, Opts.outfile, Opts.max_rate)
+        sys.exit(0)
+
+    if state is not None:
+        histogram = daysHistogram(state.expirations(), time.time())
+    elif Opts.infile:
+        histogram = getExpirationHistogramParallel(Opts.infile, Opts.workers)
+    else:
+        histogram = getExpirationHistogram(sys.stdin.buffer)
     if Opts.plot_type == 'line':
-        expirations = getExpirationDict()
-        plotLine(expirations, Opts.outfile)
+        plotLine(getExpirationDict(histogram), Opts.outfile)
     elif Opts.plot_type == 'histo':
-        expirations = getExpirationCounts()
-        plotHistogram(expirations, Opts.outfile)
+        plotHistogram(histogram, Opts.outfile)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+#
+
+"""
+Probe EDNS UDP buffer size behaviour of all nameserver addresses of
+a zone, for a given qname and qtype.
+
+For every server address, the advertised EDNS UDP payload size is
+binary searched to find the smallest size at which the server stops
+truncating the response. The probes then show:
+
+  - the largest UDP response that arrived intact
+  - the truncation threshold (the smallest advertised payload size
+    that gets a full, untruncated response)
+  - whether full responses larger than the path MTU are lost while
+    smaller truncated ones arrive, which signals IP fragmentation
+    being dropped somewhere on the path
+
+All server addresses are probed concurrently. The full response size
+is obtained over TCP for reference.
+
+"""
+
+import os
+import sys
+import getopt
+import json
+import asyncio
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rdatatype
+import dns.asyncquery
+
+import query_all_authservers as qa
+
+
+PROGNAME = os.path.basename(sys.argv[0])
+VERSION = "0.0.1"
+
+MIN_PAYLOAD = 512
+MAX_PAYLOAD = 4096
+TIMEOUT = 2
+RETRIES = 3
+REPROBES = 1
+
+# Outcomes of a single probe
+OK = "ok"
+TRUNCATED = "tc"
+LOST = "lost"
+ERROR = "error"
+
+
+# Options with initialized defaults
+class Opts:
+    json = False
+    dnssec = False
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+
+    print("""\
+{0} version {1}
+Usage: {0} [Options] <zone> <qname> <qtype>
+
+       Options:
+       -h          Print this help string
+       -4          Use IPv4 transport only
+       -6          Use IPv6 transport only
+       -d          Set the DNSSEC OK bit (to get larger responses)
+       -j          Output JSON (default is text output)
+       -m N        Maximum EDNS payload size to probe (default {2})
+       -T secs     Timeout per probe (default {3})
+       -r N        Attempts per probe before declaring loss (default {4})
+""".format(PROGNAME, VERSION, MAX_PAYLOAD, TIMEOUT, RETRIES))
+    sys.exit(4)
+
+
+def process_args(arg_vector):
+    """Process command line options and arguments"""
+
+    global MAX_PAYLOAD, TIMEOUT, RETRIES
+
+    try:
+        (options, args) = getopt.getopt(arg_vector, 'h46djm:T:r:')
+    except getopt.GetoptError as exc_info:
+        usage("{}".format(exc_info))
+
+    try:
+        for (opt, optval) in options:
+            if opt == "-h":
+                usage()
+            elif opt == "-4":
+                qa.IP_RRTYPES = [dns.rdatatype.A]
+            elif opt == "-6":
+                qa.IP_RRTYPES = [dns.rdatatype.AAAA]
+            elif opt == "-d":
+                Opts.dnssec = True
+            elif opt == "-j":
+                Opts.json = True
+            elif opt == "-m":
+                MAX_PAYLOAD = int(optval)
+            elif opt == "-T":
+                TIMEOUT = float(optval)
+            elif opt == "-r":
+                RETRIES = int(optval)
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
+
+    if len(args) != 3:
+        usage("Missing positional arguments. 3 required")
+    if MAX_PAYLOAD < MIN_PAYLOAD or RETRIES < 1:
+        usage("Invalid maximum payload or retry count")
+    return args
+
+
+def make_probe(qname, qtype, payload):
+    """Make non-recursive query advertising given EDNS payload size"""
+
+    msg = dns.message.make_query(qname, qtype, use_edns=0, payload=payload,
+                                 want_dnssec=Opts.dnssec)
+    msg.flags &= ~dns.flags.RD
+    return msg
+
+
+async def probe(ipaddress, qname, qtype, payload, sem):
+    """
+    Send UDP query advertising given payload size. Return outcome
+    (OK, TRUNCATED, LOST, or ERROR if the query could not be sent),
+    and the response size if one arrived.
+    """
+
+    msg = make_probe(qname, qtype, payload)
+    for _ in range(RETRIES):
+        try:
+            async with sem:
+                res = await dns.asyncquery.udp(msg, ipaddress,
+                                               timeout=TIMEOUT, port=qa.PORT)
+        except dns.exception.Timeout:
+            continue
+        except OSError:
+            return ERROR, None
+        size = len(res.wire) if getattr(res, 'wire', None) \
+            else len(res.to_wire())
+        return (TRUNCATED if res.flags & dns.flags.TC else OK), size
+    return LOST, None
+
+
+async def full_size(ipaddress, qname, qtype, sem):
+    """Return size of the full response obtained over TCP, or None"""
+
+    msg = make_probe(qname, qtype, MAX_PAYLOAD)
+    try:
+        async with sem:
+            res = await dns.asyncquery.tcp(msg, ipaddress, timeout=TIMEOUT,
+                                           port=qa.PORT)
+    except (dns.exception.DNSException, OSError):
+        return None
+    return len(res.wire) if getattr(res, 'wire', None) \
+        else len(res.to_wire())
+
+
+async def probe_server(nsname, ipaddress, qname, qtype, sem):
+    """
+    Binary search the advertised payload size for a server address,
+    and return a summary dictionary of the results. Lost probes are
+    sent again (REPROBES more times), so that a single lost datagram
+    below the real threshold doesn't pull the threshold down; a probe
+    that is still lost is taken as an untruncated response that was
+    dropped, as happens to fragmented responses.
+    """
+
+    probes = {}
+
+    async def probe_payload(payload):
+        if payload not in probes:
+            probes[payload] = await probe(ipaddress, qname, qtype,
+                                          payload, sem)
+            for _ in range(REPROBES):
+                if probes[payload][0] != LOST:
+                    break
+                probes[payload] = await probe(ipaddress, qname, qtype,
+                                              payload, sem)
+        return probes[payload][0]
+
+    tcp_size, _, _ = await asyncio.gather(
+        full_size(ipaddress, qname, qtype, sem),
+        probe_payload(MIN_PAYLOAD), probe_payload(MAX_PAYLOAD))
+
+    threshold = None
+    if ERROR in (probes[MIN_PAYLOAD][0], probes[MAX_PAYLOAD][0]):
+        pass
+    elif probes[MIN_PAYLOAD][0] == OK:
+        threshold = MIN_PAYLOAD
+    elif probes[MAX_PAYLOAD][0] != TRUNCATED:
+        low, high = MIN_PAYLOAD, MAX_PAYLOAD
+        while high - low > 1:
+            mid = (low + high) // 2
+            outcome = await probe_payload(mid)
+            if outcome == ERROR:
+                break
+            if outcome == TRUNCATED:
+                low = mid
+            else:
+                high = mid
+        else:
+            threshold = high
+
+    intact = [size for outcome, size in probes.values() if outcome == OK]
+    truncated = [size for outcome, size in probes.values()
+                 if outcome == TRUNCATED]
+    lost = sorted(payload for payload, (outcome, _) in probes.items()
+                  if outcome == LOST)
+    truncated_payloads = [payload for payload, (outcome, _) in probes.items()
+                          if outcome == TRUNCATED]
+
+    # Loss only of the large (untruncated) responses, while the small
+    # truncated ones get through, points at dropped IP fragments.
+    fragmentation_loss = bool(lost) and bool(truncated_payloads) and \
+        lost[0] > max(truncated_payloads)
+
+    return {
+        "name": nsname.to_text(),
+        "ip": ipaddress,
+        "tcp_size": tcp_size,
+        "largest_intact": max(intact) if intact else None,
+        "largest_truncated": max(truncated) if truncated else None,
+        "truncation_threshold": threshold,
+        "lost_payloads": lost,
+        "fragmentation_loss": fragmentation_loss,
+        "error": any(outcome == ERROR for outcome, _ in probes.values()),
+        "probes": len(probes),
+    }
+
+
+async def probe_all(zone, qname, qtype):
+    """Probe all server addresses of zone concurrently"""
+
+    sem = asyncio.Semaphore(qa.CONCURRENCY)
+    nslist = await qa.get_nslist_async(zone, sem)
+    iplists = await asyncio.gather(*[qa.get_iplist_async(nsname, sem)
+                                     for nsname in nslist])
+    return await asyncio.gather(*[
+        probe_server(nsname, ipaddress, qname, qtype, sem)
+        for nsname, iplist in zip(nslist, iplists)
+        for ipaddress in iplist])
+
+
+def print_results(results):
+    """Print per server summary table"""
+
+    print("{:<30} {:<40} {:>6} {:>8} {:>9} {:>6}  {}".format(
+        "Name", "Address", "TCP", "Intact", "Threshold", "Probes",
+        "Notes"))
+    for res in results:
+        notes = []
+        if res['error']:
+            notes.append("query error")
+        elif res['truncation_threshold'] is None:
+            notes.append("always truncates")
+        if res['fragmentation_loss']:
+            notes.append("fragmentation loss at payload >= {}".format(
+                res['lost_payloads'][0]))
+        elif res['lost_payloads']:
+            notes.append("no response")
+        print("{:<30} {:<40} {:>6} {:>8} {:>9} {:>6}  {}".format(
+            res['name'], res['ip'], str(res['tcp_size']),
+            str(res['largest_intact']), str(res['truncation_threshold']),
+            res['probes'], ", ".join(notes)))
+
+
+if __name__ == '__main__':
+
+    ZONE, QNAME, QTYPE = process_args(sys.argv[1:])
+    RESULTS = qa.run_async(probe_all(ZONE, QNAME, QTYPE))
+    if Opts.json:
+        print(json.dumps({"query": {"zone": ZONE, "qname": QNAME,
+                                    "qtype": QTYPE},
+                          "servers": RESULTS}))
+    else:
+        print_results(RESULTS)
@@ -8,27 +8,61 @@ Query all nameserver addresses for a given zone, qname, and qtype.
 
 import os
 import sys
-import getopt
+import atexit
 import json
 import time
+import struct
+from collections import OrderedDict
+import dns.name
+import dns.entropy
+import dns.message
 import dns.resolver
 import dns.query
 import dns.rdatatype
 import dns.rdataclass
 import dns.rcode
-from sortedcontainers import SortedList
+
+
+# asyncio and the dnspython async modules are only imported by
+# import_async(), on the first use of the async code paths, to keep
+# them out of the start up time of the (default) serial mode, which
+# matters for Lambda cold starts.
+asyncio = None
+
+
+def import_async():
+    """
+    Import asyncio and the dnspython async modules. Called by the
+    async entry points: run_async(), run_persistent() and main_async().
+    """
+
+    global asyncio
+    import asyncio
+    import dns.asyncresolver
+    import dns.asyncquery
 
 
 PROGNAME = os.path.basename(sys.argv[0])
 VERSION = "0.0.1"
 
+PORT = 53
 TIMEOUT = 3
 RETRIES = 2
 
+RTO_MIN = 0.2
+FAIL_THRESHOLD = 3
+HOLDDOWN = 60
+HOLDDOWN_MAX = 900
+
 EDNS = True
 EDNS_UDP_ADV = 1420
 
 JSON = False
+ASYNC = False
+TCP_ONLY = False
+CONCURRENCY = 64
+BATCH = None
+CACHE_SIZE = 10000
 IP_RRTYPES = [dns.rdatatype.AAAA, dns.rdatatype.A]
 
 
@@ -41,6 +75,7 @@ def usage(msg=None):
     print("""\
 {0} version {1}
 Usage: {0} [Options] <zone> <qname> <qtype>
+       {0} [Options] -b <file>
 
        Options:
        -h          Print this help string
@@ -48,7 +83,17 @@ Usage: {0} [Options] <zone> <qname> <qtype>
        -6          Use IPv6 transport only
        -e          Disable EDNS (and NSID)
        -j          Output JSON (default is text output)
-""".format(PROGNAME, VERSION)
+       -a          Query all servers concurrently (asyncio)
+       -c N        Maximum in-flight queries in async mode (default {2})
+       -t          Use TCP only, pipelining queries over persistent
+                   connections to each server address (implies -a)
+       -b <file>   Batch mode: read JSON lines of zone, qname, qtype from
+                   file ("-" for stdin) and write one JSON result per line
+
+Batch input lines are JSON objects, e.g.
+  {{"zone": "example.com", "qname": "www.example.com", "qtype": "A"}}
+or JSON arrays of the form ["example.com", "www.example.com", "A"].
+""".format(PROGNAME, VERSION, CONCURRENCY)
 )
     sys.exit(4)
 
@@ -56,16 +101,15 @@ Usage: {0} [Options] <zone> <qname> <qtype>
 def process_args(arg_vector):
     """Process command line options and arguments"""
 
-    global IP_RRTYPES, EDNS, JSON
+    global IP_RRTYPES, EDNS, JSON, ASYNC, TCP_ONLY, CONCURRENCY, BATCH
+
+    import getopt
 
     try:
-        (options, args) = getopt.getopt(arg_vector, 'h46ej')
+        (options, args) = getopt.getopt(arg_vector, 'h46ejac:tb:')
     except getopt.GetoptError as exc_info:
         usage("{}".format(exc_info))
 
-    if len(args) != 3:
-        usage("Missing positional arguments. 3 required")
-
     for (opt, optval) in options:
         _ = optval
         if opt == "-h":
@@ -78,106 +122,796 @@ def process_args(arg_vector):
             EDNS = False
         elif opt == "-j":
             JSON = True
+        elif opt == "-a":
+            ASYNC = True
+        elif opt == "-c":
+            try:
+                CONCURRENCY = int(optval)
+            except ValueError:
+                usage("Invalid concurrency value: {}".format(optval))
+            if CONCURRENCY < 1:
+                usage("Concurrency must be at least 1")
+        elif opt == "-t":
+            TCP_ONLY = True
+            ASYNC = True
+        elif opt == "-b":
+            BATCH = optval
+
+    if BATCH is not None:
+        if args:
+            usage("No positional arguments allowed in batch mode")
+    elif len(args) != 3:
+        usage("Missing positional arguments. 3 required")
 
     return args
 
 
-def get_nslist(zone):
-    """Get NS name list for given zone"""
+class Settings:
+    """
+    Query settings for a single call of main(). Settings not given
+    default to the module level options (which the command line sets).
+    Passing a Settings object rather than changing the module globals
+    keeps concurrent calls, e.g. from lambda_handler(), independent.
+    """
+
+    def __init__(self, edns=None, ip_rrtypes=None, use_async=None,
+                 tcp_only=None):
+        self.edns = EDNS if edns is None else edns
+        self.ip_rrtypes = IP_RRTYPES if ip_rrtypes is None else ip_rrtypes
+        self.tcp_only = TCP_ONLY if tcp_only is None else tcp_only
+        self.use_async = ASYNC if use_async is None else use_async
+        self.use_async = self.use_async or self.tcp_only
+
+
+class TTLCache:
+    """
+    Size bounded cache of resolved data. Entries expire according to
+    the TTL of the DNS answer they came from, and the least recently
+    used entries are evicted when the cache is full.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return cached value for key, or None"""
+
+        entry = self.data.get(key)
+        if entry is not None:
+            value, expiration = entry
+            if expiration > time.time():
+                self.data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.data[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value, expiration):
+        """Add value to cache, expiring at the given absolute time"""
+
+        if expiration <= time.time():
+            return
+        self.data[key] = (value, expiration)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def hit_rate(self):
+        """Return fraction of lookups answered from the cache"""
+
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """Return dictionary of cache statistics"""
+
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 4),
+        }
+
 
-    nslist = SortedList()
-    msg = dns.resolver.resolve(zone, dns.rdatatype.NS).response
+CACHE = TTLCache()
+
+
+class ServerState:
+    """
+    Smoothed RTT estimator and failure tracking for a server address,
+    similar to a resolver's SRTT/RTO computation (RFC 6298). The RTO
+    starts out at TIMEOUT, is derived from measured RTTs, and doubles
+    (up to TIMEOUT) after each timeout. After FAIL_THRESHOLD queries
+    in a row get no response, the server is skipped for a holddown
+    period, which doubles each time a subsequent probe also fails.
+    """
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+        self.failures = 0
+        self.holddown = HOLDDOWN
+        self.skip_until = 0.0
+
+    def rto(self):
+        """Return current retransmission timeout in seconds"""
+
+        if self.srtt is None:
+            return TIMEOUT
+        rto = max(RTO_MIN, self.srtt + 4 * self.rttvar) * self.backoff
+        return min(rto, TIMEOUT)
+
+    def retries(self):
+        """Return number of UDP attempts to make for next query"""
+
+        return 1 if self.failures else RETRIES
+
+    def skipped(self):
+        """Return True if server is currently held down"""
+
+        return time.time() < self.skip_until
+
+    def add_sample(self, rtt):
+        """Update smoothed RTT estimate with a measured RTT (seconds)"""
+
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.backoff = 1
+
+    def add_timeout(self):
+        """Back off the retransmission timeout after a timeout"""
+
+        if self.rto() < TIMEOUT:
+            self.backoff *= 2
+
+    def success(self):
+        """Record that a query to this server got a response"""
+
+        self.failures = 0
+        self.holddown = HOLDDOWN
+        self.skip_until = 0.0
+
+    def failure(self):
+        """Record that a query to this server got no response"""
+
+        self.failures += 1
+        if self.failures >= FAIL_THRESHOLD:
+            if self.skip_until:
+                self.holddown = min(self.holddown * 2, HOLDDOWN_MAX)
+            self.skip_until = time.time() + self.holddown
+
+    def stats(self):
+        """Return dictionary of estimator state"""
+
+        return {
+            "srtt_ms": None if self.srtt is None else
+                       round(self.srtt * 1000.0, 3),
+            "rto_ms": round(self.rto() * 1000.0, 3),
+            "failures": self.failures,
+            "skipped": self.skipped(),
+        }
+
+
+SERVERS = {}
+
+
+def get_server_state(ipaddress):
+    """Return (possibly new) ServerState object for server address"""
+
+    state = SERVERS.get(ipaddress)
+    if state is None:
+        state = SERVERS[ipaddress] = ServerState()
+    return state
+
+
+def nslist_from_response(msg):
+    """Return sorted NS name list from an NS query response"""
+
+    nslist = []
     for rrset in msg.answer:
         if rrset.rdtype != dns.rdatatype.NS:
             continue
         for rdata in rrset:
-            nslist.add(rdata.target)
+            nslist.append(rdata.target)
+    return sorted(nslist)
+
+
+def iplist_from_response(msg, rrtype):
+    """Return IP address list from an address query response"""
+
+    iplist = []
+    for rrset in msg.answer:
+        if rrset.rdtype != rrtype:
+            continue
+        for rdata in rrset:
+            iplist.append(rdata.address)
+    return iplist
+
+
+def get_nslist(zone):
+    """Get NS name list for given zone"""
+
+    key = (dns.name.from_text(zone), dns.rdatatype.NS)
+    nslist = CACHE.get(key)
+    if nslist is None:
+        answer = dns.resolver.resolve(zone, dns.rdatatype.NS)
+        nslist = nslist_from_response(answer.response)
+        CACHE.put(key, nslist, answer.expiration)
     return nslist
 
 
-def get_iplist(name):
+def get_iplist_rrtype(name, rrtype):
+    """Get IP address list of given address record type for name"""
+
+    key = (name, rrtype)
+    iplist = CACHE.get(key)
+    if iplist is None:
+        answer = dns.resolver.resolve(name, rrtype,
+                                      raise_on_no_answer=False)
+        iplist = iplist_from_response(answer.response, rrtype)
+        CACHE.put(key, iplist, answer.expiration)
+    return iplist
+
+
+def get_iplist(name, settings=None):
     """Get IP address list for given name"""
 
-    global IP_RRTYPES
+    if settings is None:
+        settings = Settings()
     iplist = []
-    for rrtype in IP_RRTYPES:
-        msg = dns.resolver.resolve(name, rrtype,
-                                   raise_on_no_answer=False).response
-        for rrset in msg.answer:
-            if rrset.rdtype != rrtype:
-                continue
-            for rdata in rrset:
-                iplist.append(rdata.address)
+    for rrtype in settings.ip_rrtypes:
+        iplist.extend(get_iplist_rrtype(name, rrtype))
     return iplist
 
 
-def send_query_tcp(msg, ipaddress, timeout=TIMEOUT):
+async def get_nslist_async(zone, sem):
+    """Get NS name list for given zone (asyncio version)"""
+
+    key = (dns.name.from_text(zone), dns.rdatatype.NS)
+    nslist = CACHE.get(key)
+    if nslist is None:
+        async with sem:
+            answer = await dns.asyncresolver.resolve(zone,
+                                                     dns.rdatatype.NS)
+        nslist = nslist_from_response(answer.response)
+        CACHE.put(key, nslist, answer.expiration)
+    return nslist
+
+
+async def get_iplist_async(name, sem, settings=None):
+    """
+    Get IP address list for given name (asyncio version). The address
+    record types are queried concurrently.
+    """
+
+    if settings is None:
+        settings = Settings()
+
+    async def resolve_rrtype(rrtype):
+        key = (name, rrtype)
+        iplist = CACHE.get(key)
+        if iplist is None:
+            async with sem:
+                answer = await dns.asyncresolver.resolve(
+                    name, rrtype, raise_on_no_answer=False)
+            iplist = iplist_from_response(answer.response, rrtype)
+            CACHE.put(key, iplist, answer.expiration)
+        return iplist
+
+    iplists = await asyncio.gather(*[resolve_rrtype(rrtype)
+                                     for rrtype in settings.ip_rrtypes])
+    return [ipaddr for iplist in iplists for ipaddr in iplist]
+
+
+class TCPConnection:
+    """
+    Persistent DNS over TCP connection to a server address. Queries
+    are pipelined: they are written as soon as they are submitted,
+    and responses, which may arrive out of order, are matched to
+    queries by message ID.
+    """
+
+    def __init__(self, ipaddress, port=None):
+        self.ipaddress = ipaddress
+        self.port = PORT if port is None else port
+        self.reader = None
+        self.writer = None
+        self.read_task = None
+        self.pending = {}
+        self.lock = asyncio.Lock()
+        self.closed = False
+
+    async def connect(self, timeout=TIMEOUT):
+        """Open the connection, if not already open"""
+
+        async with self.lock:
+            if self.writer is not None:
+                return
+            try:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.ipaddress, self.port),
+                    timeout)
+            except asyncio.TimeoutError:
+                self.closed = True
+                raise dns.exception.Timeout
+            except OSError:
+                self.closed = True
+                raise
+            self.read_task = asyncio.ensure_future(self.read_responses())
+
+    async def read_responses(self):
+        """Read responses and hand them to the waiting queries"""
+
+        try:
+            while True:
+                length, = struct.unpack('!H',
+                                        await self.reader.readexactly(2))
+                wire = await self.reader.readexactly(length)
+                if length < 2:
+                    continue
+                msgid, = struct.unpack('!H', wire[:2])
+                future = self.pending.get(msgid)
+                if future is not None and not future.done():
+                    future.set_result(wire)
+        except (asyncio.IncompleteReadError, OSError) as exc_info:
+            error = exc_info
+        except asyncio.CancelledError:
+            error = ConnectionResetError("connection closed")
+        self.read_task = None
+        self.close()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionResetError(
+                    "connection to {} closed: {}".format(self.ipaddress,
+                                                         error)))
+
+    async def query(self, msg, timeout=TIMEOUT):
+        """Send query and return response message"""
+
+        await self.connect(timeout)
+        if self.closed:
+            raise ConnectionResetError("connection to {} closed".format(
+                self.ipaddress))
+        while msg.id in self.pending:
+            msg.id = dns.entropy.random_16()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[msg.id] = future
+        try:
+            wire = msg.to_wire()
+            self.writer.write(struct.pack('!H', len(wire)) + wire)
+            await self.writer.drain()
+            wire = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout
+        finally:
+            del self.pending[msg.id]
+        res = dns.message.from_wire(wire, keyring=msg.keyring,
+                                    request_mac=msg.mac)
+        if not msg.is_response(res):
+            raise dns.query.BadResponse
+        return res
+
+    def close(self):
+        """Close the connection"""
+
+        self.closed = True
+        if self.writer is not None:
+            self.writer.close()
+        if self.read_task is not None:
+            self.read_task.cancel()
+
+
+class TCPPool:
+    """Pool of persistent TCP connections, one per server address"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.connections = {}
+
+    def get_connection(self, ipaddress):
+        """Return open (or opening) connection to server address"""
+
+        conn = self.connections.get(ipaddress)
+        if conn is None or conn.closed:
+            conn = self.connections[ipaddress] = TCPConnection(ipaddress)
+        return conn
+
+    async def query(self, msg, ipaddress, timeout=TIMEOUT):
+        """
+        Send query over the pooled connection to given server address.
+        If the server had closed an idle connection, the query is
+        retried once over a new connection.
+        """
+
+        conn = self.get_connection(ipaddress)
+        reused = conn.writer is not None
+        try:
+            return await conn.query(msg, timeout)
+        except (ConnectionError, OSError):
+            if not reused:
+                raise
+        return await self.get_connection(ipaddress).query(msg, timeout)
+
+    def close(self):
+        """Close all connections"""
+
+        for conn in self.connections.values():
+            conn.close()
+        self.connections.clear()
+
+
+TCP_POOL = None
+
+
+def get_tcp_pool():
+    """Return TCP connection pool for the running event loop"""
+
+    global TCP_POOL
+    if TCP_POOL is None or TCP_POOL.loop is not asyncio.get_running_loop():
+        TCP_POOL = TCPPool()
+    return TCP_POOL
+
+
+def run_async(coroutine):
+    """
+    Run coroutine in a new event loop, closing any pooled TCP
+    connections before the loop goes away.
+    """
+
+    async def runner():
+        try:
+            return await coroutine
+        finally:
+            if TCP_POOL is not None and \
+               TCP_POOL.loop is asyncio.get_running_loop():
+                TCP_POOL.close()
+                await asyncio.sleep(0)
+
+    import_async()
+    return asyncio.run(runner())
+
+
+LOOP = None
+
+
+def run_persistent(coroutine):
+    """
+    Run coroutine in a module level event loop that is kept open
+    across calls, so that pooled TCP connections survive between
+    warm Lambda invocations.
+    """
+
+    global LOOP
+    import_async()
+    if LOOP is None or LOOP.is_closed():
+        LOOP = asyncio.new_event_loop()
+        atexit.register(close_persistent)
+    return LOOP.run_until_complete(coroutine)
+
+
+def close_persistent():
+    """Close pooled connections and the persistent event loop"""
+
+    if LOOP is None or LOOP.is_closed():
+        return
+    if TCP_POOL is not None and TCP_POOL.loop is LOOP:
+        TCP_POOL.close()
+    pending = asyncio.all_tasks(LOOP)
+    if pending:
+        LOOP.run_until_complete(asyncio.gather(*pending,
+                                               return_exceptions=True))
+    LOOP.close()
+
+
+def new_query_info():
+    """
+    Return initialized dictionary of per-server query measurements:
+    round trip time of the final exchange in milliseconds, number of
+    UDP attempts, whether TCP fallback happened, response size in
+    bytes, and the EDNS UDP payload size advertised by the server.
+    An "error" entry is added if the query fails with an error other
+    than a timeout.
+    """
+
+    return {
+        "rtt_ms": None,
+        "udp_attempts": 0,
+        "tcp": False,
+        "size": None,
+        "edns_payload": None,
+        "skipped": False,
+    }
+
+
+def record_response(info, res, elapsed):
+    """Record measurements of a received response in info dictionary"""
+
+    if info is None:
+        return
+    info['rtt_ms'] = round(elapsed * 1000.0, 3)
+    wire = getattr(res, 'wire', None)
+    info['size'] = len(wire) if wire else len(res.to_wire())
+    info['edns_payload'] = int(res.payload) if res.edns >= 0 else None
+
+
+def record_error(info, ipaddress, transport, exc_info):
+    """
+    Report a query that failed with an error other than a timeout
+    (e.g. ENETUNREACH for an IPv6 address on an IPv4 only host), and
+    record the error in info dictionary
+    """
+
+    print("WARN: {} query to {} failed: {}".format(transport, ipaddress,
+                                                   exc_info),
+          file=sys.stderr)
+    if info is not None:
+        info['error'] = str(exc_info) or type(exc_info).__name__
+
+
+def send_query_tcp(msg, ipaddress, timeout=TIMEOUT, info=None):
     """send DNS query over TCP to given IP address"""
 
     res = None
+    if info is not None:
+        info['tcp'] = True
     try:
-        res = dns.query.tcp(msg, ipaddress, timeout=timeout)
+        start = time.perf_counter()
+        res = dns.query.tcp(msg, ipaddress, timeout=timeout, port=PORT)
+        record_response(info, res, time.perf_counter() - start)
     except dns.exception.Timeout:
-        print("WARN: TCP query timeout for {}".format(ipaddress))
+        print("WARN: TCP query timeout for {}".format(ipaddress),
+              file=sys.stderr)
+    except OSError as exc_info:
+        record_error(info, ipaddress, "TCP", exc_info)
     return res
 
 
-def send_query_udp(msg, ipaddress, timeout=TIMEOUT, retries=RETRIES):
-    """send DNS query over UDP to given IP address"""
+def send_query_udp(msg, ipaddress, timeout=TIMEOUT, retries=RETRIES,
+                   info=None, server=None):
+    """
+    send DNS query over UDP to given IP address. If a ServerState
+    object is supplied, it is updated with the measured RTT or with
+    timeouts, and the timeout for each retry is taken from it.
+    """
 
     gotresponse = False
     res = None
     while (not gotresponse) and (retries > 0):
         retries -= 1
+        if info is not None:
+            info['udp_attempts'] += 1
         try:
-            res = dns.query.udp(msg, ipaddress, timeout=timeout)
+            start = time.perf_counter()
+            res = dns.query.udp(msg, ipaddress, timeout=timeout, port=PORT)
+            elapsed = time.perf_counter() - start
+            record_response(info, res, elapsed)
+            if server is not None:
+                server.add_sample(elapsed)
             gotresponse = True
         except dns.exception.Timeout:
-            print("WARN: UDP query timeout for {}".format(ipaddress))
+            print("WARN: UDP query timeout for {}".format(ipaddress),
+                  file=sys.stderr)
+            if server is not None:
+                server.add_timeout()
+                timeout = server.rto()
+        except OSError as exc_info:
+            record_error(info, ipaddress, "UDP", exc_info)
+            break
+    return res
+
+
+async def send_query_tcp_async(msg, ipaddress, sem, timeout=TIMEOUT,
+                               info=None):
+    """
+    send DNS query over TCP to given IP address (asyncio version).
+    The query is sent over a pooled persistent connection.
+    """
+
+    res = None
+    if info is not None:
+        info['tcp'] = True
+    try:
+        async with sem:
+            start = time.perf_counter()
+            res = await get_tcp_pool().query(msg, ipaddress,
+                                             timeout=timeout)
+            record_response(info, res, time.perf_counter() - start)
+    except dns.exception.Timeout:
+        print("WARN: TCP query timeout for {}".format(ipaddress),
+              file=sys.stderr)
+    except (OSError, dns.exception.DNSException) as exc_info:
+        record_error(info, ipaddress, "TCP", exc_info)
     return res
 
 
-def send_query(ipaddress, qname, qtype):
-    """Send DNS query"""
+async def send_query_udp_async(msg, ipaddress, sem,
+                               timeout=TIMEOUT, retries=RETRIES, info=None,
+                               server=None):
+    """send DNS query over UDP to given IP address (asyncio version)"""
 
+    gotresponse = False
     res = None
+    while (not gotresponse) and (retries > 0):
+        retries -= 1
+        if info is not None:
+            info['udp_attempts'] += 1
+        try:
+            async with sem:
+                start = time.perf_counter()
+                res = await dns.asyncquery.udp(msg, ipaddress,
+                                               timeout=timeout, port=PORT)
+                elapsed = time.perf_counter() - start
+            record_response(info, res, elapsed)
+            if server is not None:
+                server.add_sample(elapsed)
+            gotresponse = True
+        except dns.exception.Timeout:
+            print("WARN: UDP query timeout for {}".format(ipaddress),
+                  file=sys.stderr)
+            if server is not None:
+                server.add_timeout()
+                timeout = server.rto()
+        except OSError as exc_info:
+            record_error(info, ipaddress, "UDP", exc_info)
+            break
+    return res
+
+
+def make_query(qname, qtype, settings=None):
+    """Make non-recursive DNS query message, with NSID if using EDNS"""
+
+    if settings is None:
+        settings = Settings()
     msg = dns.message.make_query(qname, qtype)
     msg.flags &= ~dns.flags.RD
-    if EDNS:
+    if settings.edns:
         msg.use_edns(edns=0, payload=EDNS_UDP_ADV,
                      options=[dns.edns.GenericOption(dns.edns.NSID, b'')])
+    return msg
+
+
+def send_query(ipaddress, qname, qtype, info=None, settings=None):
+    """
+    Send DNS query. If an info dictionary (see new_query_info()) is
+    supplied, it is filled in with measurements of the query. The
+    UDP timeout and number of retries are taken from the server's
+    RTT estimator, and servers that are held down are not queried.
+    """
+
+    res = None
+    server = get_server_state(ipaddress)
+    if server.skipped():
+        if info is not None:
+            info['skipped'] = True
+        return res
+    msg = make_query(qname, qtype, settings)
     res = send_query_udp(msg, ipaddress,
-                         timeout=TIMEOUT, retries=RETRIES)
+                         timeout=server.rto(), retries=server.retries(),
+                         info=info, server=server)
+    if res and (res.flags & dns.flags.TC):
+        print("WARN: response was truncated; retrying with TCP ..",
+              file=sys.stderr)
+        res = send_query_tcp(msg, ipaddress, timeout=TIMEOUT, info=info)
+    if res is None:
+        server.failure()
+    else:
+        server.success()
+    return res
+
+
+async def send_query_async(ipaddress, qname, qtype, sem, info=None,
+                           settings=None):
+    """Send DNS query (asyncio version)"""
+
+    if settings is None:
+        settings = Settings()
+    res = None
+    server = get_server_state(ipaddress)
+    if server.skipped():
+        if info is not None:
+            info['skipped'] = True
+        return res
+    msg = make_query(qname, qtype, settings)
+    if settings.tcp_only:
+        res = await send_query_tcp_async(msg, ipaddress, sem,
+                                         timeout=TIMEOUT, info=info)
+    else:
+        res = await send_query_udp_async(msg, ipaddress, sem,
+                                         timeout=server.rto(),
+                                         retries=server.retries(),
+                                         info=info, server=server)
     if res and (res.flags & dns.flags.TC):
-        print("WARN: response was truncated; retrying with TCP ..")
-        return send_query_tcp(msg, ipaddress, timeout=TIMEOUT)
+        print("WARN: response was truncated; retrying with TCP ..",
+              file=sys.stderr)
+        res = await send_query_tcp_async(msg, ipaddress, sem,
+                                         timeout=TIMEOUT, info=info)
+    if res is None:
+        server.failure()
+    else:
+        server.success()
     return res
 
 
-def get_answer(ipaddress, qname, qtype):
+def parse_answer(msg, settings=None):
     """
-    Return list of answer rdata for query at given server address.
-    Also return rcode, and the value of the NSID option if present.
+    Return rcode, sorted list of answer rdata, and the value of the
+    NSID option if present, from given response message. If there
+    was no response, the rcode returned is None.
     """
 
-    answers = SortedList()
+    if settings is None:
+        settings = Settings()
+    answers = []
     nsid = None
 
-    msg = send_query(ipaddress, qname, qtype)
+    if msg is None:
+        return None, answers, nsid
 
-    if EDNS:
+    if settings.edns:
         for option in msg.options:
             if option.otype == dns.edns.NSID:
-                nsid = option.data.decode()
+                nsid = option.to_wire().decode()
 
     for rrset in msg.answer:
         for rdata in rrset:
-            answers.add(rdata.to_text())
-    return msg.rcode(), answers, nsid
+            answers.append(rdata.to_text())
+    return msg.rcode(), sorted(answers), nsid
 
 
-def main(zone, qname, qtype):
-    """main function, invoked by either command line or lambda"""
+def get_answer(ipaddress, qname, qtype, info=None, settings=None):
+    """
+    Return list of answer rdata for query at given server address.
+    Also return rcode, and the value of the NSID option if present.
+    """
+
+    msg = send_query(ipaddress, qname, qtype, info=info, settings=settings)
+    return parse_answer(msg, settings)
+
+
+async def get_answer_async(ipaddress, qname, qtype, sem, info=None,
+                           settings=None):
+    """get_answer() (asyncio version)"""
+
+    msg = await send_query_async(ipaddress, qname, qtype, sem, info=info,
+                                 settings=settings)
+    return parse_answer(msg, settings)
+
+
+def percentile(values, pct):
+    """Return nearest-rank percentile of sorted list of values"""
+
+    index = max(0, int(round(pct / 100.0 * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def latency_summary(answer_dicts):
+    """Return min/p50/p95/max RTT summary (in ms) of server answers"""
+
+    rtts = sorted(adict['rtt_ms'] for adict in answer_dicts
+                  if adict.get('rtt_ms') is not None)
+    summary = {
+        "servers": len(answer_dicts),
+        "responses": len(rtts),
+    }
+    if rtts:
+        summary['min'] = rtts[0]
+        summary['p50'] = percentile(rtts, 50)
+        summary['p95'] = percentile(rtts, 95)
+        summary['max'] = rtts[-1]
+    return summary
+
+
+def make_result(zone, qname, qtype):
+    """Return initialized result dictionary"""
 
     result = {}
     result['timestamp'] = time.time()
@@ -187,46 +921,219 @@ def main(zone, qname, qtype):
         "qtype": qtype
     }
     result['answer'] = []
+    return result
+
+
+def make_answer_dict(nsname, ipaddr, rcode, answers, nsid, info=None):
+    """Return result dictionary for a single server address"""
+
+    answer_dict = {}
+    answer_dict['name'] = nsname.to_text()
+    answer_dict['ip'] = ipaddr
+    if nsid:
+        answer_dict['nsid'] = nsid
+    if info is not None and info['skipped']:
+        answer_dict['rcode'] = "SKIPPED"
+    elif rcode is None and info is not None and 'error' in info:
+        answer_dict['rcode'] = "ERROR"
+    elif rcode is None:
+        answer_dict['rcode'] = "TIMEOUT"
+    else:
+        answer_dict['rcode'] = dns.rcode.to_text(rcode)
+    answer_dict['answers'] = ",".join(answers)
+    if info is not None:
+        answer_dict.update(info)
+    return answer_dict
+
+
+async def main_async(zone, qname, qtype, sem=None, settings=None):
+    """
+    Concurrent version of main(). Each nameserver's addresses are
+    queried as soon as they are resolved, and all server addresses
+    are queried at once, limited to CONCURRENCY queries in flight.
+    A semaphore may be passed in to share that limit with other
+    concurrent calls. Answers are returned in the same order as main().
+    """
+
+    import_async()
+    if sem is None:
+        sem = asyncio.Semaphore(CONCURRENCY)
+    if settings is None:
+        settings = Settings()
+    result = make_result(zone, qname, qtype)
+
+    async def query_server(nsname, ipaddr):
+        info = new_query_info()
+        rcode, answers, nsid = await get_answer_async(ipaddr, qname, qtype,
+                                                      sem, info=info,
+                                                      settings=settings)
+        return make_answer_dict(nsname, ipaddr, rcode, answers, nsid, info)
+
+    async def query_nsname(nsname):
+        iplist = await get_iplist_async(nsname, sem, settings)
+        return await asyncio.gather(*[query_server(nsname, ipaddr)
+                                      for ipaddr in iplist])
+
+    nslist = await get_nslist_async(zone, sem)
+    for answer_dicts in await asyncio.gather(*[query_nsname(nsname)
+                                               for nsname in nslist]):
+        result['answer'].extend(answer_dicts)
+    result['latency'] = latency_summary(result['answer'])
+    return result
+
+
+def main(zone, qname, qtype, settings=None):
+    """main function, invoked by either command line or lambda"""
+
+    if settings is None:
+        settings = Settings()
+    if settings.use_async:
+        return run_async(main_async(zone, qname, qtype, settings=settings))
+
+    result = make_result(zone, qname, qtype)
 
     nslist = get_nslist(zone)
     for nsname in nslist:
-        for ipaddr in get_iplist(nsname):
-            rcode, answers, nsid = get_answer(ipaddr, qname, qtype)
-            answers = ",".join(answers)
-            answer_dict = {}
-            answer_dict['name'] = nsname.to_text()
-            answer_dict['ip'] = ipaddr
-            if nsid:
-                answer_dict['nsid'] = nsid
-            answer_dict['rcode'] = dns.rcode.to_text(rcode)
-            answer_dict['answers'] = answers
-            result['answer'].append(answer_dict)
+        for ipaddr in get_iplist(nsname, settings):
+            info = new_query_info()
+            rcode, answers, nsid = get_answer(ipaddr, qname, qtype,
+                                              info=info, settings=settings)
+            result['answer'].append(
+                make_answer_dict(nsname, ipaddr, rcode, answers, nsid, info))
+    result['latency'] = latency_summary(result['answer'])
     return result
 
 
-def lambda_handler(event, context):
-    """AWS Lambda function to return results"""
+def read_batch(infile):
+    """Yield (zone, qname, qtype) tuples from JSON lines input"""
+
+    for lineno, line in enumerate(infile, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            item = json.loads(line)
+            if isinstance(item, dict):
+                yield item['zone'], item['qname'], item['qtype']
+            else:
+                zone, qname, qtype = item
+                yield zone, qname, qtype
+        except (ValueError, KeyError, TypeError) as exc_info:
+            print("WARN: input line {}: invalid query: {}".format(
+                lineno, exc_info), file=sys.stderr)
+
+
+def make_error_result(zone, qname, qtype, exc_info):
+    """Return result dictionary for a query that failed"""
+
+    result = make_result(zone, qname, qtype)
+    del result['answer']
+    result['error'] = "{}: {}".format(type(exc_info).__name__, exc_info)
+    return result
+
+
+def run_batch(infile, outfile=sys.stdout):
+    """
+    Run main() for every query tuple read from infile, writing each
+    result as a JSON line to outfile as soon as it is available. NS
+    and address lookups are shared across queries via the cache.
+    Returns a summary dictionary, including cache statistics.
+    """
+
+    if ASYNC:
+        return run_async(run_batch_async(infile, outfile))
+
+    count = 0
+    errors = 0
+    start = time.time()
+    for zone, qname, qtype in read_batch(infile):
+        count += 1
+        try:
+            result = main(zone, qname, qtype)
+        except dns.exception.DNSException as exc_info:
+            errors += 1
+            result = make_error_result(zone, qname, qtype, exc_info)
+        print(json.dumps(result), file=outfile, flush=True)
 
-    global EDNS, IP_RRTYPES
+    return batch_summary(count, errors, start)
 
-    # Lambda still doesn't support IPv6, sigh ..
-    IP_RRTYPES = [dns.rdatatype.A]
+
+async def run_batch_async(infile, outfile=sys.stdout):
+    """
+    run_batch() (asyncio version). All queries are run in the same
+    event loop, so pooled TCP connections are reused across them.
+    """
+
+    count = 0
+    errors = 0
+    start = time.time()
+    for zone, qname, qtype in read_batch(infile):
+        count += 1
+        try:
+            result = await main_async(zone, qname, qtype)
+        except dns.exception.DNSException as exc_info:
+            errors += 1
+            result = make_error_result(zone, qname, qtype, exc_info)
+        print(json.dumps(result), file=outfile, flush=True)
+
+    return batch_summary(count, errors, start)
+
+
+def batch_summary(count, errors, start):
+    """Return summary dictionary for a batch run"""
+
+    return {
+        "queries": count,
+        "errors": errors,
+        "elapsed": round(time.time() - start, 3),
+        "cache": CACHE.stats(),
+        "servers": {
+            "tracked": len(SERVERS),
+            "held_down": sum(1 for state in SERVERS.values()
+                             if state.skipped()),
+        },
+    }
+
+
+def lambda_handler(event, context):
+    """
+    AWS Lambda function to return results. Settings are passed per
+    call rather than through the module globals. The NS/address cache,
+    server RTT estimators, and (in async mode) the event loop with
+    its pooled TCP connections live at module scope, so they are
+    reused across warm invocations.
+    """
 
     print("Received event: " + json.dumps(event, indent=2))
 
     _ = context
-    if "edns" in event:
-        EDNS = event['edns']
+    settings = Settings(edns=event.get('edns'),
+                        # Lambda still doesn't support IPv6, sigh ..
+                        ip_rrtypes=[dns.rdatatype.A],
+                        use_async=event.get('async'),
+                        tcp_only=event.get('tcp'))
     zone = event['zone']
     qname = event['qname']
     qtype = event['qtype']
-    response = main(zone, qname, qtype)
-    return response
+    if settings.use_async:
+        return run_persistent(main_async(zone, qname, qtype,
+                                         settings=settings))
+    return main(zone, qname, qtype, settings=settings)
 
 
 if __name__ == '__main__':
 
-    ZONE, QNAME, QTYPE = process_args(sys.argv[1:])
+    ARGS = process_args(sys.argv[1:])
+    if BATCH is not None:
+        if BATCH == '-':
+            SUMMARY = run_batch(sys.stdin)
+        else:
+            with open(BATCH, 'r') as INFILE:
+                SUMMARY = run_batch(INFILE)
+        print(json.dumps({"summary": SUMMARY}), file=sys.stderr)
+        sys.exit(0)
+
+    ZONE, QNAME, QTYPE = ARGS
     RESULT = main(ZONE, QNAME, QTYPE)
     if JSON:
         print(json.dumps(RESULT))
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+#
+
+"""
+Track propagation of a new SOA serial to all nameserver addresses
+of a zone.
+
+All server addresses are polled in parallel until each one serves
+the target serial (or, if no target is given, any serial newer than
+the baseline). Without either, if the first poll finds servers on
+different serials, the push is taken to be under way, and the highest
+serial seen is the target; otherwise that serial is the baseline. The
+convergence time of each server and of the zone
+as a whole is recorded, along with a timeline of every serial change
+observed, and printed as JSON. Optionally a plot of the propagation
+is written to a file.
+
+Servers that have converged continue to be polled, with exponentially
+increasing intervals, so that regressions are still noticed while
+the remaining servers catch up.
+
+"""
+
+import os
+import sys
+import getopt
+import json
+import time
+import asyncio
+import dns.asyncquery
+import dns.exception
+import dns.flags
+import dns.rdatatype
+
+import query_all_authservers as qa
+
+
+PROGNAME = os.path.basename(sys.argv[0])
+VERSION = "0.0.1"
+
+POLL_INTERVAL = 1.0
+MAX_INTERVAL = 30.0
+MAX_WAIT = 600.0
+
+
+# Options with initialized defaults
+class Opts:
+    target = None
+    baseline = None
+    plotfile = None
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+
+    print("""\
+{0} version {1}
+Usage: {0} [Options] <zone>
+
+       Options:
+       -h          Print this help string
+       -4          Use IPv4 transport only
+       -6          Use IPv6 transport only
+       -t          Use TCP only, over persistent connections
+       -s serial   Target serial to wait for
+       -b serial   Baseline serial; wait for any newer serial (default
+                   is the serial seen in the first poll, or if servers
+                   differ, the highest one seen is the target)
+       -i secs     Poll interval (default {2})
+       -m secs     Maximum poll interval for converged servers ({3})
+       -w secs     Give up after this long (default {4})
+       -p file     Write plot of propagation timeline to file
+""".format(PROGNAME, VERSION, POLL_INTERVAL, MAX_INTERVAL, MAX_WAIT))
+    sys.exit(4)
+
+
+def process_args(arg_vector):
+    """Process command line options and arguments"""
+
+    global POLL_INTERVAL, MAX_INTERVAL, MAX_WAIT
+
+    try:
+        (options, args) = getopt.getopt(arg_vector, 'h46ts:b:i:m:w:p:')
+    except getopt.GetoptError as exc_info:
+        usage("{}".format(exc_info))
+
+    try:
+        for (opt, optval) in options:
+            if opt == "-h":
+                usage()
+            elif opt == "-4":
+                qa.IP_RRTYPES = [dns.rdatatype.A]
+            elif opt == "-6":
+                qa.IP_RRTYPES = [dns.rdatatype.AAAA]
+            elif opt == "-t":
+                qa.TCP_ONLY = True
+            elif opt == "-s":
+                Opts.target = int(optval)
+            elif opt == "-b":
+                Opts.baseline = int(optval)
+            elif opt == "-i":
+                POLL_INTERVAL = float(optval)
+            elif opt == "-m":
+                MAX_INTERVAL = float(optval)
+            elif opt == "-w":
+                MAX_WAIT = float(optval)
+            elif opt == "-p":
+                Opts.plotfile = optval
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
+
+    if len(args) != 1:
+        usage("Missing zone argument")
+    return args[0]
+
+
+def serial_gt(serial1, serial2):
+    """Return True if serial1 is greater than serial2 (RFC 1982)"""
+
+    return serial1 != serial2 and \
+        ((serial1 - serial2) % 2**32) < 2**31
+
+
+def serial_reached(serial, target, baseline):
+    """Return True if serial has reached the target or passed baseline"""
+
+    if serial is None:
+        return False
+    if target is not None:
+        return serial == target or serial_gt(serial, target)
+    return serial_gt(serial, baseline)
+
+
+async def get_serial(ipaddress, zone, sem):
+    """
+    Return SOA serial served by given server address, or None. Every
+    poll sends a single query, over UDP with TCP fallback on truncation
+    (or TCP only), bypassing the server holddown of send_query_async(),
+    so that a server that recovers is seen at its next poll.
+    """
+
+    query = qa.make_query(zone, dns.rdatatype.SOA)
+    msg = None
+    if not qa.TCP_ONLY:
+        try:
+            async with sem:
+                msg = await dns.asyncquery.udp(query, ipaddress,
+                                               timeout=qa.TIMEOUT,
+                                               port=qa.PORT)
+        except (OSError, dns.exception.DNSException):
+            return None
+    if msg is None or msg.flags & dns.flags.TC:
+        msg = await qa.send_query_tcp_async(query, ipaddress, sem,
+                                            timeout=qa.TIMEOUT)
+    if msg is None:
+        return None
+    for rrset in msg.answer:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return rrset[0].serial
+    return None
+
+
+class ServerTracker:
+    """Serial observations and convergence state for a server address"""
+
+    def __init__(self, nsname, ipaddress):
+        self.nsname = nsname
+        self.ipaddress = ipaddress
+        self.serial = None
+        self.converged_at = None
+        self.polls = 0
+        self.interval = POLL_INTERVAL
+
+    def as_dict(self):
+        """Return dictionary summary of server state"""
+
+        return {
+            "name": self.nsname.to_text(),
+            "ip": self.ipaddress,
+            "serial": self.serial,
+            "converged_after": self.converged_at,
+            "polls": self.polls,
+        }
+
+
+class Tracker:
+    """Propagation state across all server addresses of a zone"""
+
+    def __init__(self, zone, target, baseline):
+        self.zone = zone
+        self.target = target
+        self.baseline = baseline
+        self.start = time.time()
+        self.servers = []
+        self.timeline = []
+        self.done = None
+
+    def elapsed(self):
+        """Return seconds since tracking started"""
+
+        return round(time.time() - self.start, 3)
+
+    def record(self, server, serial):
+        """Record serial observed at server, returning True if converged"""
+
+        if serial != server.serial:
+            server.serial = serial
+            self.timeline.append({
+                "time": self.elapsed(),
+                "name": server.nsname.to_text(),
+                "ip": server.ipaddress,
+                "serial": serial,
+            })
+        if serial_reached(serial, self.target, self.baseline):
+            if server.converged_at is None:
+                server.converged_at = self.elapsed()
+            return True
+        server.converged_at = None
+        return False
+
+    def converged(self):
+        """Return True if all servers have converged"""
+
+        return all(server.converged_at is not None
+                   for server in self.servers)
+
+    def result(self):
+        """Return result dictionary"""
+
+        times = [server.converged_at for server in self.servers]
+        return {
+            "zone": self.zone,
+            "target": self.target,
+            "baseline": self.baseline,
+            "timestamp": self.start,
+            "converged": self.converged(),
+            "overall": max(times) if times and self.converged() else None,
+            "servers": [server.as_dict() for server in self.servers],
+            "timeline": self.timeline,
+        }
+
+
+async def poll_server(tracker, server, sem):
+    """
+    Poll a server until all servers have converged. Converged servers
+    back off their poll interval exponentially up to MAX_INTERVAL.
+    """
+
+    while not tracker.done.is_set():
+        server.polls += 1
+        serial = await get_serial(server.ipaddress, tracker.zone, sem)
+        if tracker.record(server, serial):
+            server.interval = min(server.interval * 2, MAX_INTERVAL)
+            if tracker.converged():
+                tracker.done.set()
+                return
+        else:
+            server.interval = POLL_INTERVAL
+        try:
+            await asyncio.wait_for(tracker.done.wait(), server.interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def track(zone, target=None, baseline=None):
+    """Track propagation of SOA serial to all server addresses of zone"""
+
+    sem = asyncio.Semaphore(qa.CONCURRENCY)
+    tracker = Tracker(zone, target, baseline)
+    tracker.done = asyncio.Event()
+
+    nslist = await qa.get_nslist_async(zone, sem)
+    iplists = await asyncio.gather(*[qa.get_iplist_async(nsname, sem)
+                                     for nsname in nslist])
+    for nsname, iplist in zip(nslist, iplists):
+        for ipaddress in iplist:
+            tracker.servers.append(ServerTracker(nsname, ipaddress))
+    # Convergence times are measured from here, not including the time
+    # taken to look up the nameservers and their addresses
+    tracker.start = time.time()
+
+    if target is None and baseline is None:
+        serials = await asyncio.gather(*[get_serial(server.ipaddress,
+                                                    zone, sem)
+                                         for server in tracker.servers])
+        serials = [serial for serial in serials if serial is not None]
+        if not serials:
+            raise dns.exception.DNSException(
+                "no server returned an SOA serial for {}".format(zone))
+        highest = serials[0]
+        for serial in serials[1:]:
+            if serial_gt(serial, highest):
+                highest = serial
+        # With mixed serials, the new serial has already reached some
+        # servers, so track the lagging servers towards it
+        if any(serial != highest for serial in serials):
+            tracker.target = highest
+        else:
+            tracker.baseline = highest
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*[poll_server(tracker, server, sem)
+                             for server in tracker.servers]),
+            MAX_WAIT)
+    except asyncio.TimeoutError:
+        pass
+    return tracker.result()
+
+
+def plot_timeline(result, outfile):
+    """Plot number of converged servers against time"""
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    times = sorted(server['converged_after'] for server in result['servers']
+                   if server['converged_after'] is not None)
+    total = len(result['servers'])
+    plt.step([0] + times, range(0, len(times) + 1), where='post')
+    plt.axis([0, max(times + [1.0]) * 1.10, 0, total * 1.10])
+    plt.title("SOA serial propagation for {}".format(result['zone']))
+    plt.xlabel('Time (seconds)')
+    plt.ylabel('Server addresses converged (of {})'.format(total))
+    plt.savefig(outfile, dpi=150)
+    print("Plot output saved in {}".format(outfile), file=sys.stderr)
+
+
+if __name__ == '__main__':
+
+    ZONE = process_args(sys.argv[1:])
+    try:
+        RESULT = qa.run_async(track(ZONE, Opts.target, Opts.baseline))
+    except dns.exception.DNSException as exc_info:
+        print("ERROR: {}".format(exc_info))
+        sys.exit(3)
+    print(json.dumps(RESULT, indent=2))
+    if Opts.plotfile:
+        plot_timeline(RESULT, Opts.plotfile)
+    sys.exit(0 if RESULT['converged'] else 1)
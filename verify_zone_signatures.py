@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+#
+
+"""
+Verify all DNSSEC signatures of a signed zone, read from a zone file
+in presentation format (one RR per line, as output by dig AXFR or
+named-compilezone), or transferred from a server by AXFR.
+
+The zone is streamed: consecutive records with the same owner name
+are grouped, and batches of whole owner groups are verified by a pool
+of worker processes, so the zone is never held in memory. The zone's
+DNSKEYs are taken from the apex, which must come first (as the SOA
+does in a transfer). Each worker decodes the keys once, indexed by
+key tag and algorithm (see dnskeyrdata.py), and reuses the decoded
+key objects for all its signatures.
+
+Every signature is classified as valid, invalid (it doesn't verify,
+or the RRset it covers is missing), expired, not yet valid, or made
+by an unknown key. Counts of each, the problem signatures, and the
+throughput in signatures per second are reported.
+
+"""
+
+import os
+import sys
+import getopt
+import time
+import itertools
+import base64
+import binascii
+from collections import deque
+from multiprocessing import Pool
+from cryptography.exceptions import InvalidSignature
+import dns.dnssec
+import dns.exception
+import dns.name
+import dns.query
+import dns.rdata
+import dns.rdataclass
+import dns.rdataset
+import dns.rdatatype
+import dns.rrset
+from dns.rdtypes.ANY.RRSIG import RRSIG, sigtime_to_posixtime
+
+# dnspython's private signed data construction, used so that the keys
+# need only be decoded once. Should a dnspython release change or drop
+# it, the public validate_rrsig() is used instead, which is slower.
+try:
+    from dns.dnssec import _make_rrsig_signature_data
+except ImportError:
+    _make_rrsig_signature_data = None
+
+import dnskeyrdata
+from zonelines import split_record, owner_groups
+
+
+PROGNAME = os.path.basename(sys.argv[0])
+
+BATCH_LINES = 5000
+MAX_PROBLEMS = 20
+XFR_TIMEOUT = 30
+RESULTS = ("valid", "invalid", "expired", "not yet valid", "unknown key")
+
+
+# Options with initialized defaults
+class Opts:
+    infile = None
+    server = None
+    port = 53
+    zone = None
+    workers = os.cpu_count() or 1
+    problems = MAX_PROBLEMS
+    at_time = None
+
+
+def usage(msg=None):
+    """Print usage string and terminate program."""
+
+    if msg:
+        print(msg)
+    print("""\
+Usage: {0} [Options] -f <zonefile|->
+       {0} [Options] -s <server> -z <zone>
+
+       Options:
+       -h          Print this help string
+       -f file     Read zone from file ("-" for stdin)
+       -s server   Transfer zone by AXFR from server (addr[#port])
+       -z zone     Zone name (default: owner name of first record)
+       -w N        Worker processes (default {1})
+       -n N        Number of problem signatures to list (default {2})
+       -t time     Check validity at this time (seconds since the epoch)
+""".format(PROGNAME, Opts.workers, MAX_PROBLEMS))
+    sys.exit(2)
+
+
+def process_args(arguments):
+    """Process command line arguments"""
+
+    try:
+        (options, args) = getopt.getopt(arguments, "hf:s:z:w:n:t:")
+    except getopt.GetoptError as exc_info:
+        usage(exc_info)
+
+    try:
+        for (opt, optval) in options:
+            if opt == "-h":
+                usage()
+            elif opt == "-f":
+                Opts.infile = optval
+            elif opt == "-s":
+                Opts.server, _, port = optval.partition('#')
+                if port:
+                    Opts.port = int(port)
+            elif opt == "-z":
+                Opts.zone = optval
+            elif opt == "-w":
+                Opts.workers = int(optval)
+            elif opt == "-n":
+                Opts.problems = int(optval)
+            elif opt == "-t":
+                Opts.at_time = float(optval)
+    except ValueError as exc_info:
+        usage("Invalid option value: {}".format(exc_info))
+
+    if args:
+        usage("Too many arguments")
+    if (Opts.infile is None) == (Opts.server is None):
+        usage("Either a zone file or a server must be given")
+    if Opts.server is not None and Opts.zone is None:
+        usage("Zone name required for transfer")
+    if Opts.workers < 1:
+        usage("Number of workers must be at least 1")
+
+
+# Per worker process state, set by init_worker(): the zone origin, the
+# zone's decoded keys indexed by (key tag, algorithm), the DNSKEY
+# rdataset by owner (for validate_rrsig()), the time at which to check
+# validity periods, and the number of problems to return.
+ORIGIN = None
+KEYS = {}
+KEYSET = {}
+NOW = None
+PROBLEMS = MAX_PROBLEMS
+
+
+def init_worker(origin, dnskeys, now, problems=MAX_PROBLEMS):
+    """Set up worker state, decoding the DNSKEYs (rdata text) once"""
+    global ORIGIN, KEYS, KEYSET, NOW, PROBLEMS
+    ORIGIN = dns.name.from_text(origin)
+    rdatas = [dnskeyrdata.decode_dnskey(text) for text in dnskeys]
+    KEYS = dnskeyrdata.index_keys(rdatas)
+    KEYSET = {ORIGIN: dns.rdataset.from_rdata_list(0, rdatas)}
+    NOW = now
+    PROBLEMS = problems
+
+
+def check_signature(rrset, rrsig):
+    """Return result of verifying RRSIG rdata over RRset (or None)"""
+    keys = KEYS.get((rrsig.key_tag, rrsig.algorithm)) \
+        if rrsig.signer == ORIGIN else None
+    if not keys:
+        return "unknown key"
+    if rrsig.expiration < NOW:
+        return "expired"
+    if rrsig.inception > NOW:
+        return "not yet valid"
+    if rrset is None:
+        return "invalid"
+    if _make_rrsig_signature_data is None:
+        try:
+            dns.dnssec.validate_rrsig(rrset, rrsig, KEYSET, ORIGIN, NOW,
+                                      dns.dnssec.allow_all_policy)
+            return "valid"
+        except (dns.dnssec.ValidationFailure,
+                dns.dnssec.UnsupportedAlgorithm):
+            return "invalid"
+    # dnspython's validate_rrsig() would decode the key for every
+    # signature, so only its signed data construction is used
+    try:
+        data = _make_rrsig_signature_data(rrset, rrsig, ORIGIN)
+    except dns.dnssec.ValidationFailure:
+        return "invalid"
+    for key in keys:
+        try:
+            key.verify(rrsig.signature, data)
+            return "valid"
+        except (InvalidSignature, dns.dnssec.ValidationFailure):
+            continue
+    return "invalid"
+
+
+def parse_rrsig(text, names):
+    """
+    Return RRSIG rdata from its text, splitting the fields directly
+    rather than with dnspython's tokenizer, which dominates the cost
+    of parsing a zone. Signer names are looked up in the names cache.
+    """
+    fields = text.split()
+    signer = names.get(fields[7])
+    if signer is None:
+        signer = names[fields[7]] = dns.name.from_text(fields[7], ORIGIN)
+    return RRSIG(dns.rdataclass.IN, dns.rdatatype.RRSIG,
+                 dns.rdatatype.from_text(fields[0]), int(fields[1]),
+                 int(fields[2]), int(fields[3]),
+                 sigtime_to_posixtime(fields[4]),
+                 sigtime_to_posixtime(fields[5]), int(fields[6]), signer,
+                 base64.b64decode("".join(fields[8:])))
+
+
+def verify_batch(lines):
+    """
+    Verify the signatures in a batch of zone lines, made up of whole
+    owner name groups. Runs in worker processes. Returns counts of
+    results, a list of up to PROBLEMS (result, owner, covered type,
+    key tag) problem signatures, and the number of unparsable lines.
+    """
+    rrsets = {}
+    rrsigs = []
+    names = {}
+    bad = 0
+    owner = name = None
+    for line in lines:
+        record = split_record(line)
+        if record is None:
+            continue
+        try:
+            if record[0] != owner:
+                owner = record[0]
+                name = dns.name.from_text(owner, ORIGIN)
+            if record[1] == "RRSIG":
+                try:
+                    rrsigs.append((name, parse_rrsig(record[2], names)))
+                    continue
+                except (IndexError, binascii.Error):
+                    pass
+            rdtype = dns.rdatatype.from_text(record[1])
+            rdata = dns.rdata.from_text(dns.rdataclass.IN, rdtype,
+                                        record[2], origin=ORIGIN,
+                                        relativize=False)
+        except (dns.exception.DNSException, ValueError):
+            owner = None
+            bad += 1
+            continue
+        if rdtype == dns.rdatatype.RRSIG:
+            rrsigs.append((name, rdata))
+        else:
+            key = (name, rdtype)
+            if key not in rrsets:
+                rrsets[key] = dns.rrset.RRset(name, dns.rdataclass.IN, rdtype)
+            rrsets[key].add(rdata)
+
+    counts = dict.fromkeys(RESULTS, 0)
+    problems = []
+    for name, rrsig in rrsigs:
+        result = check_signature(rrsets.get((name, rrsig.type_covered)),
+                                 rrsig)
+        counts[result] += 1
+        if result != "valid" and len(problems) < PROBLEMS:
+            problems.append((result, name.to_text(),
+                             dns.rdatatype.to_text(rrsig.type_covered),
+                             rrsig.key_tag))
+    return counts, problems, bad
+
+
+def batches(groups, size=BATCH_LINES):
+    """Generate batches of about size lines, of whole owner groups"""
+    batch = []
+    for group in groups:
+        batch.extend(group)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def transfer_lines(server, zone, port=53):
+    """Generate RR lines of a zone transfer as the messages arrive"""
+    for message in dns.query.xfr(server, zone, port=port,
+                                 timeout=XFR_TIMEOUT, relativize=False):
+        for rrset in message.answer:
+            yield from rrset.to_text().split('\n')
+
+
+class Report:
+    """Merged verification results"""
+
+    def __init__(self, max_problems=MAX_PROBLEMS):
+        self.counts = dict.fromkeys(RESULTS, 0)
+        self.problems = []
+        self.max_problems = max_problems
+        self.bad = 0
+
+    def add(self, result):
+        counts, problems, bad = result
+        for name, count in counts.items():
+            self.counts[name] += count
+        self.problems.extend(problems[:self.max_problems -
+                                      len(self.problems)])
+        self.bad += bad
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+def verify_zone(lines, workers, zone=None, now=None, report=None):
+    """
+    Verify all signatures of the zone given by its RR lines, with a
+    pool of worker processes. At most a few batches per worker are
+    queued at a time, so the zone is read as fast as it is verified.
+    Returns the Report, the zone origin and its number of DNSKEYs.
+    """
+    if now is None:
+        now = time.time()
+    if report is None:
+        report = Report()
+    groups = owner_groups(lines)
+    apex = next(groups, [])
+    records = [r for r in map(split_record, apex) if r is not None]
+    if zone is None:
+        zone = records[0][0] if records else "."
+    origin = dns.name.from_text(zone)
+    dnskeys = [text for owner, rdtype, text in records
+               if rdtype == "DNSKEY" and
+               dns.name.from_text(owner, origin) == origin]
+    work = batches(itertools.chain([apex], groups))
+    initargs = (origin.to_text(), dnskeys, now, report.max_problems)
+
+    if workers == 1:
+        init_worker(*initargs)
+        for batch in work:
+            report.add(verify_batch(batch))
+        return report, origin, len(dnskeys)
+
+    with Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+        window = deque()
+        for batch in work:
+            window.append(pool.apply_async(verify_batch, (batch,)))
+            if len(window) >= workers * 4:
+                report.add(window.popleft().get())
+        while window:
+            report.add(window.popleft().get())
+    return report, origin, len(dnskeys)
+
+
+def print_report(report, origin, keycount, elapsed, workers):
+    """Print verification results"""
+    total = report.total()
+    print("Zone {}: {} signatures, {} DNSKEYs, verified in {:.2f}s "
+          "({:.0f} signatures/s, {} workers)".format(
+              origin, total, keycount, elapsed,
+              total / elapsed if elapsed else 0, workers))
+    for name in RESULTS:
+        print("  {:<14} {:>12}".format(name, report.counts[name]))
+    if report.bad:
+        print("WARN: {} records could not be parsed".format(report.bad))
+    if report.problems:
+        print("\nProblem signatures (first {}):".format(len(report.problems)))
+        for result, owner, covered, keytag in report.problems:
+            print("  {:<14} {} {} keytag {}".format(result, owner, covered,
+                                                   keytag))
+
+
+if __name__ == '__main__':
+
+    process_args(sys.argv[1:])
+
+    if Opts.server is not None:
+        LINES = transfer_lines(Opts.server, Opts.zone, Opts.port)
+    elif Opts.infile == "-":
+        LINES = sys.stdin
+    else:
+        LINES = open(Opts.infile)
+
+    start = time.perf_counter()
+    try:
+        report, origin, keycount = verify_zone(
+            LINES, Opts.workers, Opts.zone, Opts.at_time,
+            Report(Opts.problems))
+    except (dns.exception.DNSException, OSError, EOFError) as e:
+        print("ERROR: {}".format(e), file=sys.stderr)
+        sys.exit(2)
+    elapsed = time.perf_counter() - start
+
+    print_report(report, origin, keycount, elapsed, Opts.workers)
+    sys.exit(0 if report.counts["valid"] == report.total() else 1)
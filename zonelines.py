@@ -0,0 +1,62 @@
+"""
+Helpers for streaming zones in presentation format, one RR per line
+(as output by dig AXFR or named-compilezone), shared by
+verify_zone_signatures.py, length_domainname.py, nsecbitmap.py and
+plot-rrsig-expirations.py.
+
+"""
+
+CLASSES = ("IN", "CH", "HS")
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def split_record(line):
+    """
+    Return (owner, type, rdata text) of a presentation format RR line,
+    skipping over TTL and class, or None for blank and comment lines,
+    directives and continuation lines.
+    """
+    if not line or line[0] in " \t\r\n;$":
+        return None
+    fields = line.split(None, 1)
+    owner, rest = fields[0], fields[1] if len(fields) > 1 else ""
+    parts = rest.split(None, 1)
+    while parts and (parts[0].isdigit() or parts[0].upper() in CLASSES):
+        parts = parts[1].split(None, 1) if len(parts) > 1 else []
+    if not parts:
+        return None
+    return owner, parts[0].upper(), parts[1].strip() if len(parts) > 1 \
+        else ""
+
+
+def owner_groups(lines):
+    """Generate lists of consecutive RR lines with the same owner name"""
+    group, owner = [], None
+    for line in lines:
+        if not line or line[0] in " \t\r\n;$":
+            continue
+        name = line.split(None, 1)[0].lower()
+        if name != owner and group:
+            yield group
+            group = []
+        owner = name
+        group.append(line)
+    if group:
+        yield group
+
+
+def read_chunks(infile, chunk_size=CHUNK_SIZE):
+    """Generate chunks of whole lines from a binary input stream"""
+    remainder = b""
+    while True:
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            break
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            remainder += chunk
+            continue
+        yield remainder + chunk[:end]
+        remainder = chunk[end:]
+    if remainder:
+        yield remainder + b"\n"